@@ -1,12 +1,237 @@
-from rest_framework_simplejwt.tokens import RefreshToken
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework_simplejwt.tokens import RefreshToken, AccessToken, UntypedToken
+from rest_framework_simplejwt.exceptions import TokenError
+
+from Aplicaciones.incidentes.realtime import enviar_control, al_recibir_control
+
+
+logger = logging.getLogger(__name__)
+
 
 def generar_tokens(user):
     refresh = RefreshToken.for_user(user)
 
     refresh["role"] = user.perfil.rol
     refresh["email"] = user.email
+    refresh["username"] = user.username
+
+    # sesión: se copia a cada access token para poder revocarla en el logout
+    refresh["sid"] = refresh["jti"]
 
     return {
         "access": str(refresh.access_token),
         "refresh": str(refresh)
     }
+
+
+# =========================
+# TOKENS VERIFICADOS (handshake WS)
+# =========================
+
+class TokensVerificados:
+    '''
+    LRU con TTL de access tokens ya verificados, por jti. Una reconexión
+    masiva no repite la verificación de firma y nunca toca la base de
+    datos: el usuario sale de los claims.
+
+    Las revocaciones (logout, usuario desactivado o con otro rol) se
+    aplican aquí y se propagan a los demás procesos por el grupo de
+    control. También quedan en la caché compartida mientras vive un
+    access token: un token que no está en el LRU se contrasta con ella,
+    así un proceso que arrancó después de la revocación también la ve.
+    '''
+
+    def __init__(self, tamano, ttl):
+        self.tamano = tamano
+        self.ttl = ttl
+        self.entradas = OrderedDict()       # jti -> (huella, claims, vence)
+        self.usuarios_revocados = {}        # user_id -> tokens emitidos hasta (iat)
+        self.sesiones_revocadas = {}        # sid -> hasta cuándo recordarla
+        self.lock = threading.Lock()
+
+    def en_cache(self, token):
+        '''
+        Claims del token si ya está verificado en el LRU, o None.
+        '''
+        huella = hashlib.sha256(token.encode()).digest()
+
+        # jti sin verificar: solo sirve de clave, la huella confirma el token
+        jti = UntypedToken(token, verify=False).get("jti")
+
+        with self.lock:
+            entrada = self.entradas.get(jti)
+            if entrada and entrada[0] == huella and entrada[2] > time.time():
+                self.entradas.move_to_end(jti)
+                return entrada[1]
+
+        return None
+
+    def verificar(self, token):
+        '''
+        Claims del token o TokenError si es inválido, expiró o fue revocado.
+        '''
+        ahora = time.time()
+        huella = hashlib.sha256(token.encode()).digest()
+
+        claims = self.en_cache(token)
+
+        if claims is None:
+            claims = AccessToken(token).payload
+
+            # antes de guardarlo: un token revocado no entra al LRU
+            self.leer_revocaciones(claims)
+            if self.revocado(claims):
+                raise TokenError("Token revocado")
+
+            vence = min(claims["exp"], ahora + self.ttl)
+
+            with self.lock:
+                self.entradas[claims["jti"]] = (huella, claims, vence)
+                self.entradas.move_to_end(claims["jti"])
+                while len(self.entradas) > self.tamano:
+                    self.entradas.popitem(last=False)
+
+        if self.revocado(claims):
+            raise TokenError("Token revocado")
+
+        return claims
+
+    async def averificar(self, token):
+        '''
+        verificar() desde el event loop. Un acierto del LRU se resuelve
+        aquí; un fallo (firma + caché compartida, bloqueantes) va a un hilo
+        para no frenar a los demás sockets en una reconexión masiva.
+        '''
+        claims = self.en_cache(token)
+
+        if claims is None:
+            return await sync_to_async(self.verificar, thread_sensitive=False)(token)
+
+        if self.revocado(claims):
+            raise TokenError("Token revocado")
+
+        return claims
+
+    def leer_revocaciones(self, claims):
+        '''
+        Trae de la caché compartida las revocaciones que afectan al token.
+        '''
+        clave_usuario = clave_revocacion("usuario", claims.get("user_id"))
+        clave_sesion = clave_revocacion("sesion", claims.get("sid"))
+
+        claves = [clave_usuario]
+        if claims.get("sid"):
+            claves.append(clave_sesion)
+
+        try:
+            revocadas = cache.get_many(claves)
+        except Exception:
+            # sin caché quedan las revocaciones recibidas por el grupo de control
+            logger.exception("No se pudieron leer las revocaciones de tokens")
+            return
+
+        if clave_usuario in revocadas:
+            self.revocar(usuario=claims.get("user_id"), desde=revocadas[clave_usuario])
+
+        if clave_sesion in revocadas:
+            self.revocar(sesion=claims.get("sid"))
+
+    def revocado(self, claims):
+        # iat va en segundos enteros: un token del mismo segundo que la
+        # revocación también cae (mejor un login repetido que uno de más)
+        desde = self.usuarios_revocados.get(str(claims.get("user_id")))
+        if desde is not None and claims.get("iat", 0) <= desde:
+            return True
+
+        return claims.get("sid") in self.sesiones_revocadas
+
+    def revocar(self, usuario=None, sesion=None, desde=None):
+
+        ahora = time.time()
+
+        with self.lock:
+
+            if usuario is not None:
+                # una revocación vieja no pisa a una más reciente
+                self.usuarios_revocados[str(usuario)] = max(
+                    int(desde or ahora),
+                    self.usuarios_revocados.get(str(usuario), 0)
+                )
+
+            if sesion is not None:
+                vida = settings.SIMPLE_JWT["REFRESH_TOKEN_LIFETIME"].total_seconds()
+                self.sesiones_revocadas[sesion] = ahora + vida
+
+            # olvidar sesiones cuyo refresh ya expiró
+            for sid, hasta in list(self.sesiones_revocadas.items()):
+                if hasta < ahora:
+                    del self.sesiones_revocadas[sid]
+
+            for jti, (huella, claims, vence) in list(self.entradas.items()):
+                if (
+                    (usuario is not None and str(claims.get("user_id")) == str(usuario))
+                    or (sesion is not None and claims.get("sid") == sesion)
+                ):
+                    del self.entradas[jti]
+
+
+tokens_verificados = TokensVerificados(
+    getattr(settings, "WS_TOKEN_CACHE_SIZE", 10000),
+    getattr(settings, "WS_TOKEN_CACHE_TTL", 300),
+)
+
+
+def clave_revocacion(tipo, valor):
+    return f"tokens_revocados:{tipo}:{valor}"
+
+
+def revocar_tokens(usuario=None, sesion=None):
+    '''
+    Revoca en este proceso, la deja en la caché compartida y avisa a los
+    demás.
+    usuario: todos los tokens emitidos hasta ahora (desactivación, cambio de rol).
+    sesion: solo la sesión (sid) que hizo logout.
+    '''
+    desde = int(time.time())
+
+    tokens_verificados.revocar(usuario=usuario, sesion=sesion, desde=desde)
+
+    # hasta que expire el último access token afectado (el refresh de la
+    # sesión ya está en la blacklist: no emite otros)
+    revocadas = {}
+    if usuario is not None:
+        revocadas[clave_revocacion("usuario", usuario)] = desde
+    if sesion is not None:
+        revocadas[clave_revocacion("sesion", sesion)] = desde
+
+    try:
+        cache.set_many(
+            revocadas,
+            timeout=int(settings.SIMPLE_JWT["ACCESS_TOKEN_LIFETIME"].total_seconds())
+        )
+    except Exception:
+        logger.exception("No se pudieron guardar las revocaciones de tokens")
+
+    enviar_control({
+        "accion": "revocar_tokens",
+        "usuario": usuario,
+        "sesion": sesion,
+        "desde": desde
+    })
+
+
+@al_recibir_control("revocar_tokens")
+def aplicar_revocacion(data):
+    tokens_verificados.revocar(
+        usuario=data.get("usuario"),
+        sesion=data.get("sesion"),
+        desde=data.get("desde")
+    )
@@ -60,6 +60,17 @@ class IsAdminOrOperador(BasePermission):
         return role in ["admin", "operador"]
 
 
+class IsOperadorOrRescatista(BasePermission):
+    def has_permission(self, request, view):
+
+        if not request.auth:
+            return False
+
+        role = request.auth.get("role")
+
+        return role in ["operador", "rescatista"]
+
+
 class IsAdminOrAuditor(BasePermission):
     def has_permission(self, request, view):
 
@@ -1,3 +1,84 @@
-from django.test import TestCase
+import threading
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from Aplicaciones.incidentes.middleware import get_user_from_token
+
+from .jwt import TokensVerificados, generar_tokens, revocar_tokens
+
+
+CACHE_LOCAL = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+}
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class RevocacionTokensTests(TestCase):
+
+    def setUp(self):
+        # las revocaciones viven en la caché: los ids se repiten entre tests
+        cache.clear()
+
+        self.usuario = User.objects.create_user("rescatista", password="x")
+        self.usuario.perfil.rol = "rescatista"
+        self.usuario.perfil.save()
+
+    def proceso_nuevo(self):
+        # LRU vacío y sin los avisos del grupo de control
+        return TokensVerificados(100, 300)
+
+    def test_proceso_nuevo_rechaza_usuario_revocado(self):
+        # emitido en el mismo segundo que la revocación (iat en segundos)
+        tokens = generar_tokens(self.usuario)
+
+        revocar_tokens(usuario=self.usuario.id)
+
+        with self.assertRaises(TokenError):
+            self.proceso_nuevo().verificar(tokens["access"])
+
+    def test_proceso_nuevo_rechaza_sesion_cerrada(self):
+        tokens = generar_tokens(self.usuario)
+        otra = generar_tokens(self.usuario)
+
+        revocar_tokens(sesion=RefreshToken(tokens["refresh"])["sid"])
+
+        proceso = self.proceso_nuevo()
+        with self.assertRaises(TokenError):
+            proceso.verificar(tokens["access"])
+
+        # las demás sesiones del usuario siguen valiendo
+        self.assertEqual(proceso.verificar(otra["access"])["role"], "rescatista")
+
+    async def test_handshake_verifica_fuera_del_loop(self):
+        tokens = await sync_to_async(generar_tokens)(self.usuario)
+        hilo_loop = threading.get_ident()
+        hilos = []
+
+        original = cache.get_many
+
+        def get_many(claves):
+            hilos.append(threading.get_ident())
+            return original(claves)
+
+        proceso = self.proceso_nuevo()
+
+        with (
+            mock.patch("Aplicaciones.incidentes.middleware.tokens_verificados", proceso),
+            mock.patch("Aplicaciones.accounts.jwt.cache.get_many", side_effect=get_many),
+        ):
+            usuario = await get_user_from_token(tokens["access"])
+            # segundo handshake: acierto del LRU, sin tocar la caché compartida
+            await get_user_from_token(tokens["access"])
+
+            self.assertEqual(usuario.role, "rescatista")
+            self.assertEqual(len(hilos), 1)
+            self.assertNotEqual(hilos[0], hilo_loop)
+
+            proceso.revocar(usuario=self.usuario.id)
+            self.assertTrue((await get_user_from_token(tokens["access"])).is_anonymous)
@@ -4,7 +4,7 @@ from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework import status
-from .jwt import generar_tokens
+from .jwt import generar_tokens, revocar_tokens
 
 from rest_framework.decorators import (api_view, permission_classes, parser_classes)
 from rest_framework.permissions import IsAuthenticated
@@ -31,6 +31,8 @@ def login_api(request):
 
     refresh["role"] = rol
     refresh["email"] = user.email
+    refresh["username"] = user.username
+    refresh["sid"] = refresh["jti"]
 
     return Response({
         "user": user.username,
@@ -50,10 +52,16 @@ def logout_api(request):
     token = request.data.get("refresh")
 
     try:
-        RefreshToken(token).blacklist()
-        return Response({"ok":"logout"})
+        refresh = RefreshToken(token)
+        refresh.blacklist()
     except:
         return Response({"error":"token invalido"},status=400)
+
+    # los sockets de esta sesión ya no pasan el handshake
+    if refresh.get("sid"):
+        revocar_tokens(sesion=refresh["sid"])
+
+    return Response({"ok":"logout"})
     
 
 
@@ -125,10 +133,16 @@ def usuario_detalle_api(request, pk):
         user.is_active = request.data.get("activo", user.is_active)
         user.save()
 
+        rol_anterior = user.perfil.rol
+
         if "rol" in request.data:
             user.perfil.rol = request.data["rol"]
             user.perfil.save()
 
+        # el rol viaja en el token: desactivar o cambiar rol invalida los emitidos
+        if not user.is_active or user.perfil.rol != rol_anterior:
+            revocar_tokens(usuario=user.id)
+
         return Response({"ok":"actualizado"})
 
     # DESACTIVAR
@@ -137,4 +151,6 @@ def usuario_detalle_api(request, pk):
         user.is_active = False
         user.save()
 
+        revocar_tokens(usuario=user.id)
+
         return Response({"ok":"desactivado"})
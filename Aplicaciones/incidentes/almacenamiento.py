@@ -0,0 +1,148 @@
+import os
+import re
+import hashlib
+import tempfile
+import posixpath
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+# Evidencias direccionadas por contenido: cada archivo se guarda una sola
+# vez, como <carpeta>/<2 primeros>/<sha256><ext>, con el hash calculado
+# mientras se escribe (sin releerlo). Subir el mismo PDF tres veces deja
+# un archivo y tres referencias (BlobEvidencia, ver evidencias.py).
+#
+# El nombre de cada digest lo fija la fila BlobEvidencia (digest UNIQUE),
+# no el disco: la primera subida la inserta con su extensión y las demás,
+# aunque lleguen con otra extensión mientras la primera sigue en curso,
+# esperan a esa fila y escriben o reutilizan el mismo archivo. Nunca hay
+# dos archivos para un mismo contenido.
+#
+# Los blobs se comparten entre incidentes: delete() no borra nada; los que
+# se quedan sin referencias los recoge el comando deduplicar_evidencias
+# (solo si no se escribieron ni reutilizaron en la última hora).
+
+_DIGEST = re.compile(r"^[0-9a-f]{64}$")
+
+
+def digest_de(nombre):
+    '''
+    sha256 de un nombre de blob, o None si es un archivo antiguo.
+    '''
+    base = posixpath.basename(nombre or "").split(".", 1)[0]
+    return base if _DIGEST.match(base) else None
+
+
+def sha256_de(archivo):
+    digest = hashlib.sha256()
+    for bloque in archivo.chunks():
+        digest.update(bloque)
+    return digest.hexdigest()
+
+
+@deconstructible(path="Aplicaciones.incidentes.almacenamiento.AlmacenamientoDireccionado")
+class AlmacenamientoDireccionado(FileSystemStorage):
+
+    def get_available_name(self, name, max_length=None):
+        # el nombre final sale del contenido (_save): nunca se renombra
+        return name
+
+    def nombre_blob(self, carpeta, digest, ext=""):
+        return posixpath.join(carpeta, digest[:2], digest + ext)
+
+    def buscar(self, carpeta, digest):
+        '''
+        Nombre del blob con ese digest (con cualquier extensión), o None.
+        '''
+        directorio = posixpath.join(carpeta, digest[:2])
+        try:
+            archivos = self.listdir(directorio)[1]
+        except FileNotFoundError:
+            return None
+
+        for archivo in archivos:
+            if archivo.split(".", 1)[0] == digest:
+                return posixpath.join(directorio, archivo)
+        return None
+
+    def reservar(self, carpeta, digest, ext, tamano):
+        '''
+        Nombre del blob para `digest`: el de la fila BlobEvidencia si ya
+        existe, o el propio (con `ext`) insertándola. En PostgreSQL una
+        segunda subida espera en el índice único a que la primera
+        confirme; en SQLite las escrituras ya van en fila.
+        '''
+        # aquí y no arriba: models importa este módulo
+        from .models import BlobEvidencia
+
+        BlobEvidencia.objects.bulk_create(
+            [BlobEvidencia(
+                digest=digest,
+                nombre=self.nombre_blob(carpeta, digest, ext),
+                tamano=tamano
+            )],
+            ignore_conflicts=True
+        )
+
+        return (
+            BlobEvidencia.objects
+            .filter(digest=digest)
+            .values_list("nombre", flat=True)
+            .get()
+        )
+
+    def _save(self, name, content):
+
+        carpeta = posixpath.dirname(name)
+        ext = os.path.splitext(name)[1].lower()[:10]
+
+        directorio = self.path(carpeta)
+        os.makedirs(directorio, exist_ok=True)
+
+        # a un temporal del mismo disco: el rename final es atómico
+        fd, temporal = tempfile.mkstemp(dir=directorio, prefix=".subida-")
+
+        try:
+            digest = hashlib.sha256()
+            tamano = 0
+            with os.fdopen(fd, "wb") as destino:
+                for bloque in content.chunks():
+                    digest.update(bloque)
+                    tamano += len(bloque)
+                    destino.write(bloque)
+            digest = digest.hexdigest()
+
+            final = self.reservar(carpeta, digest, ext, tamano)
+            ruta = self.path(final)
+
+            if os.path.exists(ruta):
+                # recién usado: la recolección respeta los blobs recientes
+                os.utime(ruta)
+                return final
+
+            os.makedirs(os.path.dirname(ruta), exist_ok=True)
+            os.replace(temporal, ruta)
+            temporal = None
+
+            if self.file_permissions_mode is not None:
+                os.chmod(ruta, self.file_permissions_mode)
+
+            return final
+
+        finally:
+            if temporal is not None:
+                try:
+                    os.remove(temporal)
+                except FileNotFoundError:
+                    pass
+
+    def delete(self, name):
+        # compartido: solo borrar_blob() (recolección sin referencias)
+        pass
+
+    def borrar_blob(self, name):
+        super().delete(name)
+
+
+almacenamiento_evidencias = AlmacenamientoDireccionado()
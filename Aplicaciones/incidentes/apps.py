@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class IncidentesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = 'Aplicaciones.incidentes'
+
+    def ready(self):
+        import Aplicaciones.incidentes.signals
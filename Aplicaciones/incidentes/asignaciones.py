@@ -0,0 +1,209 @@
+from django.utils import timezone
+
+from .models import Asignacion, Recurso, EstadoRecurso
+from .catalogos import catalogo
+from .versiones import tocar_versiones
+from .cercania import recursos_cambian_estado
+
+
+# Motor de asignación de recursos. Un recurso tiene como mucho UNA
+# asignación activa: lo garantiza el índice único parcial
+# asignacion_recurso_activa_unica (migración 0011), no una lectura previa.
+#
+# Reclamar = INSERT ... ON CONFLICT DO NOTHING (bulk_create con
+# ignore_conflicts) y releer cuáles quedaron a nombre de este incidente:
+# es un compare-and-swap por fila. Entre dos operadores que piden el
+# mismo recurso a la vez, el índice deja pasar a uno y el otro recibe el
+# conflicto; nunca hay bloqueo de tabla (en PostgreSQL el segundo espera
+# solo a la fila del índice; en SQLite las escrituras ya van en fila).
+# El paso a Asignado es condicional (estado = Disponible): si el recurso
+# cambió de estado después de la foto, se pierde y se informa.
+
+# motivos de conflicto
+NO_EXISTE = "no_existe"
+NO_DISPONIBLE = "no_disponible"
+OCUPADO = "ocupado"
+
+
+def estados():
+    return (
+        catalogo(EstadoRecurso).buscar("Disponible", 1),
+        catalogo(EstadoRecurso).buscar("Asignado", 2),
+    )
+
+
+def reclamar(inc, ids):
+    '''
+    Intenta asignar `ids` a `inc`. Devuelve (ganados, conflictos), con
+    conflictos = {recurso_id: motivo}. Dentro de transaction.atomic().
+    '''
+    estado_disponible, estado_asignado = estados()
+
+    if not ids:
+        return set(), {}
+
+    # foto del estado: solo se intenta con los que se ven Disponibles
+    vistos = dict(
+        Recurso.objects
+        .filter(id__in=ids)
+        .values_list("id", "estado_id")
+    )
+
+    conflictos = {rid: NO_EXISTE for rid in ids if rid not in vistos}
+
+    candidatos = set()
+    for rid, estado_id in vistos.items():
+        if estado_disponible and estado_id != estado_disponible.id:
+            conflictos[rid] = NO_DISPONIBLE
+        else:
+            candidatos.add(rid)
+
+    if not candidatos:
+        return set(), conflictos
+
+    # el índice único decide: las filas que chocan no se insertan
+    Asignacion.objects.bulk_create(
+        [Asignacion(incidente=inc, recurso_id=rid) for rid in sorted(candidatos)],
+        ignore_conflicts=True
+    )
+
+    ganados = set(
+        Asignacion.objects
+        .filter(incidente=inc, recurso_id__in=candidatos)
+        .values_list("recurso_id", flat=True)
+    )
+
+    for rid in candidatos - ganados:
+        conflictos[rid] = OCUPADO
+
+    if ganados and estado_asignado:
+        ganados -= marcar_asignados(inc, ganados, estado_disponible, estado_asignado, conflictos)
+        recursos_cambian_estado(ganados, estado_asignado.id)
+
+    return ganados, conflictos
+
+
+def marcar_asignados(inc, ganados, estado_disponible, estado_asignado, conflictos):
+    '''
+    Pasa `ganados` de Disponible a Asignado solo si siguen Disponibles:
+    la foto de reclamar() puede haber quedado vieja (otro los puso en
+    mantenimiento entre la lectura y el INSERT). Los que ya no lo estaban
+    pierden la asignación recién creada y van a `conflictos`. Devuelve
+    los perdidos.
+    '''
+    filtro = {"id__in": ganados}
+    if estado_disponible:
+        filtro["estado"] = estado_disponible
+
+    marcados = Recurso.objects.filter(**filtro).update(estado=estado_asignado)
+
+    if marcados == len(ganados):
+        return set()
+
+    # los que no marcó este UPDATE no están en Asignado (los marcados
+    # quedan bloqueados por esta transacción hasta el commit)
+    perdidos = set(
+        Recurso.objects
+        .filter(id__in=ganados)
+        .exclude(estado=estado_asignado)
+        .values_list("id", flat=True)
+    )
+
+    # filas insertadas en esta misma transacción: se borran, no hay historia
+    Asignacion.all_objects.filter(
+        incidente=inc,
+        recurso_id__in=perdidos,
+        activo=True
+    ).delete()
+
+    for rid in perdidos:
+        conflictos[rid] = NO_DISPONIBLE
+
+    return perdidos
+
+
+def soltar(inc, ids):
+    '''
+    Libera los recursos `ids` asignados a `inc` (los demás no se tocan).
+    Devuelve los liberados. Dentro de transaction.atomic().
+    '''
+    estado_disponible, _ = estados()
+
+    if not ids:
+        return set()
+
+    liberados = set(
+        Asignacion.objects
+        .filter(incidente=inc, recurso_id__in=ids)
+        .values_list("recurso_id", flat=True)
+    )
+
+    if liberados:
+        Asignacion.objects.filter(
+            incidente=inc,
+            recurso_id__in=liberados
+        ).update(activo=False, fecha_borrado=timezone.now())
+
+        if estado_disponible:
+            Recurso.objects.filter(id__in=liberados).update(estado=estado_disponible)
+            recursos_cambian_estado(liberados, estado_disponible.id)
+
+    return liberados
+
+
+def liberar_incidentes(ids):
+    '''
+    Libera todos los recursos de los incidentes `ids` (al cerrarlos o
+    borrarlos) con tres sentencias, sean uno o quinientos. Dentro de la
+    transacción del que llama. Devuelve cuántas asignaciones cerró.
+    '''
+    estado_disponible, _ = estados()
+
+    activas = Asignacion.objects.filter(incidente_id__in=ids)
+
+    # los ids hacen falta para el índice de cercanía
+    liberados = list(activas.values_list("recurso_id", flat=True))
+
+    if liberados and estado_disponible:
+        Recurso.objects.filter(id__in=liberados).update(estado=estado_disponible)
+        recursos_cambian_estado(liberados, estado_disponible.id)
+
+    cerradas = activas.update(activo=False, fecha_borrado=timezone.now())
+
+    if cerradas:
+        tocar_versiones("asignacion", "recurso")
+
+    return cerradas
+
+
+def aplicar_asignacion(inc, asignar, desasignar):
+    '''
+    Aplica el diff de recursos de un incidente con un número fijo de
+    sentencias, sea cual sea la cantidad de recursos. Llamar dentro de
+    transaction.atomic(). Devuelve el diff efectivo:
+    {"asignados", "desasignados", "conflictos": [{"recurso", "motivo"}]},
+    con motivo NO_EXISTE, NO_DISPONIBLE u OCUPADO.
+    '''
+    activos = set(
+        Asignacion.objects
+        .filter(incidente=inc)
+        .values_list("recurso_id", flat=True)
+    )
+
+    # desasignar gana si un id viene en las dos listas; solo se libera lo
+    # que está asignado a ESTE incidente
+    liberados = soltar(inc, desasignar & activos)
+    ganados, conflictos = reclamar(inc, asignar - activos - desasignar)
+
+    # bulk_create y .update() no pasan por las señales
+    if ganados or liberados:
+        tocar_versiones("asignacion", "recurso")
+
+    return {
+        "asignados": sorted(ganados),
+        "desasignados": sorted(liberados),
+        "conflictos": [
+            {"recurso": rid, "motivo": motivo}
+            for rid, motivo in sorted(conflictos.items())
+        ],
+    }
@@ -0,0 +1,164 @@
+import re
+
+from django.db import connection
+
+from .models import Incidente, TipoIncidente, EstadoIncidente
+
+
+# Búsqueda de texto completo sobre los incidentes activos: descripción,
+# nombre del tipo y nombre del estado. El índice es una tabla aparte
+# (migración 0010) que se mantiene por señales en la misma transacción
+# que la escritura:
+#   SQLite     -> tabla virtual FTS5 (rowid = id del incidente), bm25
+#   PostgreSQL -> tabla con tsvector ('spanish') + índice GIN, ts_rank_cd
+# Otros motores: icontains sobre la descripción, sin índice ni ranking.
+# Los .update() masivos no pasan por las señales: reindexar_busqueda.
+
+TABLA = "incidentes_busqueda"
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def _tablas():
+    return {
+        "incidente": Incidente._meta.db_table,
+        "tipo": TipoIncidente._meta.db_table,
+        "estado": EstadoIncidente._meta.db_table,
+        "indice": TABLA,
+    }
+
+
+def disponible():
+    return connection.vendor in ("sqlite", "postgresql")
+
+
+def terminos(texto):
+    # solo palabras: la sintaxis de MATCH / tsquery nunca llega del cliente
+    return _TOKEN.findall(texto or "")[:20]
+
+
+# ---------------- SINCRONIZACIÓN ----------------
+
+def _actualizar(donde, params):
+    '''
+    Reescribe en el índice los incidentes que cumplen `donde` (SQL sobre
+    el alias i): se borran y se vuelven a insertar solo los activos.
+    '''
+    if not disponible():
+        return
+
+    t = _tablas()
+
+    seleccion = (
+        f"FROM {t['incidente']} i "
+        f"JOIN {t['tipo']} ti ON ti.id = i.tipo_id "
+        f"JOIN {t['estado']} es ON es.id = i.estado_id "
+        f"WHERE {donde}"
+    )
+
+    with connection.cursor() as cursor:
+
+        if connection.vendor == "sqlite":
+            cursor.execute(
+                f"DELETE FROM {TABLA} WHERE rowid IN (SELECT i.id {seleccion})",
+                params
+            )
+            cursor.execute(
+                f"INSERT INTO {TABLA} (rowid, descripcion, tipo, estado) "
+                f"SELECT i.id, i.descripcion, ti.nombre, es.nombre {seleccion} AND i.activo",
+                params
+            )
+        else:
+            cursor.execute(
+                f"DELETE FROM {TABLA} WHERE incidente_id IN (SELECT i.id {seleccion})",
+                params
+            )
+            # la descripción pesa más que los nombres de catálogo
+            cursor.execute(
+                f"INSERT INTO {TABLA} (incidente_id, documento) "
+                "SELECT i.id, "
+                "setweight(to_tsvector('spanish', coalesce(i.descripcion, '')), 'A') || "
+                "setweight(to_tsvector('spanish', ti.nombre || ' ' || es.nombre), 'B') "
+                f"{seleccion} AND i.activo",
+                params
+            )
+
+
+def indexar_incidentes(ids):
+    ids = list(ids)
+    if ids:
+        _actualizar(f"i.id IN ({', '.join(['%s'] * len(ids))})", ids)
+
+
+def indexar_por_catalogo(columna, id_):
+    # renombrar un tipo o un estado cambia el texto de sus incidentes
+    _actualizar(f"i.{columna} = %s", [id_])
+
+
+def quitar_incidente(id_):
+    if not disponible():
+        return
+
+    columna = "rowid" if connection.vendor == "sqlite" else "incidente_id"
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLA} WHERE {columna} = %s", [id_])
+
+
+def reindexar():
+    '''
+    Vacía el índice y lo reconstruye con todos los incidentes activos.
+    '''
+    if not disponible():
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLA}")
+
+    _actualizar("1 = 1", [])
+
+
+# ---------------- CONSULTA ----------------
+
+def buscar_ids(texto, limite, desplazamiento=0):
+    '''
+    Ids de incidentes activos que contienen todas las palabras de `texto`
+    (también como prefijo), del más relevante al menos.
+    '''
+    palabras = terminos(texto)
+    if not palabras:
+        return []
+
+    with connection.cursor() as cursor:
+
+        if connection.vendor == "sqlite":
+            consulta = " ".join(f'"{p}"*' for p in palabras)
+            cursor.execute(
+                f"SELECT rowid FROM {TABLA} WHERE {TABLA} MATCH %s "
+                # bm25: más negativo = más relevante; pesos por columna
+                f"ORDER BY bm25({TABLA}, 4.0, 1.0, 1.0), rowid DESC "
+                "LIMIT %s OFFSET %s",
+                [consulta, limite, desplazamiento]
+            )
+
+        elif connection.vendor == "postgresql":
+            consulta = " & ".join(f"{p}:*" for p in palabras)
+            cursor.execute(
+                "SELECT b.incidente_id "
+                f"FROM {TABLA} b, to_tsquery('spanish', %s) q "
+                "WHERE b.documento @@ q "
+                "ORDER BY ts_rank_cd(b.documento, q) DESC, b.incidente_id DESC "
+                "LIMIT %s OFFSET %s",
+                [consulta, limite, desplazamiento]
+            )
+
+        else:
+            qs = Incidente.objects.all()
+            for palabra in palabras:
+                qs = qs.filter(descripcion__icontains=palabra)
+            return list(
+                qs.order_by("-fecha_creacion", "-id")
+                .values_list("id", flat=True)[desplazamiento:desplazamiento + limite]
+            )
+
+        return [fila[0] for fila in cursor.fetchall()]
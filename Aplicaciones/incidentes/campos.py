@@ -0,0 +1,85 @@
+from collections import namedtuple
+
+from rest_framework import serializers
+
+
+# Selección de campos (?fields=a,b / ?omit=c) para los serializers de
+# listado. La misma selección poda la consulta: solo los JOIN, columnas y
+# anotaciones que leen los campos pedidos (ver consultas.py).
+
+Seleccion = namedtuple("Seleccion", ["campos", "omitir"])
+
+Plan = namedtuple("Plan", ["campos", "relaciones", "columnas"])
+
+
+def _lista(valor):
+    return tuple(x.strip() for x in (valor or "").split(",") if x.strip())
+
+
+def leer_seleccion(params):
+    '''
+    Seleccion desde ?fields= / ?omit=, o None si no se pidió ninguna.
+    Los campos_fijos del serializer salen aunque no estén en ?fields= o
+    estén en ?omit= (en incidentes, id y version).
+    '''
+    campos = _lista(params.get("fields")) or None
+    omitir = _lista(params.get("omit"))
+
+    if campos is None and not omitir:
+        return None
+
+    return Seleccion(campos, omitir)
+
+
+class CamposDinamicosMixin:
+    '''
+    Serializer(..., seleccion=Seleccion(...)) deja solo los campos pedidos.
+    campos_fijos salen siempre, pedidos o no y aunque vengan en ?omit=:
+    los clientes aplican deltas por id y descartan los de versión vieja.
+    columnas_metodos: columnas del modelo que lee cada SerializerMethodField.
+    '''
+
+    campos_fijos = ("id",)
+    columnas_metodos = {}
+
+    def __init__(self, *args, seleccion=None, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        if seleccion is None:
+            return
+
+        pedidos = set(seleccion.campos or ()) | set(seleccion.omitir)
+        desconocidos = pedidos - set(self.fields)
+        if desconocidos:
+            raise ValueError(f"Campos desconocidos: {', '.join(sorted(desconocidos))}")
+
+        quedan = set(self.fields) if seleccion.campos is None else set(seleccion.campos)
+        quedan = (quedan - set(seleccion.omitir)) | set(self.campos_fijos)
+
+        for nombre in list(self.fields):
+            if nombre not in quedan:
+                self.fields.pop(nombre)
+
+    def plan_consulta(self):
+        '''
+        Plan(campos, relaciones, columnas) con lo que leen los campos que
+        quedaron: relaciones para select_related, columnas para only().
+        '''
+        relaciones = set()
+        columnas = set()
+
+        for nombre, campo in self.fields.items():
+
+            if isinstance(campo, serializers.SerializerMethodField):
+                columnas.update(self.columnas_metodos.get(nombre, ()))
+                continue
+
+            if campo.source == "*":
+                continue
+
+            ruta = campo.source_attrs
+            columnas.add("__".join(ruta))
+            if len(ruta) > 1:
+                relaciones.add("__".join(ruta[:-1]))
+
+        return Plan(set(self.fields), relaciones, columnas)
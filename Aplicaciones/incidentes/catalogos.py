@@ -0,0 +1,141 @@
+import time
+import threading
+
+from django.conf import settings
+from rest_framework import serializers
+
+from .models import (
+    TipoIncidente, Severidad, EstadoIncidente, TipoRecurso, EstadoRecurso
+)
+from .realtime import enviar_control, al_recibir_control, loop_envio
+from .presupuesto import fuera_de_presupuesto
+
+
+# Caché en memoria de los catálogos (tablas pequeñas que casi no cambian),
+# por id y por nombre. Cada proceso tiene la suya; un cambio en cualquier
+# proceso la invalida en todos por el grupo de control. El TTL solo cubre
+# un aviso perdido.
+
+MODELOS = {
+    "tipo_incidente": TipoIncidente,
+    "severidad": Severidad,
+    "estado_incidente": EstadoIncidente,
+    "tipo_recurso": TipoRecurso,
+    "estado_recurso": EstadoRecurso,
+}
+
+
+class Catalogo:
+
+    def __init__(self, modelo):
+        self.modelo = modelo
+        self.lock = threading.Lock()
+        self.datos = None           # (por_id, por_nombre, vence)
+        self.generacion = 0         # sube con cada invalidación
+
+    def cargar(self):
+
+        datos = self.datos
+        if datos is not None and datos[2] > time.monotonic():
+            return datos
+
+        with self.lock:
+            datos = self.datos
+            if datos is None or datos[2] <= time.monotonic():
+                generacion = self.generacion
+                with fuera_de_presupuesto():
+                    filas = list(self.modelo.objects.order_by("id"))
+                datos = (
+                    {fila.id: fila for fila in filas},
+                    {fila.nombre.lower(): fila for fila in filas},
+                    time.monotonic() + getattr(settings, "CATALOGOS_CACHE_TTL", 300),
+                )
+
+                # invalidada mientras se leía: se usa esta vez, no se guarda
+                if generacion == self.generacion:
+                    self.datos = datos
+
+                # la invalidación entre procesos necesita el oyente de control
+                loop_envio()
+
+        return datos
+
+    def invalidar(self):
+        self.generacion += 1
+        self.datos = None
+
+    def todos(self):
+        return list(self.cargar()[0].values())
+
+    def por_id(self, id_):
+        try:
+            return self.cargar()[0].get(int(id_))
+        except (TypeError, ValueError):
+            return None
+
+    def por_nombre(self, nombre):
+        return self.cargar()[1].get(nombre.lower())
+
+    def buscar(self, nombre, id_defecto=None):
+        '''
+        Por nombre y, si no existe, por un id fijo conocido.
+        '''
+        obj = self.por_nombre(nombre)
+        if obj is None and id_defecto is not None:
+            obj = self.por_id(id_defecto)
+        return obj
+
+
+_catalogos = {tabla: Catalogo(modelo) for tabla, modelo in MODELOS.items()}
+_tablas = {modelo: tabla for tabla, modelo in MODELOS.items()}
+
+
+def catalogo(modelo):
+    return _catalogos[_tablas[modelo]]
+
+
+def es_catalogo(modelo):
+    return modelo in _tablas
+
+
+def invalidar_catalogo(modelo):
+    '''
+    Invalida aquí ya y en todos los procesos cuando la transacción confirme.
+    '''
+    tabla = _tablas[modelo]
+    _catalogos[tabla].invalidar()
+    enviar_control({"accion": "catalogo_invalidado", "tabla": tabla})
+
+
+@al_recibir_control("catalogo_invalidado")
+def aplicar_invalidacion(data):
+    catalogo_ = _catalogos.get(data.get("tabla"))
+    if catalogo_:
+        catalogo_.invalidar()
+
+
+class CatalogoPKField(serializers.PrimaryKeyRelatedField):
+    '''
+    PrimaryKeyRelatedField que valida contra la caché, sin consulta.
+    '''
+
+    def __init__(self, modelo, **kwargs):
+        self.modelo = modelo
+        if not kwargs.get("read_only"):
+            kwargs.setdefault("queryset", modelo.objects.all())
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+
+        obj = catalogo(self.modelo).por_id(data)
+
+        if obj is None:
+            try:
+                int(data)
+            except (TypeError, ValueError):
+                self.fail("incorrect_type", data_type=type(data).__name__)
+            self.fail("does_not_exist", pk_value=data)
+
+        return obj
@@ -0,0 +1,355 @@
+import math
+import heapq
+import time
+import uuid
+import threading
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Recurso
+from .realtime import enviar_control, al_recibir_control, loop_envio
+from .presupuesto import fuera_de_presupuesto
+
+
+# Índice espacial en memoria de los recursos con posición conocida, para
+# recomendar los k más cercanos a un incidente sin recorrer la tabla.
+# Rejilla de celdas de RECURSOS_CELDA_GRADOS (0.01° ≈ 1.1 km), una por
+# (tipo, estado): la consulta solo mira la de (tipo, Disponible) y avanza
+# por anillos de celdas alrededor del punto hasta que nada fuera de ellos
+# puede estar más cerca que el k-ésimo encontrado. Lejos de los recursos
+# (zona vacía) salta a bloques de BLOQUE x BLOQUE celdas.
+#
+# Cada proceso tiene el suyo. Las escrituras lo actualizan fila a fila
+# después del commit: aquí directamente y en los demás procesos por el
+# grupo de control, con los datos nuevos en el mensaje (el oyente no
+# consulta la base). El TTL recarga todo por si se perdió un aviso.
+
+RADIO_TIERRA_KM = 6371.0088
+KM_POR_GRADO = math.pi * RADIO_TIERRA_KM / 180
+
+# los avisos propios ya se aplicaron al confirmar: se ignora el eco
+ORIGEN = uuid.uuid4().hex
+
+BLOQUE = 16
+
+
+def distancia_km(lat1, lon1, lat2, lon2):
+    # haversine
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dlat = p2 - p1
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dlon / 2) ** 2
+    return 2 * RADIO_TIERRA_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def fila_indice(recurso):
+    '''
+    (tipo, estado, lat, lon) de un recurso, o None si no va en el índice.
+    '''
+    if not recurso.activo or recurso.latitud is None or recurso.longitud is None:
+        return None
+    return (
+        recurso.tipo_id,
+        recurso.estado_id,
+        float(recurso.latitud),
+        float(recurso.longitud),
+    )
+
+
+class Rejilla:
+    '''
+    Puntos de un (tipo, estado) por celda, y las celdas ocupadas de cada
+    bloque.
+    '''
+
+    def __init__(self):
+        self.celdas = {}    # (fila, columna) -> {id: (lat, lon)}
+        self.bloques = {}   # (fila // BLOQUE, columna // BLOQUE) -> {celda}
+
+    def poner(self, celda, id_, punto):
+        puntos = self.celdas.get(celda)
+        if puntos is None:
+            puntos = self.celdas[celda] = {}
+            self.bloques.setdefault(
+                (celda[0] // BLOQUE, celda[1] // BLOQUE), set()
+            ).add(celda)
+        puntos[id_] = punto
+
+    def quitar(self, celda, id_):
+        puntos = self.celdas[celda]
+        del puntos[id_]
+        if not puntos:
+            del self.celdas[celda]
+            bloque = (celda[0] // BLOQUE, celda[1] // BLOQUE)
+            self.bloques[bloque].discard(celda)
+            if not self.bloques[bloque]:
+                del self.bloques[bloque]
+
+
+class IndiceEspacial:
+
+    def __init__(self, celda):
+        self.celda = celda
+        self.lock = threading.Lock()        # lecturas y cambios
+        self.lock_carga = threading.Lock()  # una sola recarga a la vez
+        self.recursos = None                # id -> (tipo, estado, lat, lon)
+        self.rejillas = {}                  # (tipo, estado) -> Rejilla
+        self.vence = 0
+        self.pendientes = None              # cambios llegados durante una recarga
+
+    def _celda(self, lat, lon):
+        return (math.floor(lat / self.celda), math.floor(lon / self.celda))
+
+    # ---------------- CAMBIOS ----------------
+
+    def _poner(self, recursos, rejillas, id_, fila):
+        anterior = recursos.pop(id_, None)
+
+        if anterior is not None:
+            tipo, estado, lat, lon = anterior
+            rejillas[(tipo, estado)].quitar(self._celda(lat, lon), id_)
+
+        if fila is not None:
+            tipo, estado, lat, lon = fila
+            recursos[id_] = fila
+            rejilla = rejillas.get((tipo, estado))
+            if rejilla is None:
+                rejilla = rejillas[(tipo, estado)] = Rejilla()
+            rejilla.poner(self._celda(lat, lon), id_, (lat, lon))
+
+    def _aplicar_filas(self, recursos, rejillas, cambios):
+        for id_, fila in cambios:
+            self._poner(recursos, rejillas, id_, fila)
+
+    def _aplicar_estado(self, recursos, rejillas, ids, estado):
+        # los que no tienen posición no están: nada que mover
+        for id_ in ids:
+            fila = recursos.get(id_)
+            if fila is not None and fila[1] != estado:
+                self._poner(recursos, rejillas, id_, (fila[0], estado, fila[2], fila[3]))
+
+    def _cambiar(self, funcion, *args):
+        with self.lock:
+            if self.recursos is not None:
+                funcion(self.recursos, self.rejillas, *args)
+            if self.pendientes is not None:
+                self.pendientes.append((funcion, args))
+
+    def actualizar(self, cambios):
+        self._cambiar(self._aplicar_filas, cambios)
+
+    def cambiar_estado(self, ids, estado):
+        self._cambiar(self._aplicar_estado, ids, estado)
+
+    # ---------------- CARGA ----------------
+
+    def cargar(self):
+
+        if self.recursos is not None and self.vence > time.monotonic():
+            return
+
+        with self.lock_carga:
+            if self.recursos is not None and self.vence > time.monotonic():
+                return
+
+            # lo que cambie mientras se lee se vuelve a aplicar encima
+            with self.lock:
+                self.pendientes = []
+
+            try:
+                with fuera_de_presupuesto():
+                    filas = list(
+                        Recurso.objects
+                        .filter(latitud__isnull=False, longitud__isnull=False)
+                        .values_list("id", "tipo_id", "estado_id", "latitud", "longitud")
+                    )
+
+                recursos, rejillas = {}, {}
+                self._aplicar_filas(recursos, rejillas, [
+                    (id_, (tipo, estado, float(lat), float(lon)))
+                    for id_, tipo, estado, lat, lon in filas
+                ])
+
+                with self.lock:
+                    for funcion, args in self.pendientes:
+                        funcion(recursos, rejillas, *args)
+                    self.recursos, self.rejillas = recursos, rejillas
+                    self.vence = time.monotonic() + getattr(settings, "RECURSOS_INDICE_TTL", 300)
+            finally:
+                with self.lock:
+                    self.pendientes = None
+
+            # los avisos de otros procesos necesitan el oyente de control
+            loop_envio()
+
+    # ---------------- CONSULTA ----------------
+
+    # Cotas inferiores de distancia, a partir de haversine:
+    #   hav(d) = hav(Δlat) + cos(lat1)·cos(lat2)·hav(Δlon)
+    # con cos(lat1)·cos(lat2) >= cos²(la latitud más alejada del ecuador).
+
+    def _fuera_km(self, lat, anillo):
+        '''
+        Distancia mínima a cualquier punto fuera de los anillos 0..anillo:
+        está al menos `anillo` celdas más allá en latitud o en longitud.
+        '''
+        grados = anillo * self.celda
+        lat_extrema = min(90.0, abs(lat) + (anillo + 1) * self.celda)
+        a = math.cos(math.radians(lat_extrema)) * math.sin(math.radians(grados) / 2)
+        return 2 * RADIO_TIERRA_KM * math.asin(min(1.0, a))
+
+    def _caja_km(self, lat, lon, caja, c):
+        '''
+        Distancia mínima de (lat, lon) a cualquier punto de la caja
+        (fila, columna) de lado c grados: una celda o un bloque.
+        '''
+        fila, columna = caja
+        dlat = max(fila * c - lat, lat - (fila + 1) * c, 0.0)
+        dlon = max(columna * c - lon, lon - (columna + 1) * c, 0.0)
+        lat_extrema = min(90.0, max(abs(lat), abs(fila * c), abs((fila + 1) * c)))
+        a = (
+            math.sin(math.radians(dlat) / 2) ** 2 +
+            (math.cos(math.radians(lat_extrema)) * math.sin(math.radians(dlon) / 2)) ** 2
+        )
+        return 2 * RADIO_TIERRA_KM * math.asin(min(1.0, math.sqrt(a)))
+
+    def cercanos(self, lat, lon, tipo, estado, k, radio_km=None):
+        '''
+        Los k recursos de (tipo, estado) más cercanos a (lat, lon), como
+        [(distancia_km, id)] del más cercano al más lejano. Con radio_km,
+        solo los que están dentro.
+        '''
+        self.cargar()
+
+        with self.lock:
+
+            rejilla = self.rejillas.get((tipo, estado))
+            if rejilla is None or not rejilla.celdas or k <= 0:
+                return []
+
+            celdas = rejilla.celdas
+
+            fila0, columna0 = self._celda(lat, lon)
+            mejores = []        # montículo de (-distancia, id): los k mejores
+
+            def limite():
+                # una celda o un punto más lejos que esto ya no entra
+                peor = -mejores[0][0] if len(mejores) == k else math.inf
+                return peor if radio_km is None else min(peor, radio_km)
+
+            def considerar(celda):
+                if self._caja_km(lat, lon, celda, self.celda) > limite():
+                    return
+                for id_, (plat, plon) in celdas[celda].items():
+                    d = distancia_km(lat, lon, plat, plon)
+                    if d > limite():
+                        continue
+                    if len(mejores) < k:
+                        heapq.heappush(mejores, (-d, id_))
+                    else:
+                        heapq.heapreplace(mejores, (-d, id_))
+
+            anillo = 0
+
+            while True:
+
+                # ya se miraron más celdas de las que tienen recursos (zona
+                # vacía o recursos dispersos): se sigue por bloques, del más
+                # cercano al más lejano, solo con las celdas que faltan
+                if (2 * anillo + 1) ** 2 > len(celdas):
+                    lado = self.celda * BLOQUE
+                    bloques = sorted(
+                        (self._caja_km(lat, lon, bloque, lado), bloque)
+                        for bloque in rejilla.bloques
+                    )
+                    for cota, bloque in bloques:
+                        if cota > limite():
+                            break
+                        for celda in rejilla.bloques[bloque]:
+                            if max(abs(celda[0] - fila0), abs(celda[1] - columna0)) >= anillo:
+                                considerar(celda)
+                    break
+
+                for fila in range(fila0 - anillo, fila0 + anillo + 1):
+                    # bordes superior e inferior completos; en medio, solo los extremos
+                    if abs(fila - fila0) == anillo:
+                        columnas = range(columna0 - anillo, columna0 + anillo + 1)
+                    else:
+                        columnas = (columna0 - anillo, columna0 + anillo)
+
+                    for columna in columnas:
+                        if (fila, columna) in celdas:
+                            considerar((fila, columna))
+
+                # nada fuera de los anillos 0..anillo puede mejorar el resultado
+                if self._fuera_km(lat, anillo) > limite():
+                    break
+
+                anillo += 1
+
+        return sorted((-d, id_) for d, id_ in mejores)
+
+
+_indice = IndiceEspacial(getattr(settings, "RECURSOS_CELDA_GRADOS", 0.01))
+
+
+def cercanos(lat, lon, tipo_id, estado_id, k, radio_km=None):
+    return _indice.cercanos(float(lat), float(lon), tipo_id, estado_id, k, radio_km)
+
+
+# ---------------- AVISOS ----------------
+# Llamar dentro de la transacción de la escritura: se aplican al confirmar.
+
+def _avisar(cambios):
+    transaction.on_commit(lambda: _indice.actualizar(cambios))
+    enviar_control({
+        "accion": "recursos_indice",
+        "origen": ORIGEN,
+        "cambios": cambios
+    })
+
+
+def recursos_cambiados(recursos):
+    '''
+    Posición, tipo, estado o baja de recursos guardados con .save().
+    '''
+    _avisar([(r.pk, fila_indice(r)) for r in recursos])
+
+
+def recursos_borrados(ids):
+    _avisar([(id_, None) for id_ in ids])
+
+
+def recursos_cambian_estado(ids, estado_id):
+    '''
+    Cambio de estado masivo (.update()): solo ids y el estado nuevo.
+    '''
+    ids = list(ids)
+    if not ids:
+        return
+
+    transaction.on_commit(lambda: _indice.cambiar_estado(ids, estado_id))
+    enviar_control({
+        "accion": "recursos_estado",
+        "origen": ORIGEN,
+        "ids": ids,
+        "estado": estado_id
+    })
+
+
+@al_recibir_control("recursos_indice")
+def aplicar_recursos_indice(data):
+    if data.get("origen") == ORIGEN:
+        return
+    _indice.actualizar([
+        (id_, tuple(fila) if fila is not None else None)
+        for id_, fila in data.get("cambios") or []
+    ])
+
+
+@al_recibir_control("recursos_estado")
+def aplicar_recursos_estado(data):
+    if data.get("origen") == ORIGEN:
+        return
+    _indice.cambiar_estado(data.get("ids") or [], data.get("estado"))
@@ -0,0 +1,78 @@
+import zlib
+
+import msgpack
+
+from django.conf import settings
+
+from .json_rapido import dumps
+
+
+# Subprotocolos del WebSocket, en orden de preferencia del servidor.
+# "*.deflate" comprime a nivel de aplicación (zlib): daphne no negocia
+# la extensión permessage-deflate.
+SUBPROTOCOLOS = ["msgpack.deflate", "msgpack", "json.deflate", "json"]
+
+# sin subprotocolo: JSON en texto, como siempre
+SUBPROTOCOLO_DEFECTO = "json"
+
+
+def elegir_subprotocolo(ofrecidos):
+    '''
+    El primero de SUBPROTOCOLOS que ofrezca el cliente, o None si no
+    ofreció ninguno conocido (se acepta sin subprotocolo).
+    '''
+    ofrecidos = set(ofrecidos or [])
+
+    for subprotocolo in SUBPROTOCOLOS:
+        if subprotocolo in ofrecidos:
+            return subprotocolo
+
+    return None
+
+
+def codificar(data, subprotocolo):
+    '''
+    Frame listo para el socket: (text_data, bytes_data), uno de los dos None.
+    '''
+    formato, _, compresion = (subprotocolo or SUBPROTOCOLO_DEFECTO).partition(".")
+
+    if formato == "msgpack":
+        frame = (None, msgpack.packb(data))
+    else:
+        frame = (dumps(data), None)
+
+    if compresion == "deflate":
+        frame = comprimir(frame)
+
+    return frame
+
+
+def precodificar(data):
+    '''
+    El mismo frame en todos los subprotocolos: se codifica una vez por
+    evento en el productor y cada consumer solo elige el suyo.
+    '''
+    frames = {
+        "json": (dumps(data), None),
+        "msgpack": (None, msgpack.packb(data)),
+    }
+
+    for formato in list(frames):
+        frames[f"{formato}.deflate"] = comprimir(frames[formato])
+
+    return frames
+
+
+def comprimir(frame):
+    '''
+    Solo se comprimen los frames de al menos REALTIME_DEFLATE_MIN_BYTES;
+    el cliente los reconoce por el primer byte (0x78, cabecera zlib),
+    que nunca empieza un mapa msgpack ni un objeto JSON.
+    '''
+    texto, binario = frame
+    crudo = binario if binario is not None else texto.encode()
+
+    if len(crudo) < getattr(settings, "REALTIME_DEFLATE_MIN_BYTES", 256):
+        return frame
+
+    return None, zlib.compress(crudo)
@@ -0,0 +1,106 @@
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import Incidente, Recurso, Asignacion, EstadoRecurso
+from .catalogos import catalogo
+from .serializers import IncidenteSerializer, RecursoSerializer
+
+
+# Consultas de lectura compartidas por los listados: todo lo que leen
+# IncidenteSerializer y RecursoSerializer sale en la misma consulta.
+# Con una selección de campos (?fields= / ?omit=) la consulta se poda a
+# lo que leen esos campos: sin JOIN, columnas ni anotaciones de más.
+
+
+def podar(qs, plan, columnas_extra=()):
+    # select_related() sin argumentos uniría TODAS las FK: solo si hay
+    if plan.relaciones:
+        qs = qs.select_related(*plan.relaciones)
+
+    return qs.only(*plan.columnas, *columnas_extra)
+
+
+def incidentes_qs(base=None, seleccion=None):
+    '''
+    Incidentes con tipo, severidad, estado, creado_por y rescatista
+    (select_related) y recursos_activos anotado. base: queryset de
+    partida (por defecto todos, activos e inactivos). seleccion: la de
+    campos.leer_seleccion(); ValueError si pide campos que no existen.
+    '''
+    if base is None:
+        base = Incidente.all_objects.all()
+
+    if seleccion is not None:
+        plan = IncidenteSerializer(seleccion=seleccion).plan_consulta()
+
+        # fecha_creacion: el cursor de la paginación la lee siempre
+        base = podar(base, plan, ["fecha_creacion"])
+
+        if "recursos_asignados" not in plan.campos:
+            return base
+
+        return base.annotate(recursos_activos=recursos_activos())
+
+    return (
+        base
+        .select_related("tipo", "severidad", "estado", "creado_por", "rescatista")
+        .annotate(recursos_activos=recursos_activos())
+    )
+
+
+def recursos_activos():
+
+    # subconsulta correlacionada y no JOIN + GROUP BY: con LIMIT solo se
+    # calcula para las filas de la página (Asignacion.objects: solo activas)
+    activas = (
+        Asignacion.objects
+        .filter(incidente=OuterRef("pk"))
+        .order_by()
+        .values("incidente")
+        .annotate(total=Count("id"))
+        .values("total")
+    )
+
+    return Coalesce(Subquery(activas, output_field=IntegerField()), Value(0))
+
+
+def recursos_qs(base=None, seleccion=None):
+    if base is None:
+        base = Recurso.objects.all()
+
+    if seleccion is not None:
+        return podar(base, RecursoSerializer(seleccion=seleccion).plan_consulta())
+
+    return base.select_related("tipo", "estado")
+
+
+def recursos_disponibles_qs(seleccion=None):
+    # el estado sale de la caché de catálogos: sin JOIN por nombre
+    disponible = catalogo(EstadoRecurso).buscar("Disponible", 1)
+    if disponible is None:
+        return Recurso.objects.none()
+
+    return recursos_qs(seleccion=seleccion).filter(estado=disponible)
+
+
+@contextmanager
+def lectura_consistente():
+    '''
+    Transacción en la que todas las consultas ven la misma foto de la
+    base. En PostgreSQL, REPEATABLE READ y solo lectura (con el READ
+    COMMITTED por defecto cada consulta ve su propia foto). En SQLite una
+    transacción de lectura ya lo es: la foto se toma en la primera
+    consulta. Lo que se haga antes de la primera consulta (p. ej. leer
+    la secuencia de eventos) queda antes de la foto.
+    '''
+    exterior = connection.in_atomic_block
+
+    with transaction.atomic():
+        # dentro de otra transacción ya es tarde para fijar el aislamiento
+        if connection.vendor == "postgresql" and not exterior:
+            with connection.cursor() as cursor:
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+        yield
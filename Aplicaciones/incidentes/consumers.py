@@ -1,7 +1,55 @@
-import json
+import time
+import asyncio
+from collections import Counter
+from urllib.parse import parse_qs
+from django.conf import settings
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 
+from .codificacion import elegir_subprotocolo, codificar, SUBPROTOCOLO_DEFECTO
+from .json_rapido import loads
+from .realtime import clave_evento
+
+
+# contadores del proceso (suma de todas las conexiones)
+metricas = Counter()
+
+
+ROLES_TODOS = {"admin", "operador", "rescatista", "auditor"}
+
+# tema -> roles que pueden suscribirse
+TEMAS = {
+    "catalogos": ROLES_TODOS,
+    "auditoria": {"admin", "auditor"},
+}
+
+# temas con id: prefijo -> roles. incidente_<id> lleva el incidente
+# completo: los mismos roles que pueden leerlo por la API (IsAdminOrOperador)
+TEMAS_POR_ID = {
+    "incidente_": {"admin", "operador"},
+    "auditoria_incidente_": {"admin", "operador", "auditor"},
+}
+
+MAX_TEMAS = 50
+
+
+def roles_tema(tema):
+    '''
+    Roles autorizados para el tema, o None si el tema no existe.
+    '''
+    if not isinstance(tema, str):
+        return None
+
+    if tema in TEMAS:
+        return TEMAS[tema]
+
+    for prefijo, roles in TEMAS_POR_ID.items():
+        resto = tema[len(prefijo):]
+        if tema.startswith(prefijo) and resto.isdigit():
+            return roles
+
+    return None
+
 
 class IncidenteConsumer(AsyncWebsocketConsumer):
 
@@ -14,7 +62,8 @@ class IncidenteConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
 
-        role = await self.get_user_role(user)
+        # el rol viene en los claims del token: sin consulta a la BD
+        role = getattr(user, "role", None) or await self.get_user_role(user)
 
         if not role:
             await self.close()
@@ -23,54 +72,354 @@ class IncidenteConsumer(AsyncWebsocketConsumer):
         self.role = role
         self.group_name = f"rol_{self.role}"
 
-        # grupo por rol
-        await self.channel_layer.group_add(
-            self.group_name,
-            self.channel_name
-        )
+        # coalescencia de eventos
+        self.ventana = getattr(settings, "REALTIME_COALESCE_MS", 0) / 1000
+        self.pendientes = {}
+        self.tarea_vaciado = None
+        self.lock_envio = asyncio.Lock()
+        self.eventos_fusionados = 0
+
+        # temas suscritos (?temas= al conectar o {"accion": "suscribir"})
+        self.temas = set()
+
+        # secuencias ya enviadas por reproducción (se descartan si llegan en vivo)
+        self.reproducidos = set()
 
-        # 🔥 grupo catalogos
-        await self.channel_layer.group_add(
-            "catalogos",
-            self.channel_name
-        )
+        # latido: ping periódico y cierre de sockets sin actividad
+        self.intervalo_ping = getattr(settings, "REALTIME_PING_S", 25)
+        self.tiempo_inactivo = getattr(settings, "REALTIME_IDLE_TIMEOUT_S", 75)
+        self.ultima_actividad = time.monotonic()
+        self.ultima_renovacion = self.ultima_actividad
+        self.tarea_latido = None
 
-        # grupo auditoria realtime
-        await self.channel_layer.group_add(
-            "auditoria",
-            self.channel_name
-        )
+        # grupo por rol + temas pedidos en la URL (?temas=a,b): un solo viaje
+        aceptados, rechazados, nuevos = self.autorizar_temas(self.leer_temas())
 
+        await self.unirse([self.group_name, *nuevos])
+        self.unido = True
 
-        await self.accept()
+        # codificación pedida por el cliente (json / msgpack, con o sin deflate)
+        self.subprotocolo = elegir_subprotocolo(self.scope.get("subprotocols"))
+
+        await self.accept(subprotocol=self.subprotocolo)
+
+        await self.enviar_frame({
+            "accion": "conectado",
+            "seq": await self.seq_actual(),
+            "ping": self.intervalo_ping
+        })
+
+        if aceptados or rechazados:
+            await self.enviar_frame({
+                "accion": "suscrito",
+                "temas": aceptados,
+                "rechazados": rechazados
+            })
+
+        # reconexión: ?since=<seq> reenvía solo lo perdido
+        since = self.leer_since()
+        if since is not None:
+            await self.reproducir([self.group_name, *nuevos], since)
+
+        if self.intervalo_ping:
+            self.tarea_latido = asyncio.ensure_future(self.latir())
 
 
 
     async def disconnect(self, close_code):
 
-        await self.channel_layer.group_discard(
-            self.group_name,
-            self.channel_name
-        )
+        if getattr(self, "tarea_vaciado", None):
+            self.tarea_vaciado.cancel()
+
+        if getattr(self, "tarea_latido", None):
+            self.tarea_latido.cancel()
+
+        await self.abandonar()
+
+
+    # ----------- protocolo cliente -----------
+
+    async def receive(self, text_data=None, bytes_data=None):
+
+        self.ultima_actividad = time.monotonic()
+
+        try:
+            msg = loads(text_data or "")
+            accion = msg.get("accion")
+            temas = msg.get("temas") or []
+        except (ValueError, AttributeError):
+            await self.enviar_frame({"accion": "error", "detalle": "JSON inválido"})
+            return
+
+        if not isinstance(temas, list):
+            temas = [temas]
+
+        if accion == "pong":
+            return
+
+        if accion == "suscribir":
+            await self.suscribir(temas, msg.get("desde"))
+        elif accion == "desuscribir":
+            await self.desuscribir(temas)
+        else:
+            await self.enviar_frame({"accion": "error", "detalle": "Acción desconocida"})
+
+
+    async def suscribir(self, temas, desde=None):
+
+        aceptados, rechazados, nuevos = self.autorizar_temas(temas)
+
+        await self.unirse(nuevos)
+
+        await self.enviar_frame({
+            "accion": "suscrito",
+            "temas": aceptados,
+            "rechazados": rechazados
+        })
+
+        if nuevos and isinstance(desde, int):
+            await self.reproducir(nuevos, desde)
+
+
+    def autorizar_temas(self, temas):
+        '''
+        Separa los temas en (aceptados, rechazados, nuevos) según el rol y
+        MAX_TEMAS. Los nuevos quedan anotados; falta unirse a sus grupos.
+        '''
+        aceptados = []
+        rechazados = []
+        nuevos = []
+
+        for tema in temas:
+
+            roles = roles_tema(tema)
+
+            if roles is None or self.role not in roles:
+                rechazados.append(tema)
+                continue
+
+            if tema not in self.temas:
+                if len(self.temas) >= MAX_TEMAS:
+                    rechazados.append(tema)
+                    continue
+
+                self.temas.add(tema)
+                nuevos.append(tema)
+
+            aceptados.append(tema)
+
+        return aceptados, rechazados, nuevos
+
+
+    async def reproducir(self, grupos, desde):
+
+        if not hasattr(self.channel_layer, "eventos_desde"):
+            return
+
+        eventos = await self.channel_layer.eventos_desde(grupos, desde)
+
+        # el hueco es mayor que el log retenido: el cliente recarga todo
+        if eventos is None:
+            metricas["resyncs"] += 1
+            await self.enviar_frame({
+                "accion": "resync",
+                "seq": await self.seq_actual()
+            })
+            return
+
+        # del mismo incidente/tabla basta el último
+        ultimos = {}
+        for seq, data in eventos:
+            self.reproducidos.add(seq)
+            clave = clave_evento(data) or seq
+            ultimos.pop(clave, None)
+            ultimos[clave] = {**data, "seq": seq}
+
+        metricas["eventos_reproducidos"] += len(ultimos)
+
+        for data in ultimos.values():
+            await self.enviar_frame(data)
+
 
-        await self.channel_layer.group_discard(
-            "catalogos",
-            self.channel_name
-        )
-        await self.channel_layer.group_discard(
-            "auditoria",
-            self.channel_name
-        )
+    async def desuscribir(self, temas):
+
+        quitados = [tema for tema in dict.fromkeys(temas) if tema in self.temas]
+
+        await self.salir(quitados)
+        self.temas.difference_update(quitados)
+
+        await self.enviar_frame({
+            "accion": "desuscrito",
+            "temas": quitados
+        })
 
 
 
 
     async def enviar_evento(self, event):
-        await self.send(text_data=json.dumps(event["data"]))
+
+        # frames ya codificados por el productor (ver realtime.evento_precodificado)
+        meta = event["meta"]
+        metricas["eventos_recibidos"] += 1
+
+        # ya salió en la reproducción. En vivo llegan en orden de seq: lo
+        # reproducido hasta este evento ya no se repetirá y se olvida
+        if self.reproducidos and meta["seq"] is not None:
+            repetido = meta["seq"] in self.reproducidos
+            self.reproducidos = {seq for seq in self.reproducidos if seq > meta["seq"]}
+            if repetido:
+                return
+
+        clave = meta["clave"]
+
+        # sin ventana, evento no fusionable o crítico: sale ya, después de
+        # lo que espera en la ventana (es anterior: el seq no se desordena)
+        if not self.ventana or clave is None or meta["critico"]:
+            async with self.lock_envio:
+                if self.pendientes.pop(clave, None) is not None:
+                    self.contar_fusion()
+                await self.enviar_pendientes()
+                await self.enviar_precodificado(event["frames"])
+            return
+
+        previo = self.pendientes.get(clave)
+
+        if previo is not None:
+            self.contar_fusion()
+
+            # nunca reemplazar por un delta más viejo
+            if previo["meta"]["version"] > meta["version"]:
+                return
+
+        # al final: los pendientes quedan en el orden de su último seq
+        self.pendientes.pop(clave, None)
+        self.pendientes[clave] = event
+
+        if self.tarea_vaciado is None:
+            self.tarea_vaciado = asyncio.ensure_future(self.vaciar_pendientes())
+
+
+    async def vaciar_pendientes(self):
+
+        await asyncio.sleep(self.ventana)
+
+        self.tarea_vaciado = None
+
+        async with self.lock_envio:
+            await self.enviar_pendientes()
+
+
+    async def enviar_pendientes(self):
+
+        pendientes = self.pendientes
+        self.pendientes = {}
+
+        for event in pendientes.values():
+            await self.enviar_precodificado(event["frames"])
+
+
+    async def enviar_precodificado(self, frames):
+        metricas["frames_enviados"] += 1
+        texto, binario = frames[self.subprotocolo or SUBPROTOCOLO_DEFECTO]
+        await self.send(text_data=texto, bytes_data=binario)
+
+
+    async def enviar_frame(self, data):
+        # respuestas propias de esta conexión: se codifican aquí
+        metricas["frames_enviados"] += 1
+        texto, binario = codificar(data, self.subprotocolo)
+        await self.send(text_data=texto, bytes_data=binario)
+
+
+    # ----------- latido -----------
+
+    async def latir(self):
+        '''
+        Ping cada intervalo_ping. Un socket que no responde en
+        tiempo_inactivo se cierra y sale de sus grupos en ese momento,
+        sin esperar a que expire la membresía en el channel layer.
+        '''
+        expiracion = getattr(self.channel_layer, "group_expiry", None)
+
+        while True:
+            await asyncio.sleep(self.intervalo_ping)
+
+            ahora = time.monotonic()
+
+            if self.tiempo_inactivo and ahora - self.ultima_actividad > self.tiempo_inactivo:
+                metricas["conexiones_reaped"] += 1
+                self.tarea_latido = None
+                await self.abandonar()
+                await self.close(code=4408)
+                return
+
+            await self.enviar_frame({"accion": "ping"})
+
+            # la membresía expira (group_expiry): los vivos la renuevan
+            if expiracion and ahora - self.ultima_renovacion > expiracion / 3:
+                self.ultima_renovacion = ahora
+                await self.unirse([self.group_name, *self.temas])
+
+
+    async def abandonar(self):
+        # sale del grupo del rol y de todos los temas, una sola vez
+        if not getattr(self, "unido", False):
+            return
+
+        self.unido = False
+        await self.salir([self.group_name, *self.temas])
+        self.temas = set()
+
+
+    async def unirse(self, grupos):
+
+        if not grupos:
+            return
+
+        if hasattr(self.channel_layer, "group_add_many"):
+            await self.channel_layer.group_add_many(grupos, self.channel_name)
+            return
+
+        for grupo in grupos:
+            await self.channel_layer.group_add(grupo, self.channel_name)
+
+
+    async def salir(self, grupos):
+
+        if not grupos:
+            return
+
+        if hasattr(self.channel_layer, "group_discard_many"):
+            await self.channel_layer.group_discard_many(grupos, self.channel_name)
+            return
+
+        for grupo in grupos:
+            await self.channel_layer.group_discard(grupo, self.channel_name)
 
 
     # ----------- helpers -----------
 
+    def leer_temas(self):
+        params = parse_qs(self.scope.get("query_string", b"").decode())
+        temas = params.get("temas", [""])[0]
+        return [tema for tema in temas.split(",") if tema]
+
+    def leer_since(self):
+        params = parse_qs(self.scope.get("query_string", b"").decode())
+        try:
+            return int(params["since"][0])
+        except (KeyError, ValueError):
+            return None
+
+    async def seq_actual(self):
+        if hasattr(self.channel_layer, "seq_actual"):
+            return await self.channel_layer.seq_actual()
+        return None
+
+    def contar_fusion(self):
+        self.eventos_fusionados += 1
+        metricas["eventos_fusionados"] += 1
+
     @database_sync_to_async
     def get_user_role(self, user):
         try:
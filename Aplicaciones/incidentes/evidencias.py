@@ -0,0 +1,41 @@
+from django.db.models import F
+
+from .models import BlobEvidencia
+from .almacenamiento import almacenamiento_evidencias, digest_de
+
+
+# Conteo de referencias de los blobs de evidencia (ver almacenamiento.py):
+# cuántos incidentes apuntan a cada archivo. Se mueve en la misma
+# transacción que el guardado del incidente. Un blob que llega a cero no
+# se borra aquí (otra subida del mismo contenido podría estar usándolo):
+# lo recoge el comando deduplicar_evidencias.
+
+
+def referenciar(nombre):
+    digest = digest_de(nombre)
+    if digest is None:
+        return
+
+    # la fila la crea la subida (almacenamiento.reservar); aquí solo falta
+    # si el nombre se asignó a mano
+    BlobEvidencia.objects.bulk_create(
+        [BlobEvidencia(
+            digest=digest,
+            nombre=nombre,
+            tamano=almacenamiento_evidencias.size(nombre)
+        )],
+        ignore_conflicts=True
+    )
+    BlobEvidencia.objects.filter(digest=digest).update(
+        referencias=F("referencias") + 1
+    )
+
+
+def soltar(nombre):
+    digest = digest_de(nombre)
+    if digest is None:
+        return
+
+    BlobEvidencia.objects.filter(digest=digest, referencias__gt=0).update(
+        referencias=F("referencias") - 1
+    )
@@ -0,0 +1,260 @@
+import csv
+import codecs
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+from django.db import transaction
+
+from .models import Incidente, TipoIncidente, Severidad, EstadoIncidente
+from .catalogos import catalogo
+from .versiones import tocar_versiones
+from .busqueda import indexar_incidentes
+from .json_rapido import loads
+
+
+# Carga masiva de incidentes (centrales de llamadas): NDJSON o CSV leído
+# línea a línea del cuerpo de la petición, sin cargarlo entero. Cada fila
+# se valida contra la caché de catálogos (sin consultas) y las válidas se
+# insertan en lotes de LOTE con bulk_create, una transacción por lote.
+# Una fila inválida no detiene la carga: se informa con su número.
+#
+# Columnas: tipo, severidad, estado (id o nombre; estado por defecto
+# Abierto), descripcion, latitud, longitud (por defecto 0).
+
+LOTE = 500
+MAXIMO_FILAS = 100_000
+MAXIMO_ERRORES = 1000           # los demás solo se cuentan
+LARGO_MAXIMO_LINEA = 64 * 1024
+
+SEIS_DECIMALES = Decimal("0.000001")
+
+REQUERIDO = "Este campo es requerido."
+
+
+# ---------------- LECTURA ----------------
+
+def lineas(stream):
+    '''
+    Líneas de texto (UTF-8, con o sin BOM) del stream, a medida que llegan.
+    '''
+    return codecs.iterdecode(
+        iter(lambda: stream.readline(LARGO_MAXIMO_LINEA), b""),
+        "utf-8-sig",
+        errors="replace"
+    )
+
+
+def filas_ndjson(lineas):
+    for numero, linea in enumerate(lineas, 1):
+
+        if not linea.strip():
+            continue
+
+        try:
+            dato = loads(linea)
+        except ValueError:
+            yield numero, None, {"fila": ["JSON inválido."]}
+            continue
+
+        if not isinstance(dato, dict):
+            yield numero, None, {"fila": ["Se esperaba un objeto JSON."]}
+            continue
+
+        yield numero, dato, None
+
+
+class LecturaInterrumpida(Exception):
+    '''
+    El resto del cuerpo no se puede leer: la carga queda truncada en la
+    línea `numero`.
+    '''
+
+    def __init__(self, numero, mensaje):
+        super().__init__(mensaje)
+        self.numero = numero
+
+
+def filas_csv(lineas):
+    # la fila 1 es la cabecera; cuenta también los saltos dentro de comillas
+    leidas = 0
+
+    def contar():
+        nonlocal leidas
+        for linea in lineas:
+            leidas += 1
+            yield linea
+
+    lector = csv.DictReader(contar())
+
+    # sin cabecera no hay columnas con las que leer lo demás
+    try:
+        lector.fieldnames
+    except csv.Error as e:
+        raise LecturaInterrumpida(leidas, f"Cabecera CSV inválida: {e}")
+
+    # una fila mal formada se informa y se sigue con la siguiente
+    while True:
+        try:
+            dato = next(lector)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            yield leidas, None, {"fila": [f"CSV inválido: {e}"]}
+            continue
+
+        yield leidas, dato, None
+
+
+# ---------------- VALIDACIÓN ----------------
+
+def _catalogo(modelo, valor, campo, errores):
+    if valor in (None, ""):
+        errores[campo] = [REQUERIDO]
+        return None
+
+    if isinstance(valor, str) and not valor.strip().isdigit():
+        obj = catalogo(modelo).por_nombre(valor.strip())
+    elif isinstance(valor, bool):
+        obj = None
+    else:
+        obj = catalogo(modelo).por_id(valor)
+
+    if obj is None:
+        errores[campo] = [f'No existe "{valor}".']
+
+    return obj
+
+
+def _coordenada(valor, limite, campo, errores):
+    if valor in (None, ""):
+        return Decimal(0)
+
+    try:
+        numero = Decimal(str(valor).strip())
+    except InvalidOperation:
+        numero = None
+
+    if numero is None or not numero.is_finite() or abs(numero) > limite:
+        errores[campo] = [f"Debe ser un número entre -{limite} y {limite}."]
+        return None
+
+    return numero.quantize(SEIS_DECIMALES, rounding=ROUND_HALF_UP)
+
+
+def validar(dato, usuario, estado_defecto):
+    '''
+    Incidente sin guardar a partir de una fila, o (None, errores).
+    '''
+    errores = {}
+
+    tipo = _catalogo(TipoIncidente, dato.get("tipo"), "tipo", errores)
+    severidad = _catalogo(Severidad, dato.get("severidad"), "severidad", errores)
+
+    if dato.get("estado") in (None, ""):
+        estado = estado_defecto
+        if estado is None:
+            errores["estado"] = [REQUERIDO]
+    else:
+        estado = _catalogo(EstadoIncidente, dato.get("estado"), "estado", errores)
+
+    descripcion = dato.get("descripcion")
+    if not isinstance(descripcion, str) or not descripcion.strip():
+        errores["descripcion"] = [REQUERIDO]
+
+    latitud = _coordenada(dato.get("latitud"), 90, "latitud", errores)
+    longitud = _coordenada(dato.get("longitud"), 180, "longitud", errores)
+
+    if errores:
+        return None, errores
+
+    return Incidente(
+        tipo=tipo,
+        severidad=severidad,
+        estado=estado,
+        descripcion=descripcion.strip(),
+        latitud=latitud,
+        longitud=longitud,
+        creado_por=usuario,
+        activo=True
+    ), None
+
+
+# ---------------- CARGA ----------------
+
+def insertar(incidentes, al_insertar=None):
+    '''
+    Un lote en una transacción: INSERT múltiple, índice de búsqueda y
+    versión de la tabla (bulk_create no pasa por las señales).
+    '''
+    with transaction.atomic():
+        creados = Incidente.objects.bulk_create(incidentes)
+        indexar_incidentes([inc.pk for inc in creados])
+        tocar_versiones("incidente")
+
+        if al_insertar:
+            al_insertar(creados)
+
+    return creados
+
+
+def ingerir(filas, usuario, al_insertar=None):
+    '''
+    Valida e inserta las filas (numero, dato, error) por lotes. Llama a
+    al_insertar(creados) dentro de la transacción de cada lote.
+    '''
+    estado_defecto = catalogo(EstadoIncidente).buscar("Abierto", 1)
+
+    resumen = {
+        "filas": 0,
+        "creados": 0,
+        "lotes": 0,
+        "ids": [],
+        "errores": [],
+        "errores_omitidos": 0,
+        "truncado": False,
+    }
+
+    def error(numero, errores):
+        if len(resumen["errores"]) < MAXIMO_ERRORES:
+            resumen["errores"].append({"fila": numero, "errores": errores})
+        else:
+            resumen["errores_omitidos"] += 1
+
+    def vaciar(pendientes):
+        creados = insertar(pendientes, al_insertar)
+        resumen["creados"] += len(creados)
+        resumen["lotes"] += 1
+        resumen["ids"].extend(inc.pk for inc in creados)
+
+    pendientes = []
+
+    try:
+        for numero, dato, errores in filas:
+
+            if resumen["filas"] == MAXIMO_FILAS:
+                resumen["truncado"] = True
+                error(numero, {"fila": [f"Máximo {MAXIMO_FILAS} filas por carga."]})
+                break
+
+            resumen["filas"] += 1
+
+            if errores is None:
+                incidente, errores = validar(dato, usuario, estado_defecto)
+
+            if errores:
+                error(numero, errores)
+                continue
+
+            pendientes.append(incidente)
+
+            if len(pendientes) == LOTE:
+                vaciar(pendientes)
+                pendientes = []
+
+    except LecturaInterrumpida as e:
+        resumen["truncado"] = True
+        error(e.numero, {"fila": [str(e)]})
+
+    if pendientes:
+        vaciar(pendientes)
+
+    return resumen
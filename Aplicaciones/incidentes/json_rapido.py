@@ -0,0 +1,75 @@
+import ujson
+
+from django.conf import settings
+from rest_framework import renderers, parsers
+from rest_framework.exceptions import ParseError
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+
+# JSON con ujson para DRF (renderer y parser), el WebSocket y el streaming.
+# Lo que ujson no sabe codificar (datetime, date, UUID, timedelta, lazy
+# strings...) pasa por el mismo JSONEncoder de DRF, así la salida es la
+# misma que con el renderer estándar. Decimal: ujson lo escribe como
+# número, igual que JSONEncoder (los DecimalField de los serializers ya
+# salen como texto con COERCE_DECIMAL_TO_STRING).
+
+_encoder = JSONEncoder()
+
+
+def dumps(data):
+    '''
+    JSON compacto y unicode (str). ValueError con NaN o infinitos si
+    STRICT_JSON, como DRF.
+    '''
+    try:
+        return ujson.dumps(
+            data,
+            ensure_ascii=False,
+            escape_forward_slashes=False,
+            reject_bytes=False,
+            allow_nan=not api_settings.STRICT_JSON,
+            default=_encoder.default,
+        )
+    except OverflowError as e:
+        # ujson no distingue: stdlib json (y DRF) lanza ValueError
+        raise ValueError(f"Out of range float values are not JSON compliant: {e}") from e
+
+
+def loads(texto):
+    return ujson.loads(texto)
+
+
+class JSONRapidoRenderer(renderers.JSONRenderer):
+    '''
+    JSONRenderer con ujson. Con indentación (?indent / Accept: ...;
+    indent=4, la API navegable) usa el renderer estándar.
+    '''
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+
+        if data is None:
+            return b""
+
+        renderer_context = renderer_context or {}
+
+        if self.get_indent(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # U+2028/U+2029 son válidos en JSON pero no en JavaScript
+        ret = dumps(data).replace("\u2028", "\\u2028").replace("\u2029", "\\u2029")
+        return ret.encode()
+
+
+class JSONRapidoParser(parsers.JSONParser):
+
+    renderer_class = JSONRapidoRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get("encoding", settings.DEFAULT_CHARSET)
+
+        try:
+            return loads(stream.read().decode(encoding))
+        except ValueError as exc:
+            raise ParseError(f"JSON parse error - {exc}")
@@ -0,0 +1,301 @@
+import time
+import asyncio
+import logging
+import itertools
+import collections
+
+import msgpack
+
+from channels.exceptions import ChannelFull
+from channels.layers import InMemoryChannelLayer as BaseInMemoryChannelLayer
+from channels_redis.core import RedisChannelLayer as BaseRedisChannelLayer
+
+
+logger = logging.getLogger(__name__)
+
+
+# =======================
+# REDIS
+# =======================
+
+class RedisChannelLayer(BaseRedisChannelLayer):
+    '''
+    channels_redis con envío a varios grupos en una sola pasada:
+    un pipeline por shard para leer los grupos y un script por shard
+    para encolar el mensaje (un canal en varios grupos lo recibe una vez).
+
+    Además guarda un log acotado por grupo (un Redis Stream por grupo,
+    event_log_size entradas) con número de secuencia global, para que
+    un socket que se reconecta reciba solo lo que se perdió. El log vive
+    event_log_ttl segundos, independiente de group_expiry.
+    '''
+
+    def __init__(self, *args, event_log_size=500, event_log_ttl=86400, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.event_log_size = event_log_size
+        self.event_log_ttl = event_log_ttl
+
+    def _groups_by_connection(self, groups):
+        groups_by_connection = collections.defaultdict(list)
+        for group in groups:
+            groups_by_connection[self.consistent_hash(group)].append(group)
+        return groups_by_connection
+
+    async def group_add_many(self, groups, channel):
+        '''
+        group_add de varios grupos en un pipeline por shard. También
+        renueva la membresía (el score es la hora de alta).
+        '''
+        for group in groups:
+            assert self.require_valid_group_name(group), "Group name not valid"
+        assert self.require_valid_channel_name(channel), "Channel name not valid"
+
+        ahora = time.time()
+
+        for index, shard_groups in self._groups_by_connection(groups).items():
+            pipe = self.connection(index).pipeline()
+            for group in shard_groups:
+                key = self._group_key(group)
+                pipe.zadd(key, {channel: ahora})
+                pipe.expire(key, self.group_expiry)
+            await pipe.execute()
+
+    async def group_discard_many(self, groups, channel):
+
+        for group in groups:
+            assert self.require_valid_group_name(group), "Group name not valid"
+        assert self.require_valid_channel_name(channel), "Channel name not valid"
+
+        for index, shard_groups in self._groups_by_connection(groups).items():
+            pipe = self.connection(index).pipeline()
+            for group in shard_groups:
+                pipe.zrem(self._group_key(group), channel)
+            await pipe.execute()
+
+    group_send_many_lua = """
+        local over_capacity = 0
+        local cutoff = ARGV[#ARGV - 2]
+        local current_time = ARGV[#ARGV - 1]
+        local expiry = ARGV[#ARGV]
+        for i=1,#KEYS do
+            redis.call('ZREMRANGEBYSCORE', KEYS[i], 0, cutoff)
+            if redis.call('ZCOUNT', KEYS[i], '-inf', '+inf') < tonumber(ARGV[i + #KEYS]) then
+                redis.call('ZADD', KEYS[i], current_time, ARGV[i])
+                redis.call('EXPIRE', KEYS[i], expiry)
+            else
+                over_capacity = over_capacity + 1
+            end
+        end
+        return over_capacity
+    """
+
+    async def group_send_many(self, groups, message):
+
+        for group in groups:
+            assert self.require_valid_group_name(group), "Group name not valid"
+
+        # 1) miembros de todos los grupos, agrupados por shard
+        channel_names = {}
+        for index, shard_groups in self._groups_by_connection(groups).items():
+            pipe = self.connection(index).pipeline()
+            for group in shard_groups:
+                key = self._group_key(group)
+                pipe.zremrangebyscore(
+                    key, min=0, max=int(time.time()) - self.group_expiry
+                )
+                pipe.zrange(key, 0, -1)
+
+            results = await pipe.execute()
+
+            # resultados alternan zremrangebyscore / zrange
+            for members in results[1::2]:
+                for member in members:
+                    channel_names[member.decode("utf8")] = None
+
+        if not channel_names:
+            return
+
+        (
+            connection_to_channel_keys,
+            channel_keys_to_message,
+            channel_keys_to_capacity,
+        ) = self._map_channel_keys_to_connection(list(channel_names), message)
+
+        # 2) un solo EVAL por shard (limpieza de expirados incluida)
+        for index, channel_redis_keys in connection_to_channel_keys.items():
+
+            args = [channel_keys_to_message[key] for key in channel_redis_keys]
+            args += [channel_keys_to_capacity[key] for key in channel_redis_keys]
+            args += [
+                int(time.time()) - int(self.expiry),
+                time.time(),
+                self.expiry,
+            ]
+
+            over_capacity = await self.connection(index).eval(
+                self.group_send_many_lua,
+                len(channel_redis_keys),
+                *channel_redis_keys,
+                *args
+            )
+
+            if over_capacity > 0:
+                logger.info(
+                    "%s of %s channels over capacity in groups %s",
+                    over_capacity,
+                    len(channel_names),
+                    ", ".join(groups),
+                )
+
+    # INCR + XADD en todos los streams de forma atómica: los ids de
+    # cada stream quedan en orden aunque publiquen varios procesos.
+    # Al recortar se recuerda la secuencia descartada para detectar huecos.
+    registrar_evento_lua = """
+        local seq = redis.call('INCR', KEYS[1])
+        local id = seq .. '-0'
+        local maxlen = tonumber(ARGV[2])
+        local ttl = tonumber(ARGV[3])
+        for i=3,#KEYS do
+            if redis.call('XLEN', KEYS[i]) >= maxlen then
+                local oldest = redis.call('XRANGE', KEYS[i], '-', '+', 'COUNT', 1)
+                if #oldest > 0 then
+                    redis.call('HSET', KEYS[2], KEYS[i], string.match(oldest[1][1], '^(%d+)'))
+                end
+            end
+            redis.call('XADD', KEYS[i], 'MAXLEN', maxlen, id, 'd', ARGV[1])
+            redis.call('EXPIRE', KEYS[i], ttl)
+        end
+        redis.call('EXPIRE', KEYS[2], ttl)
+        return seq
+    """
+
+    def _event_key(self, name):
+        return f"{self.prefix}:eventos:{name}".encode("utf8")
+
+    def _event_connection(self):
+        # todo el log vive en un shard: el script necesita todas las claves
+        return self.connection(self.consistent_hash("eventos"))
+
+    async def seq_actual(self):
+        seq = await self._event_connection().get(self._event_key("_seq"))
+        return int(seq or 0)
+
+    async def registrar_evento(self, groups, data):
+        '''
+        Guarda el evento en el log de cada grupo y devuelve su secuencia.
+        '''
+        keys = [self._event_key("_seq"), self._event_key("_descartado")]
+        keys += [self._event_key(group) for group in groups]
+
+        return await self._event_connection().eval(
+            self.registrar_evento_lua,
+            len(keys),
+            *keys,
+            msgpack.packb(data),
+            self.event_log_size,
+            self.event_log_ttl,
+        )
+
+    async def eventos_desde(self, groups, seq):
+        '''
+        Eventos con secuencia > seq de los grupos dados, en orden.
+        None si alguno ya se recortó del log (el cliente debe resincronizar).
+        '''
+        keys = [self._event_key(group) for group in groups]
+
+        pipe = self._event_connection().pipeline()
+        pipe.hmget(self._event_key("_descartado"), keys)
+        for key in keys:
+            pipe.xrange(key, min=f"{seq + 1}-0", max="+")
+
+        descartados, *streams = await pipe.execute()
+
+        if any(d is not None and int(d) > seq for d in descartados):
+            return None
+
+        eventos = {}
+        for entries in streams:
+            for entry_id, fields in entries:
+                entry_seq = int(entry_id.split(b"-")[0])
+                eventos[entry_seq] = msgpack.unpackb(fields[b"d"])
+
+        return sorted(eventos.items())
+
+
+# =======================
+# EN MEMORIA (desarrollo / pruebas)
+# =======================
+
+class InMemoryChannelLayer(BaseInMemoryChannelLayer):
+
+    # event_log_ttl se acepta por compatibilidad de configuración: en
+    # memoria el log muere con el proceso
+    def __init__(self, *args, event_log_size=500, event_log_ttl=86400, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.event_log_size = event_log_size
+        self.event_logs = collections.defaultdict(
+            lambda: collections.deque(maxlen=self.event_log_size)
+        )
+        self.event_descartados = {}
+        self.event_seq = itertools.count(1)
+        self.event_ultimo = 0
+
+    async def seq_actual(self):
+        return self.event_ultimo
+
+    async def registrar_evento(self, groups, data):
+
+        seq = self.event_ultimo = next(self.event_seq)
+
+        for group in groups:
+            log = self.event_logs[group]
+            if len(log) == log.maxlen:
+                self.event_descartados[group] = log[0][0]
+            log.append((seq, data))
+
+        return seq
+
+    async def eventos_desde(self, groups, seq):
+
+        if any(self.event_descartados.get(group, 0) > seq for group in groups):
+            return None
+
+        eventos = {}
+        for group in groups:
+            for entry_seq, data in self.event_logs.get(group, ()):
+                if entry_seq > seq:
+                    eventos[entry_seq] = data
+
+        return sorted(eventos.items())
+
+    async def group_add_many(self, groups, channel):
+        for group in groups:
+            await self.group_add(group, channel)
+
+    async def group_discard_many(self, groups, channel):
+        for group in groups:
+            await self.group_discard(group, channel)
+
+    async def group_send_many(self, groups, message):
+
+        assert isinstance(message, dict), "Message is not a dict"
+        for group in groups:
+            self.require_valid_group_name(group)
+
+        self._clean_expired()
+
+        channels = {}
+        for group in groups:
+            for channel in self.groups.get(group, {}):
+                channels[channel] = None
+
+        ops = [
+            asyncio.create_task(self.send(channel, message))
+            for channel in channels
+        ]
+
+        for send_result in asyncio.as_completed(ops):
+            try:
+                await send_result
+            except ChannelFull:
+                pass
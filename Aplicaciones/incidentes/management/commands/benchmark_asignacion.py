@@ -0,0 +1,178 @@
+import time
+import os
+import tempfile
+import random
+import threading
+from collections import Counter
+
+from django.db import connection, transaction, OperationalError
+from django.db.models import Count
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+
+from Aplicaciones.incidentes.asignaciones import aplicar_asignacion
+from Aplicaciones.incidentes.models import (
+    Incidente, TipoIncidente, Severidad, EstadoIncidente,
+    Recurso, TipoRecurso, EstadoRecurso, Asignacion
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Contención en la asignación de recursos: N despachadores en "
+        "paralelo (hilos, cada uno con su conexión) compiten por un pool "
+        "pequeño en una base de pruebas; asignaciones/s, tasa de conflicto "
+        "y verificación de que ningún recurso se asignó dos veces"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--despachadores", type=int, default=50)
+        parser.add_argument("--recursos", type=int, default=10)
+        parser.add_argument("--por-pedido", type=int, default=3,
+                            help="recursos pedidos en cada intento (1..n)")
+        parser.add_argument("--segundos", type=float, default=10)
+        parser.add_argument("--retencion-ms", type=float, default=5,
+                            help="tiempo que se retiene lo ganado antes de soltarlo")
+        parser.add_argument("--pausa-ms", type=float, default=0,
+                            help="espera entre intentos de cada despachador")
+
+    def handle(self, *args, **options):
+
+        nombre_original = connection.settings_dict["NAME"]
+
+        # SQLite en memoria no se comparte entre hilos: archivo temporal
+        prueba = connection.settings_dict["TEST"]
+        if connection.vendor == "sqlite" and not prueba.get("NAME"):
+            prueba["NAME"] = os.path.join(tempfile.gettempdir(), "benchmark_asignacion.sqlite3")
+
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+        try:
+            incidentes, recursos = self.preparar(options)
+            resultado = self.medir(options, incidentes, recursos)
+            resultado["asignaciones_activas_duplicadas"] = (
+                Asignacion.objects
+                .values("recurso_id")
+                .annotate(n=Count("id"))
+                .filter(n__gt=1)
+                .count()
+            )
+        finally:
+            connection.creation.destroy_test_db(nombre_original, verbosity=0)
+
+        for clave, valor in resultado.items():
+            self.stdout.write(f"{clave:>32}: {valor}")
+
+    def preparar(self, options):
+
+        operador = User.objects.create_user("bench_operador", password=None)
+        tipo = TipoIncidente.objects.create(nombre="Bench")
+        severidad = Severidad.objects.create(nombre="Bench", nivel=1)
+        estado = EstadoIncidente.objects.create(nombre="Abierto")
+
+        EstadoRecurso.objects.create(nombre="Disponible")
+        EstadoRecurso.objects.create(nombre="Asignado")
+        tipo_recurso = TipoRecurso.objects.create(nombre="Ambulancia")
+        disponible = EstadoRecurso.objects.get(nombre="Disponible")
+
+        incidentes = [
+            Incidente.objects.create(
+                tipo=tipo, severidad=severidad, estado=estado,
+                descripcion=f"Despachador {i}", creado_por=operador
+            )
+            for i in range(options["despachadores"])
+        ]
+
+        recursos = [
+            Recurso.objects.create(
+                nombre=f"R{i}", tipo=tipo_recurso, estado=disponible, capacidad=1
+            ).id
+            for i in range(options["recursos"])
+        ]
+
+        return incidentes, recursos
+
+    def medir(self, options, incidentes, recursos):
+
+        contadores = Counter()
+        motivos = Counter()
+        tenencia = {}                   # recurso -> incidente que lo tiene
+        lock = threading.Lock()
+        fin = time.monotonic() + options["segundos"]
+        retencion = options["retencion_ms"] / 1000
+        por_pedido = options["por_pedido"]
+        pausa = options["pausa_ms"] / 1000
+
+        def con_reintento(funcion):
+            # SQLite: "database is locked" si otra escritura no soltó a tiempo
+            while True:
+                try:
+                    with transaction.atomic():
+                        return funcion()
+                except OperationalError:
+                    with lock:
+                        contadores["reintentos_bloqueo"] += 1
+                    time.sleep(0.001)
+
+        def despachador(inc):
+            azar = random.Random(inc.id)
+
+            try:
+                while time.monotonic() < fin:
+
+                    pedidos = set(azar.sample(recursos, azar.randint(1, por_pedido)))
+                    diff = con_reintento(lambda: aplicar_asignacion(inc, pedidos, set()))
+                    ganados = set(diff["asignados"])
+
+                    with lock:
+                        contadores["intentos"] += 1
+                        contadores["recursos_pedidos"] += len(pedidos)
+                        contadores["recursos_asignados"] += len(ganados)
+                        contadores["conflictos"] += len(diff["conflictos"])
+                        motivos.update(c["motivo"] for c in diff["conflictos"])
+                        for rid in ganados:
+                            if rid in tenencia:
+                                contadores["dobles_asignaciones"] += 1
+                            tenencia[rid] = inc.id
+
+                    if not ganados:
+                        time.sleep(pausa)
+                        continue
+
+                    time.sleep(retencion)
+
+                    # se suelta antes del commit: nadie lo ve libre antes
+                    with lock:
+                        for rid in ganados:
+                            tenencia.pop(rid, None)
+
+                    con_reintento(lambda: aplicar_asignacion(inc, set(), ganados))
+            finally:
+                connection.close()
+
+        hilos = [
+            threading.Thread(target=despachador, args=(inc,))
+            for inc in incidentes
+        ]
+
+        inicio = time.monotonic()
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        duracion = time.monotonic() - inicio
+
+        pedidos = contadores["recursos_pedidos"] or 1
+
+        return {
+            "motor": connection.vendor,
+            "despachadores": options["despachadores"],
+            "recursos_en_pool": len(recursos),
+            "duracion_s": round(duracion, 2),
+            "intentos": contadores["intentos"],
+            "asignaciones_por_s": round(contadores["recursos_asignados"] / duracion, 1),
+            "tasa_conflicto": round(contadores["conflictos"] / pedidos, 3),
+            "reintentos_bloqueo": contadores["reintentos_bloqueo"],
+            "dobles_asignaciones": contadores["dobles_asignaciones"],
+            "conflictos_por_motivo": dict(motivos),
+        }
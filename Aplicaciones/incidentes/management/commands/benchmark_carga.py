@@ -0,0 +1,269 @@
+import gc
+import os
+import json
+import time
+import asyncio
+import subprocess
+import tempfile
+import tracemalloc
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connection
+from django.test import override_settings
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from channels.testing import HttpCommunicator, WebsocketCommunicator
+
+from Aplicaciones.accounts.jwt import generar_tokens
+from Aplicaciones.incidentes.models import (
+    Incidente, TipoIncidente, Severidad, EstadoIncidente
+)
+
+
+ROLES = ["admin", "operador", "rescatista", "auditor"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Prueba de carga de core.asgi.application (rutas y JwtAuthMiddleware "
+        "reales) en una base de pruebas: N sockets por roles, escrituras a "
+        "cambiar_estado a tasa fija; latencia de entrega p50/p99, mensajes/s, "
+        "memoria por conexión y mensajes perdidos, guardados en JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--conexiones", type=int, default=500)
+        parser.add_argument("--escrituras", type=int, default=50)
+        parser.add_argument("--tasa", type=float, default=10, help="escrituras/s")
+        parser.add_argument("--layer", choices=["memoria", "redis"], default="memoria")
+        parser.add_argument(
+            "--ventana-ms", type=int, default=None,
+            help="REALTIME_COALESCE_MS durante la prueba (por defecto el de settings)"
+        )
+        parser.add_argument("--espera", type=float, default=10,
+                            help="segundos a esperar los últimos eventos")
+        parser.add_argument(
+            "--salida",
+            default=os.path.join(tempfile.gettempdir(), "benchmark_carga.json"),
+            help="informe JSON (por defecto en el directorio temporal)"
+        )
+
+    def handle(self, *args, **options):
+
+        # base de pruebas: nunca se escribe en la base real
+        nombre_original = connection.settings_dict["NAME"]
+
+        # SQLite en memoria se bloquea con varios hilos escribiendo (cada
+        # request ASGI corre en el suyo): se usa un archivo temporal
+        prueba = connection.settings_dict["TEST"]
+        if connection.vendor == "sqlite" and not prueba.get("NAME"):
+            prueba["NAME"] = os.path.join(tempfile.gettempdir(), "benchmark_carga.sqlite3")
+
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+        try:
+            with override_settings(**self.ajustes(options)):
+                tokens, incidentes, estados = self.preparar(options)
+                resultado = asyncio.run(
+                    self.medir(options, tokens, incidentes, estados)
+                )
+        finally:
+            connection.creation.destroy_test_db(nombre_original, verbosity=0)
+
+        informe = {
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+            "commit": self.commit(),
+            "parametros": {
+                clave: options[clave]
+                for clave in ["conexiones", "escrituras", "tasa", "layer", "ventana_ms"]
+            },
+            "resultados": resultado,
+        }
+
+        with open(options["salida"], "w") as archivo:
+            json.dump(informe, archivo, indent=2)
+
+        for clave, valor in resultado.items():
+            self.stdout.write(f"{clave:>28}: {valor}")
+
+        self.stdout.write(self.style.SUCCESS(f"Guardado en {options['salida']}"))
+
+    def ajustes(self, options):
+
+        ajustes = {
+            # sin pings: solo se cuentan los eventos
+            "REALTIME_PING_S": 0,
+        }
+
+        if options["layer"] == "memoria":
+            ajustes["CHANNEL_LAYERS"] = {
+                "default": {
+                    "BACKEND": "Aplicaciones.incidentes.layers.InMemoryChannelLayer",
+                    "CONFIG": {"capacity": 1000},
+                }
+            }
+
+        if options["ventana_ms"] is not None:
+            ajustes["REALTIME_COALESCE_MS"] = options["ventana_ms"]
+
+        return ajustes
+
+    def preparar(self, options):
+
+        usuarios = []
+        for rol in ROLES:
+            user = User.objects.create_user(f"carga_{rol}", password=None)
+            user.perfil.rol = rol
+            user.perfil.save()
+            usuarios.append(user)
+
+        # un token por rol; los sockets se reparten entre ellos
+        tokens = {user.perfil.rol: generar_tokens(user)["access"] for user in usuarios}
+
+        tipo = TipoIncidente.objects.create(nombre="Carga")
+        severidad = Severidad.objects.create(nombre="Carga", nivel=1)
+        estados = [
+            EstadoIncidente.objects.create(nombre="Carga A").id,
+            EstadoIncidente.objects.create(nombre="Carga B").id,
+        ]
+
+        # un incidente por escritura: ningún evento se funde con otro
+        incidentes = Incidente.objects.bulk_create([
+            Incidente(
+                tipo=tipo,
+                severidad=severidad,
+                estado_id=estados[0],
+                descripcion=f"Carga {i}",
+                creado_por=usuarios[0],
+            )
+            for i in range(options["escrituras"])
+        ])
+
+        return tokens, [inc.id for inc in incidentes], estados
+
+    async def medir(self, options, tokens, incidentes, estados):
+
+        from core.asgi import application
+
+        n = options["conexiones"]
+        roles = list(tokens)
+
+        # ---- conexiones ----
+        gc.collect()
+        tracemalloc.start()
+        memoria_antes = tracemalloc.get_traced_memory()[0]
+        inicio = time.perf_counter()
+
+        sockets = []
+        for i in range(n):
+            rol = roles[i % len(roles)]
+            socket = WebsocketCommunicator(
+                application, f"/ws/incidentes/?token={tokens[rol]}"
+            )
+            conectado, _ = await socket.connect()
+            if not conectado:
+                raise RuntimeError(f"No se pudo conectar el socket {i} ({rol})")
+            await socket.receive_output(5)      # "conectado"
+            sockets.append(socket)
+
+        tiempo_conexion = time.perf_counter() - inicio
+        gc.collect()
+        memoria_por_conexion = (tracemalloc.get_traced_memory()[0] - memoria_antes) / n
+        tracemalloc.stop()
+
+        # ---- escrituras y recepción ----
+        enviados = {}           # incidente -> instante de la escritura
+        latencias = []
+        errores_http = []
+
+        async def recibir(socket):
+            pendientes = len(incidentes)
+            while pendientes:
+                try:
+                    salida = await socket.receive_output(options["espera"])
+                except asyncio.TimeoutError:
+                    return
+                data = json.loads(salida.get("text") or "{}")
+                if data.get("accion") == "incidente_update" and data.get("id") in enviados:
+                    latencias.append(time.perf_counter() - enviados[data["id"]])
+                    pendientes -= 1
+
+        async def escribir(incidente):
+            cuerpo = json.dumps({"estado": estados[1]}).encode()
+            peticion = HttpCommunicator(
+                application,
+                "PUT",
+                f"/api/incidentes/{incidente}/estado/",
+                body=cuerpo,
+                headers=[
+                    (b"host", b"localhost"),
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(cuerpo)).encode()),
+                    (b"authorization", f"Bearer {tokens['operador']}".encode()),
+                ],
+            )
+            # la auditoría registra la IP del cliente
+            peticion.scope["client"] = ("127.0.0.1", 0)
+
+            enviados[incidente] = time.perf_counter()
+            respuesta = await peticion.get_response(timeout=30)
+            await peticion.send_input({"type": "http.disconnect"})
+            await peticion.wait()
+            if respuesta["status"] != 200:
+                errores_http.append(respuesta["status"])
+
+        receptores = [asyncio.ensure_future(recibir(socket)) for socket in sockets]
+
+        inicio = time.perf_counter()
+        escrituras = []
+        for i, incidente in enumerate(incidentes):
+            # tasa fija: cada escritura sale a su hora aunque la anterior no termine
+            retraso = inicio + i / options["tasa"] - time.perf_counter()
+            if retraso > 0:
+                await asyncio.sleep(retraso)
+            escrituras.append(asyncio.ensure_future(escribir(incidente)))
+
+        await asyncio.gather(*escrituras)
+        await asyncio.gather(*receptores)
+        duracion = time.perf_counter() - inicio
+
+        # al vencer la espera el communicator ya cerró la aplicación
+        for socket in sockets:
+            if not socket.future.done():
+                await socket.disconnect()
+
+        esperados = n * len(incidentes)
+        latencias.sort()
+
+        return {
+            "conexiones": n,
+            "tiempo_conexion_s": round(tiempo_conexion, 3),
+            "memoria_por_conexion_kb": round(memoria_por_conexion / 1024, 1),
+            "escrituras": len(incidentes),
+            "errores_http": len(errores_http),
+            "mensajes_esperados": esperados,
+            "mensajes_recibidos": len(latencias),
+            "mensajes_perdidos": esperados - len(latencias),
+            "mensajes_por_s": round(len(latencias) / duracion, 1),
+            "latencia_p50_ms": self.percentil(latencias, 50),
+            "latencia_p99_ms": self.percentil(latencias, 99),
+            "latencia_max_ms": self.percentil(latencias, 100),
+            "ventana_ms": getattr(settings, "REALTIME_COALESCE_MS", 0),
+        }
+
+    def percentil(self, valores, p):
+        if not valores:
+            return None
+        indice = min(len(valores) - 1, int(len(valores) * p / 100))
+        return round(valores[indice] * 1000, 1)
+
+    def commit(self):
+        try:
+            return subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"],
+                capture_output=True, text=True, check=True,
+                cwd=settings.BASE_DIR,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
@@ -0,0 +1,113 @@
+import time
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from Aplicaciones.incidentes.codificacion import SUBPROTOCOLOS
+from Aplicaciones.incidentes.consumers import IncidenteConsumer
+from Aplicaciones.incidentes.realtime import evento_precodificado
+
+
+class Command(BaseCommand):
+    help = (
+        "CPU por evento al repartir un delta a N sockets de un proceso: "
+        "codificando en cada consumer vs. frame precodificado en el productor"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--conexiones", type=int, nargs="+", default=[1000, 5000, 10000]
+        )
+        parser.add_argument("--eventos", type=int, default=20)
+        parser.add_argument(
+            "--subprotocolo", choices=SUBPROTOCOLOS, default="json"
+        )
+
+    def handle(self, *args, **options):
+        asyncio.run(self.medir(options))
+
+    async def medir(self, options):
+
+        subprotocolo = options["subprotocolo"]
+        eventos = options["eventos"]
+
+        self.stdout.write(
+            f"subprotocolo={subprotocolo} eventos={eventos} "
+            f"(µs de CPU por evento, solo el proceso de los consumers)"
+        )
+        self.stdout.write(
+            f"{'conexiones':>10} {'por consumer':>14} {'precodificado':>14} {'x':>6}"
+        )
+
+        for n in options["conexiones"]:
+
+            consumers = [self.consumer(subprotocolo) for _ in range(n)]
+
+            # antes: cada consumer codifica el mismo dict
+            inicio = time.process_time()
+            for i in range(eventos):
+                data = self.delta(i)
+                for consumer in consumers:
+                    await consumer.enviar_frame(data)
+            por_consumer = (time.process_time() - inicio) / eventos
+
+            # ahora: una codificación por evento, los consumers solo escriben
+            inicio = time.process_time()
+            for i in range(eventos):
+                evento = evento_precodificado(self.delta(i))
+                for consumer in consumers:
+                    await consumer.enviar_evento(evento)
+            precodificado = (time.process_time() - inicio) / eventos
+
+            self.stdout.write(
+                f"{n:>10} {por_consumer * 1e6:>14.0f} {precodificado * 1e6:>14.0f} "
+                f"{por_consumer / precodificado:>6.1f}"
+            )
+
+    def consumer(self, subprotocolo):
+        '''
+        Consumer ya conectado, sin socket: send() descarta el frame.
+        '''
+        consumer = IncidenteConsumer()
+        consumer.subprotocolo = subprotocolo
+        consumer.ventana = 0
+        consumer.pendientes = {}
+        consumer.reproducidos = set()
+        consumer.eventos_fusionados = 0
+
+        async def send(text_data=None, bytes_data=None, close=False):
+            pass
+
+        consumer.send = send
+        return consumer
+
+    def delta(self, i):
+        # tamaño parecido al de un incidente serializado
+        return {
+            "accion": "incidente_update",
+            "op": "upsert",
+            "id": i,
+            "version": 1,
+            "critico": False,
+            "seq": i,
+            "incidente": {
+                "id": i,
+                "tipo": 1,
+                "severidad": 2,
+                "estado": 1,
+                "descripcion": "Inundación en el sector norte, varias familias afectadas",
+                "latitud": "-0.180653",
+                "longitud": "-78.467834",
+                "evidencia": None,
+                "creado_por": "operador",
+                "rescatista": None,
+                "tipo_nombre": "Inundación",
+                "severidad_nombre": "Alta",
+                "estado_nombre": "Abierto",
+                "rescatista_username": None,
+                "activo": True,
+                "fecha_creacion": "2026-01-15T10:32:11.123456-05:00",
+                "fecha_borrado": None,
+                "version": 1,
+            },
+        }
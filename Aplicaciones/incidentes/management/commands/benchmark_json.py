@@ -0,0 +1,116 @@
+import io
+import json
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from Aplicaciones.incidentes.json_rapido import (
+    JSONRapidoRenderer, JSONRapidoParser, dumps
+)
+from Aplicaciones.incidentes.models import (
+    Incidente, TipoIncidente, Severidad, EstadoIncidente
+)
+from Aplicaciones.incidentes.serializers import IncidenteSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Tiempo de codificar/decodificar listas de incidentes: renderer y "
+        "parser JSON de DRF (json) vs. json_rapido (ujson), y un evento WS"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--incidentes", type=int, nargs="+", default=[50, 1000, 10000]
+        )
+        parser.add_argument("--repeticiones", type=int, default=20)
+
+    def handle(self, *args, **options):
+
+        repeticiones = options["repeticiones"]
+
+        self.stdout.write(f"repeticiones={repeticiones} (ms por operación)")
+        self.stdout.write(
+            f"{'incidentes':>10} {'bytes':>10} "
+            f"{'render DRF':>11} {'ujson':>8} {'x':>5} "
+            f"{'parse DRF':>10} {'ujson':>8} {'x':>5}"
+        )
+
+        for n in options["incidentes"]:
+
+            data = self.lista(n)
+
+            estandar = JSONRenderer().render(data)
+            rapido = JSONRapidoRenderer().render(data)
+
+            # misma salida salvo espacios / escapes: se compara decodificada
+            assert json.loads(estandar) == json.loads(rapido)
+
+            render_drf = self.medir(lambda: JSONRenderer().render(data), repeticiones)
+            render_rapido = self.medir(lambda: JSONRapidoRenderer().render(data), repeticiones)
+
+            parse_drf = self.medir(lambda: JSONParser().parse(io.BytesIO(estandar)), repeticiones)
+            parse_rapido = self.medir(lambda: JSONRapidoParser().parse(io.BytesIO(estandar)), repeticiones)
+
+            self.stdout.write(
+                f"{n:>10} {len(rapido):>10} "
+                f"{render_drf:>11.2f} {render_rapido:>8.2f} {render_drf / render_rapido:>5.1f} "
+                f"{parse_drf:>10.2f} {parse_rapido:>8.2f} {parse_drf / parse_rapido:>5.1f}"
+            )
+
+        # envío del consumer: un delta por evento
+        evento = {
+            "accion": "incidente_update", "op": "upsert", "id": 1,
+            "version": 1, "seq": 1, "incidente": self.lista(1)[0]
+        }
+        ws_json = self.medir(lambda: json.dumps(evento), repeticiones * 1000) * 1000
+        ws_rapido = self.medir(lambda: dumps(evento), repeticiones * 1000) * 1000
+
+        self.stdout.write(
+            f"evento WS: json {ws_json:.1f} µs, ujson {ws_rapido:.1f} µs "
+            f"(x{ws_json / ws_rapido:.1f})"
+        )
+
+    def medir(self, funcion, repeticiones):
+        inicio = time.perf_counter()
+        for _ in range(repeticiones):
+            funcion()
+        return (time.perf_counter() - inicio) / repeticiones * 1000
+
+    def lista(self, n):
+        '''
+        Salida real de IncidenteSerializer sobre instancias en memoria
+        (sin base de datos): Decimal, datetime, FKs y nombres.
+        '''
+        tipos = [TipoIncidente(id=1, nombre="Inundación"), TipoIncidente(id=2, nombre="Incendio forestal")]
+        severidades = [Severidad(id=1, nombre="Media", nivel=2), Severidad(id=2, nombre="Alta", nivel=4)]
+        estado = EstadoIncidente(id=1, nombre="Abierto")
+        operador = User(id=1, username="operador")
+        ahora = timezone.now()
+
+        incidentes = []
+
+        for i in range(n):
+            inc = Incidente(
+                id=i + 1,
+                tipo=tipos[i % 2],
+                severidad=severidades[i % 2],
+                estado=estado,
+                descripcion=f"Reporte {i}: calle anegada, 3 familias evacuadas «sector norte»",
+                latitud=Decimal("-0.180653") + Decimal(i) / 10**6,
+                longitud=Decimal("-78.467834"),
+                creado_por=operador,
+                fecha_creacion=ahora - timedelta(minutes=i),
+                version=1 + i % 5,
+                activo=True,
+            )
+            inc.recursos_activos = i % 3
+            incidentes.append(inc)
+
+        return IncidenteSerializer(incidentes, many=True).data
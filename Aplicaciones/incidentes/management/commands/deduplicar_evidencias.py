@@ -0,0 +1,220 @@
+import os
+import time
+import posixpath
+from collections import Counter, defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from Aplicaciones.incidentes.almacenamiento import digest_de, sha256_de
+from Aplicaciones.incidentes.models import Incidente, BlobEvidencia
+
+
+# blobs sin referencias o archivos sueltos más nuevos que esto pueden ser
+# de una subida en curso (archivo escrito, transacción sin confirmar)
+GRACIA_S = 3600
+
+
+class Command(BaseCommand):
+    help = (
+        "Almacén de evidencias por contenido: pasa los archivos antiguos "
+        "(uno por subida) a blobs sha256, recalcula las referencias, borra "
+        "los blobs que ya no usa ningún incidente y, con --verificar, "
+        "comprueba el hash de cada uno"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--simular", action="store_true",
+                            help="solo informa, no cambia nada")
+        parser.add_argument("--verificar", action="store_true",
+                            help="recalcula el sha256 de cada blob y lo compara con su nombre")
+
+    def handle(self, *args, **options):
+
+        campo = Incidente._meta.get_field("evidencia")
+        self.almacen = campo.storage
+        self.carpeta = campo.upload_to.strip("/")
+        self.simular = options["simular"]
+        self.resultado = Counter()
+
+        self.migrar_antiguos()
+        self.recontar()
+        self.recoger_huerfanos()
+
+        if options["verificar"]:
+            self.verificar()
+
+        for clave, valor in sorted(self.resultado.items()):
+            self.stdout.write(f"{clave:>28}: {valor}")
+
+        if self.simular:
+            self.stdout.write(self.style.WARNING("--simular: no se cambió nada"))
+
+    def en_uso(self):
+        # los borrados lógicos conservan su evidencia
+        return (
+            Incidente.all_objects
+            .exclude(evidencia="")
+            .exclude(evidencia__isnull=True)
+        )
+
+    def reciente(self, nombre):
+        try:
+            return time.time() - os.path.getmtime(self.almacen.path(nombre)) < GRACIA_S
+        except FileNotFoundError:
+            return False
+
+    # ---------------- 1) ARCHIVOS ANTIGUOS ----------------
+
+    def migrar_antiguos(self):
+
+        antiguos = defaultdict(list)        # nombre -> ids de incidentes
+        for id_, nombre in self.en_uso().values_list("id", "evidencia"):
+            if digest_de(nombre) is None:
+                antiguos[nombre].append(id_)
+
+        vistos = set()
+
+        for nombre, ids in sorted(antiguos.items()):
+
+            if not self.almacen.exists(nombre):
+                self.resultado["antiguos_faltantes"] += 1
+                self.stderr.write(f"Falta {nombre} (incidentes {ids})")
+                continue
+
+            tamano = self.almacen.size(nombre)
+            self.resultado["antiguos_archivos"] += 1
+            self.resultado["antiguos_bytes"] += tamano
+
+            if self.simular:
+                with self.almacen.open(nombre) as archivo:
+                    digest = sha256_de(archivo)
+                if digest not in vistos and not self.almacen.buscar(self.carpeta, digest):
+                    self.resultado["antiguos_bytes_unicos"] += tamano
+                vistos.add(digest)
+                continue
+
+            with self.almacen.open(nombre) as archivo:
+                nuevo = self.almacen.save(nombre, archivo)
+
+            # .update(): las referencias se recalculan en el paso 2
+            with transaction.atomic():
+                Incidente.all_objects.filter(id__in=ids).update(evidencia=nuevo)
+
+            self.almacen.borrar_blob(nombre)
+
+    # ---------------- 2) REFERENCIAS ----------------
+
+    def recontar(self):
+
+        usados = {
+            nombre: n
+            for nombre, n in (
+                self.en_uso()
+                .values("evidencia")
+                .annotate(n=Count("id"))
+                .values_list("evidencia", "n")
+            )
+            if digest_de(nombre)
+        }
+
+        por_digest = {digest_de(nombre): (nombre, n) for nombre, n in usados.items()}
+
+        with transaction.atomic():
+
+            blobs = {b.digest: b for b in BlobEvidencia.objects.select_for_update()}
+
+            for digest, (nombre, n) in por_digest.items():
+
+                blob = blobs.get(digest)
+
+                if blob is None:
+                    if not self.almacen.exists(nombre):
+                        self.resultado["blobs_faltantes"] += 1
+                        self.stderr.write(f"Falta el blob {nombre}")
+                        continue
+                    self.resultado["blobs_sin_fila"] += 1
+                    if not self.simular:
+                        BlobEvidencia.objects.create(
+                            digest=digest,
+                            nombre=nombre,
+                            tamano=self.almacen.size(nombre),
+                            referencias=n
+                        )
+
+                elif blob.referencias != n:
+                    self.resultado["referencias_corregidas"] += 1
+                    if not self.simular:
+                        BlobEvidencia.objects.filter(pk=blob.pk).update(referencias=n)
+
+            # sin ningún incidente: se recogen (salvo los recién usados)
+            for digest, blob in blobs.items():
+                if digest in por_digest or self.reciente(blob.nombre):
+                    continue
+                self.resultado["blobs_recogidos"] += 1
+                self.resultado["bytes_liberados"] += blob.tamano
+                if not self.simular:
+                    blob.delete()
+                    transaction.on_commit(lambda nombre=blob.nombre: self.almacen.borrar_blob(nombre))
+
+        self.resultado["blobs"] = len(por_digest)
+        self.resultado["referencias"] = sum(usados.values())
+
+    # ---------------- 3) ARCHIVOS SUELTOS ----------------
+
+    def recoger_huerfanos(self):
+        '''
+        Blobs en disco sin fila (subidas revertidas) y temporales viejos.
+        '''
+        conocidos = set(BlobEvidencia.objects.values_list("nombre", flat=True))
+
+        try:
+            subcarpetas = self.almacen.listdir(self.carpeta)[0]
+        except FileNotFoundError:
+            return
+
+        for subcarpeta in subcarpetas:
+            if len(subcarpeta) != 2:
+                continue
+
+            directorio = posixpath.join(self.carpeta, subcarpeta)
+
+            for archivo in self.almacen.listdir(directorio)[1]:
+                nombre = posixpath.join(directorio, archivo)
+
+                if nombre in conocidos or self.reciente(nombre):
+                    continue
+
+                self.resultado["huerfanos_recogidos"] += 1
+                self.resultado["bytes_liberados"] += self.almacen.size(nombre)
+                if not self.simular:
+                    self.almacen.borrar_blob(nombre)
+
+        # temporales de subidas interrumpidas, junto a los antiguos
+        for archivo in self.almacen.listdir(self.carpeta)[1]:
+            nombre = posixpath.join(self.carpeta, archivo)
+            if archivo.startswith(".subida-") and not self.reciente(nombre):
+                self.resultado["temporales_recogidos"] += 1
+                if not self.simular:
+                    self.almacen.borrar_blob(nombre)
+
+    # ---------------- 4) INTEGRIDAD ----------------
+
+    def verificar(self):
+
+        for blob in BlobEvidencia.objects.order_by("id").iterator():
+
+            if not self.almacen.exists(blob.nombre):
+                self.resultado["verificar_faltantes"] += 1
+                self.stderr.write(f"Falta el blob {blob.nombre}")
+                continue
+
+            with self.almacen.open(blob.nombre) as archivo:
+                digest = sha256_de(archivo)
+
+            if digest == blob.digest:
+                self.resultado["verificar_ok"] += 1
+            else:
+                self.resultado["verificar_corruptos"] += 1
+                self.stderr.write(f"Hash distinto: {blob.nombre} ({digest})")
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from Aplicaciones.incidentes import busqueda
+from Aplicaciones.incidentes.models import Incidente
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconstruye el índice de búsqueda de incidentes (después de "
+        "cargas masivas o .update() que no pasan por las señales)"
+    )
+
+    def handle(self, *args, **options):
+
+        if not busqueda.disponible():
+            raise CommandError(
+                f"Sin índice de texto completo para {connection.vendor}: "
+                "la búsqueda usa icontains"
+            )
+
+        inicio = time.perf_counter()
+
+        with transaction.atomic():
+            busqueda.reindexar()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{Incidente.objects.count()} incidentes activos indexados "
+            f"en {(time.perf_counter() - inicio) * 1000:.0f} ms"
+        ))
@@ -1,41 +1,58 @@
 from urllib.parse import parse_qs
-from channels.db import database_sync_to_async
-from rest_framework_simplejwt.tokens import AccessToken
 import json
+import asyncio
 from .models import AuditoriaAccion
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+from .realtime import enviar_ws, registrar_loop_principal, iniciar_control
+from Aplicaciones.accounts.jwt import tokens_verificados
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.models import TokenUser
 
 def enviar_ws_auditoria(data):
-    channel_layer = get_channel_layer()
 
-    async_to_sync(channel_layer.group_send)(
-        "auditoria",
+    # firehose para admin/auditor + tema del incidente afectado
+    grupos = ["auditoria"]
+    if data.get("tabla") == "incidente" and data.get("registro_id"):
+        grupos.append(f"auditoria_incidente_{data['registro_id']}")
+
+    enviar_ws(
+        grupos,
         {
-            "type": "enviar_evento",
-            "data": {
-                "accion": "auditoria_update",
-                "payload": data
-            }
+            "accion": "auditoria_update",
+            "payload": data
         }
     )
 
-@database_sync_to_async
-def get_user_from_token(token: str):
+async def get_user_from_token(token: str):
+    '''
+    Usuario armado solo con los claims del token (rol incluido): el
+    handshake no consulta la base de datos. Los tokens ya verificados
+    se sirven desde la caché en memoria; los demás se verifican fuera
+    del event loop.
+    '''
+    from django.contrib.auth.models import AnonymousUser
+
     try:
-        from django.contrib.auth import get_user_model
-        from django.contrib.auth.models import AnonymousUser
+        claims = await tokens_verificados.averificar(token)
+    except TokenError:
+        return AnonymousUser()
 
-        User = get_user_model()
+    return TokenUser(claims)
 
-        validated = AccessToken(token)
-        user_id = validated.get("user_id")
 
-        return User.objects.get(id=user_id)
+class LoopPrincipalMiddleware:
+    '''
+    Registra el loop del servidor ASGI para que los eventos publicados
+    desde las vistas (hilos sync) se envíen en él sin bloquear.
+    '''
 
-    except Exception:
-        from django.contrib.auth.models import AnonymousUser
-        return AnonymousUser()
+    def __init__(self, inner):
+        self.inner = inner
+
+    async def __call__(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        registrar_loop_principal(loop)
+        iniciar_control(loop)
+        return await self.inner(scope, receive, send)
 
 
 class JwtAuthMiddleware:
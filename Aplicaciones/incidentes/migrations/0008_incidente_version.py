@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-18 19:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('incidentes', '0007_incidente_rescatista'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='incidente',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 6.0.1 on 2026-10-18 19:33
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('incidentes', '0008_incidente_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='incidente',
+            index=models.Index(fields=['fecha_creacion', 'id'], name='incidente_fecha_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incidente',
+            index=models.Index(fields=['estado', 'fecha_creacion', 'id'], name='incidente_estado_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incidente',
+            index=models.Index(fields=['severidad', 'fecha_creacion', 'id'], name='incidente_sever_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incidente',
+            index=models.Index(fields=['tipo', 'fecha_creacion', 'id'], name='incidente_tipo_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incidente',
+            index=models.Index(fields=['activo', 'fecha_creacion', 'id'], name='incidente_activo_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incidente',
+            index=models.Index(fields=['rescatista', 'fecha_creacion', 'id'], name='incidente_resc_fecha_idx'),
+        ),
+    ]
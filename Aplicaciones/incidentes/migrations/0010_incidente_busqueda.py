@@ -0,0 +1,69 @@
+# Generated by Django 6.0.1 on 2026-10-18 20:05
+
+from django.db import migrations
+
+
+# Índice de texto completo de incidentes (ver busqueda.py). El SQL vive
+# aquí y no en busqueda.py: la migración no cambia si el módulo cambia.
+
+TABLA = "incidentes_busqueda"
+
+
+def crear(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+
+    incidente = apps.get_model("incidentes", "Incidente")._meta.db_table
+    tipo = apps.get_model("incidentes", "TipoIncidente")._meta.db_table
+    estado = apps.get_model("incidentes", "EstadoIncidente")._meta.db_table
+
+    seleccion = (
+        f"FROM {incidente} i "
+        f"JOIN {tipo} ti ON ti.id = i.tipo_id "
+        f"JOIN {estado} es ON es.id = i.estado_id "
+        "WHERE i.activo"
+    )
+
+    if vendor == "sqlite":
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {TABLA} USING fts5("
+            "descripcion, tipo, estado, "
+            "tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(
+            f"INSERT INTO {TABLA} (rowid, descripcion, tipo, estado) "
+            f"SELECT i.id, i.descripcion, ti.nombre, es.nombre {seleccion}"
+        )
+
+    elif vendor == "postgresql":
+        schema_editor.execute(
+            f"CREATE TABLE {TABLA} ("
+            "incidente_id bigint PRIMARY KEY, "
+            "documento tsvector NOT NULL)"
+        )
+        schema_editor.execute(
+            f"CREATE INDEX {TABLA}_documento_gin ON {TABLA} USING GIN (documento)"
+        )
+        schema_editor.execute(
+            f"INSERT INTO {TABLA} (incidente_id, documento) "
+            "SELECT i.id, "
+            "setweight(to_tsvector('spanish', coalesce(i.descripcion, '')), 'A') || "
+            "setweight(to_tsvector('spanish', ti.nombre || ' ' || es.nombre), 'B') "
+            f"{seleccion}"
+        )
+
+
+def borrar(apps, schema_editor):
+    if schema_editor.connection.vendor in ("sqlite", "postgresql"):
+        schema_editor.execute(f"DROP TABLE IF EXISTS {TABLA}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('incidentes', '0009_incidente_indices_listado'),
+    ]
+
+    operations = [
+        # FTS5 en SQLite, tsvector/GIN en PostgreSQL; otros motores: nada
+        migrations.RunPython(crear, borrar),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 6.0.1 on 2026-10-18 20:20
+
+from django.db import migrations, models
+from django.db.models import Max
+from django.utils import timezone
+
+
+def cerrar_duplicadas(apps, schema_editor):
+    '''
+    Antes del índice único: si un recurso tiene varias asignaciones
+    activas, queda activa la más reciente y las demás se cierran.
+    '''
+    Asignacion = apps.get_model("incidentes", "Asignacion")
+
+    ultimas = (
+        Asignacion.objects
+        .filter(activo=True)
+        .values("recurso_id")
+        .annotate(ultima=Max("id"))
+        .values_list("ultima", flat=True)
+    )
+
+    Asignacion.objects.filter(activo=True).exclude(id__in=list(ultimas)).update(
+        activo=False,
+        fecha_borrado=timezone.now()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('incidentes', '0010_incidente_busqueda'),
+    ]
+
+    operations = [
+        migrations.RunPython(cerrar_duplicadas, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='asignacion',
+            constraint=models.UniqueConstraint(condition=models.Q(('activo', True)), fields=('recurso',), name='asignacion_recurso_activa_unica'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 6.0.1 on 2026-10-18 20:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('incidentes', '0011_asignacion_recurso_activa_unica'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recurso',
+            name='fecha_posicion',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='recurso',
+            name='latitud',
+            field=models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True),
+        ),
+        migrations.AddField(
+            model_name='recurso',
+            name='longitud',
+            field=models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True),
+        ),
+    ]
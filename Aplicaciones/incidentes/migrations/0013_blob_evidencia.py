@@ -0,0 +1,30 @@
+# Generated by Django 6.0.1 on 2026-10-18 21:02
+
+import Aplicaciones.incidentes.almacenamiento
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('incidentes', '0012_recurso_posicion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BlobEvidencia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True)),
+                ('nombre', models.CharField(max_length=255)),
+                ('tamano', models.BigIntegerField()),
+                ('referencias', models.PositiveIntegerField(default=0)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='incidente',
+            name='evidencia',
+            field=models.FileField(blank=True, null=True, storage=Aplicaciones.incidentes.almacenamiento.AlmacenamientoDireccionado(), upload_to='incidentes/'),
+        ),
+    ]
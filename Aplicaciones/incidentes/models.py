@@ -2,6 +2,8 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 
+from .almacenamiento import almacenamiento_evidencias
+
 # =======================
 # BASE SOFT DELETE
 # =======================
@@ -85,7 +87,13 @@ class Incidente(SoftDeleteModel):
     latitud = models.DecimalField(max_digits=9, decimal_places=6, default=0)
     longitud = models.DecimalField(max_digits=9, decimal_places=6, default=0)
 
-    evidencia = models.FileField(upload_to="incidentes/", null=True, blank=True)
+    # un archivo por contenido, compartido entre incidentes (almacenamiento.py)
+    evidencia = models.FileField(
+        upload_to="incidentes/",
+        storage=almacenamiento_evidencias,
+        null=True,
+        blank=True
+    )
 
     creado_por = models.ForeignKey(
         User,
@@ -103,9 +111,50 @@ class Incidente(SoftDeleteModel):
 
     fecha_creacion = models.DateTimeField(auto_now_add=True)
 
+    # sube en cada escritura; los clientes descartan deltas con versión menor
+    version = models.PositiveIntegerField(default=1)
+
     objects = ActivosManager()
     all_objects = models.Manager()
 
+    class Meta:
+        # listado paginado por (fecha_creacion, id): cada filtro lleva
+        # la clave de orden detrás para que filtro + página sea un rango
+        indexes = [
+            models.Index(fields=["fecha_creacion", "id"], name="incidente_fecha_id_idx"),
+            models.Index(fields=["estado", "fecha_creacion", "id"], name="incidente_estado_fecha_idx"),
+            models.Index(fields=["severidad", "fecha_creacion", "id"], name="incidente_sever_fecha_idx"),
+            models.Index(fields=["tipo", "fecha_creacion", "id"], name="incidente_tipo_fecha_idx"),
+            models.Index(fields=["activo", "fecha_creacion", "id"], name="incidente_activo_fecha_idx"),
+            models.Index(fields=["rescatista", "fecha_creacion", "id"], name="incidente_resc_fecha_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+
+        if self.pk is None or kwargs.get("force_insert"):
+            return super().save(*args, **kwargs)
+
+        # incremento atómico: dos escrituras concurrentes nunca comparten versión
+        self.version = models.F("version") + 1
+
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = {*update_fields, "version"}
+
+        super().save(*args, **kwargs)
+        self.refresh_from_db(fields=["version"])
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+
+        # evidencia tal como se leyó: si cambia al guardar, las señales
+        # mueven la referencia de un blob a otro
+        if "evidencia" in field_names:
+            instancia._evidencia_inicial = values[field_names.index("evidencia")] or ""
+
+        return instancia
+
     def __str__(self):
         return f"Incidente #{self.id}"
 
@@ -117,6 +166,11 @@ class Recurso(SoftDeleteModel):
     estado = models.ForeignKey(EstadoRecurso, on_delete=models.PROTECT)
     capacidad = models.TextField()
 
+    # última posición conocida (null = sin posición, no se recomienda)
+    latitud = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    longitud = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    fecha_posicion = models.DateTimeField(null=True, blank=True)
+
     objects = ActivosManager()
     all_objects = models.Manager()
 
@@ -134,10 +188,37 @@ class Asignacion(SoftDeleteModel):
     objects = ActivosManager()
     all_objects = models.Manager()
 
+    class Meta:
+        constraints = [
+            # un recurso, una asignación activa (ver asignaciones.py)
+            models.UniqueConstraint(
+                fields=["recurso"],
+                condition=models.Q(activo=True),
+                name="asignacion_recurso_activa_unica",
+            ),
+        ]
+
     def __str__(self):
         return f"{self.recurso} → Incidente {self.incidente.id}"
 
 
+# =======================
+# EVIDENCIAS
+# =======================
+
+# un blob del almacén de evidencias y cuántos incidentes lo usan; las
+# señales de Incidente mueven las referencias (ver evidencias.py)
+class BlobEvidencia(models.Model):
+    digest = models.CharField(max_length=64, unique=True)
+    nombre = models.CharField(max_length=255)
+    tamano = models.BigIntegerField()
+    referencias = models.PositiveIntegerField(default=0)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.nombre} ({self.referencias})"
+
+
 # =======================
 # HISTORIAL
 # =======================
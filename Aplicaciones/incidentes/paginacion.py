@@ -0,0 +1,64 @@
+import base64
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+# Paginación por clave (keyset) sobre (fecha_creacion, id), más nuevos
+# primero. El cursor es la clave de la última fila entregada: la página
+# siguiente es un rango sobre el índice, sin OFFSET, y cuesta lo mismo
+# en la primera página que en la número mil.
+
+LIMITE_DEFECTO = 50
+LIMITE_MAXIMO = 200
+
+
+class CursorInvalido(ValueError):
+    pass
+
+
+def codificar_cursor(obj):
+    clave = [obj.fecha_creacion.isoformat(), obj.id]
+    return base64.urlsafe_b64encode(json.dumps(clave).encode()).decode()
+
+
+def decodificar_cursor(cursor):
+    try:
+        fecha, id_ = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        fecha = parse_datetime(fecha)
+        if fecha is None or not isinstance(id_, int):
+            raise ValueError
+        return fecha, id_
+    except (ValueError, TypeError):
+        raise CursorInvalido("Cursor inválido")
+
+
+def leer_limite(valor):
+    try:
+        limite = int(valor or LIMITE_DEFECTO)
+    except (TypeError, ValueError):
+        limite = LIMITE_DEFECTO
+    return max(1, min(limite, LIMITE_MAXIMO))
+
+
+def paginar_keyset(qs, cursor=None, limite=LIMITE_DEFECTO):
+    '''
+    (filas, siguiente_cursor). siguiente_cursor es None en la última página.
+    '''
+    qs = qs.order_by("-fecha_creacion", "-id")
+
+    if cursor:
+        fecha, id_ = decodificar_cursor(cursor)
+        qs = qs.filter(
+            Q(fecha_creacion__lt=fecha) | Q(fecha_creacion=fecha, id__lt=id_)
+        )
+
+    # una fila de más dice si hay otra página, sin COUNT
+    filas = list(qs[:limite + 1])
+
+    if len(filas) > limite:
+        filas = filas[:limite]
+        return filas, codificar_cursor(filas[-1])
+
+    return filas, None
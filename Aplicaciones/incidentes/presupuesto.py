@@ -0,0 +1,104 @@
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.db import connection
+
+
+logger = logging.getLogger(__name__)
+
+# consultas que no cuentan (p. ej. la carga de una caché de proceso)
+_exentas = ContextVar("presupuesto_exentas", default=False)
+
+# control de transacción (atomic()): no son consultas de datos
+_CONTROL_TRANSACCION = (
+    "BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE SAVEPOINT", "SET TRANSACTION"
+)
+
+
+# Presupuesto de consultas: cuántas consultas SQL puede hacer como máximo
+# un bloque o una vista. En las vistas un exceso solo queda en el log
+# (nunca un 500 para el usuario); las pruebas (tests.py) lo convierten en
+# fallo.
+
+
+class PresupuestoExcedido(AssertionError):
+    pass
+
+
+class PresupuestoConsultas:
+    '''
+    with PresupuestoConsultas(2): ...
+    Falla al salir si el bloque hizo más de `maximo` consultas.
+    '''
+
+    def __init__(self, maximo, nombre="bloque", estricto=True):
+        self.maximo = maximo
+        self.nombre = nombre
+        self.estricto = estricto
+        self.consultas = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if not _exentas.get() and not sql.lstrip().upper().startswith(_CONTROL_TRANSACCION):
+            self.consultas.append(sql)
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self.envoltura = connection.execute_wrapper(self)
+        self.envoltura.__enter__()
+        return self
+
+    def __exit__(self, tipo, valor, traza):
+        self.envoltura.__exit__(tipo, valor, traza)
+
+        if tipo is not None or len(self.consultas) <= self.maximo:
+            return
+
+        mensaje = (
+            f"{self.nombre}: {len(self.consultas)} consultas, "
+            f"presupuesto {self.maximo}:\n" + "\n".join(self.consultas)
+        )
+
+        if self.estricto:
+            raise PresupuestoExcedido(mensaje)
+
+        logger.warning(mensaje)
+
+
+@contextmanager
+def fuera_de_presupuesto():
+    '''
+    Las consultas del bloque no cuentan: cargas de caché que se pagan una
+    vez por proceso y no por petición.
+    '''
+    token = _exentas.set(True)
+    try:
+        yield
+    finally:
+        _exentas.reset(token)
+
+
+def presupuesto_consultas(maximo, metodos=("GET",)):
+    '''
+    Decorador de vistas (debajo de @api_view / @permission_classes, así
+    no cuenta la autenticación). Solo aplica a los métodos indicados.
+    '''
+    def decorador(vista):
+
+        @wraps(vista)
+        def envuelta(request, *args, **kwargs):
+
+            if request.method not in metodos:
+                return vista(request, *args, **kwargs)
+
+            with PresupuestoConsultas(
+                maximo,
+                nombre=f"{request.method} {request.path}",
+                estricto=False
+            ):
+                return vista(request, *args, **kwargs)
+
+        return envuelta
+
+    return decorador
@@ -0,0 +1,326 @@
+import asyncio
+import logging
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from channels.layers import get_channel_layer
+
+from .codificacion import precodificar
+
+
+logger = logging.getLogger(__name__)
+
+GRUPOS_TODOS = ["rol_admin", "rol_operador", "rol_rescatista", "rol_auditor"]
+
+
+# ---------------- ENVÍO ----------------
+
+def enviar_ws(grupos, data):
+    '''
+    Publica un evento a varios grupos en una sola operación del channel
+    layer. Se ejecuta después del commit (nunca sale un evento de una
+    escritura revertida) y fuera del hilo del request, que no espera
+    la E/S con Redis.
+    '''
+    mensaje = {
+        "type": "enviar_evento",
+        "data": data
+    }
+    grupos = list(grupos)
+
+    transaction.on_commit(lambda: despachar(grupos, mensaje))
+
+
+def despachar(grupos, mensaje, registrar=True):
+    asyncio.run_coroutine_threadsafe(
+        group_send_many(grupos, mensaje, registrar),
+        loop_envio()
+    )
+
+
+async def group_send_many(grupos, mensaje, registrar=True):
+
+    channel_layer = get_channel_layer()
+
+    try:
+        # secuencia global + log por grupo para la reanudación
+        if registrar and hasattr(channel_layer, "registrar_evento"):
+            data = mensaje["data"]
+            seq = await channel_layer.registrar_evento(grupos, data)
+            mensaje = {**mensaje, "data": {**data, "seq": seq}}
+
+        # el frame se codifica aquí una sola vez, no en cada consumer
+        if mensaje["type"] == "enviar_evento":
+            mensaje = evento_precodificado(mensaje["data"])
+
+        if hasattr(channel_layer, "group_send_many"):
+            await channel_layer.group_send_many(grupos, mensaje)
+        else:
+            for grupo in grupos:
+                await channel_layer.group_send(grupo, mensaje)
+    except Exception:
+        logger.exception("No se pudo publicar el evento en %s", grupos)
+
+
+def seq_actual(timeout=2):
+    '''
+    Secuencia actual del log de eventos (None si el layer no lleva log o
+    no responde). Desde código síncrono: la lectura va al loop de envío.
+    '''
+    channel_layer = get_channel_layer()
+
+    if not hasattr(channel_layer, "seq_actual"):
+        return None
+
+    futuro = asyncio.run_coroutine_threadsafe(
+        channel_layer.seq_actual(),
+        loop_envio()
+    )
+    try:
+        return futuro.result(timeout)
+    except Exception:
+        futuro.cancel()
+        logger.exception("No se pudo leer la secuencia de eventos")
+        return None
+
+
+def evento_precodificado(data):
+    '''
+    Lo que viaja por el channel layer: los frames ya codificados (opacos
+    para el consumer) y solo los metadatos que necesita para fundir,
+    ordenar y deduplicar.
+    '''
+    return {
+        "type": "enviar_evento",
+        "meta": {
+            "clave": clave_evento(data),
+            "version": data.get("version", 0),
+            "critico": bool(data.get("critico")),
+            "seq": data.get("seq"),
+        },
+        "frames": precodificar(data),
+    }
+
+
+def clave_evento(data):
+    '''
+    Eventos con la misma clave dentro de la ventana se funden en uno.
+    None = no se puede fundir, se envía tal cual.
+    '''
+    accion = data.get("accion")
+
+    # un lote trae varios incidentes: no se funde con nada
+    if accion == "incidente_update" and data.get("op") != "lote":
+        return f"{accion}:{data.get('id')}"
+
+    if accion == "catalogo_actualizado":
+        return f"{accion}:{data.get('tabla')}"
+
+    if accion == "auditoria_update":
+        # cada fila de auditoría es distinta: solo se junta el duplicado exacto
+        return f"{accion}:{(data.get('payload') or {}).get('id')}"
+
+    return None
+
+
+# ---------------- LOOP DE ENVÍO ----------------
+# Bajo ASGI los envíos van al loop principal (el mismo de los consumers,
+# ver LoopPrincipalMiddleware). En procesos sin loop (WSGI, comandos) se
+# usa un hilo propio con su loop, creado una sola vez.
+
+_loop_principal = None
+_loop_hilo = None
+_lock = threading.RLock()   # loop_envio -> iniciar_control lo toma dos veces
+
+
+def registrar_loop_principal(loop):
+    global _loop_principal
+    _loop_principal = loop
+
+
+def loop_envio():
+
+    global _loop_hilo
+
+    if _loop_principal is not None and _loop_principal.is_running():
+        return _loop_principal
+
+    with _lock:
+        if _loop_hilo is None:
+            _loop_hilo = asyncio.new_event_loop()
+            threading.Thread(
+                target=_loop_hilo.run_forever,
+                name="realtime-envio",
+                daemon=True
+            ).start()
+            iniciar_control(_loop_hilo)
+
+    return _loop_hilo
+
+
+# ---------------- CONTROL ENTRE PROCESOS ----------------
+# Mensajes para los procesos (no para los sockets): cada proceso escucha
+# el grupo "control" con un canal propio y aplica el manejador registrado
+# para la acción (p. ej. invalidar cachés locales).
+
+GRUPO_CONTROL = "control"
+
+_manejadores_control = {}
+_loops_control = set()
+
+
+def al_recibir_control(accion):
+    def registrar(funcion):
+        _manejadores_control[accion] = funcion
+        return funcion
+    return registrar
+
+
+def enviar_control(data):
+    mensaje = {
+        "type": "control",
+        "data": data
+    }
+
+    # no entra al log de eventos: no es para los clientes
+    transaction.on_commit(
+        lambda: despachar([GRUPO_CONTROL], mensaje, registrar=False)
+    )
+
+
+def iniciar_control(loop):
+    '''
+    Arranca (una sola vez por loop) la escucha del grupo de control.
+    '''
+    with _lock:
+        if loop in _loops_control:
+            return
+        _loops_control.add(loop)
+
+    asyncio.run_coroutine_threadsafe(escuchar_control(), loop)
+
+
+async def escuchar_control():
+
+    channel_layer = get_channel_layer()
+    canal = await channel_layer.new_channel("control.")
+
+    asyncio.ensure_future(renovar_control(channel_layer, canal))
+
+    while True:
+        try:
+            mensaje = await channel_layer.receive(canal)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Error leyendo el canal de control")
+            await asyncio.sleep(1)
+            continue
+
+        data = mensaje.get("data") or {}
+        manejador = _manejadores_control.get(data.get("accion"))
+
+        if manejador is None:
+            continue
+
+        try:
+            manejador(data)
+        except Exception:
+            logger.exception("Error aplicando control %s", data.get("accion"))
+
+
+async def renovar_control(channel_layer, canal):
+    # los grupos expiran (group_expiry): se vuelve a entrar periódicamente
+    while True:
+        try:
+            await channel_layer.group_add(GRUPO_CONTROL, canal)
+        except Exception:
+            logger.exception("No se pudo entrar al grupo de control")
+        await asyncio.sleep(getattr(channel_layer, "group_expiry", 86400) / 3)
+
+
+# ---------------- DELTAS DE INCIDENTES ----------------
+# Los clientes mantienen su propia copia de la lista y aplican estos
+# eventos sobre ella; nunca vuelven a pedir /api/incidentes/ por un push.
+
+# roles que pueden leer /api/incidentes/ (IsAdminOrOperador): reciben el
+# incidente serializado; los demás solo qué cambió (id y versión)
+GRUPOS_LECTURA = ["rol_admin", "rol_operador"]
+
+
+def enviar_incidentes(incs, evento, roles=GRUPOS_TODOS):
+    '''
+    Publica un evento de incidentes con los mismos permisos que la API:
+    completo a los roles que pueden leer la lista y a quienes siguen cada
+    incidente (incidente_<id>, ver consumers.TEMAS_POR_ID); al resto de
+    los roles, sin los datos del incidente.
+    '''
+    completos = [g for g in roles if g in GRUPOS_LECTURA]
+    reducidos = [g for g in roles if g not in GRUPOS_LECTURA]
+
+    # el layer entrega una sola copia a un socket que está en varios
+    enviar_ws([*completos, *(f"incidente_{inc.id}" for inc in incs)], evento)
+
+    if reducidos:
+        enviar_ws(reducidos, evento_reducido(evento))
+
+
+def evento_reducido(evento):
+    '''
+    El mismo delta sin el incidente serializado (solo id, versión y op).
+    '''
+    if evento.get("op") == "lote":
+        return {**evento, "incidentes": [evento_reducido(e) for e in evento["incidentes"]]}
+
+    return {k: v for k, v in evento.items() if k != "incidente"}
+
+
+def evento_incidente(inc, data):
+    '''
+    Alta o cambio: lleva el incidente ya serializado (una sola vez,
+    en la vista) y su versión para descartar eventos atrasados.
+    '''
+    return {
+        "accion": "incidente_update",
+        "op": "upsert",
+        "id": inc.id,
+        "version": inc.version,
+        "critico": es_critico(inc),
+        "incidente": dict(data)
+    }
+
+
+def es_critico(inc):
+    # los críticos no esperan la ventana de coalescencia del consumer
+    nivel = getattr(settings, "REALTIME_NIVEL_CRITICO", None)
+    return nivel is not None and inc.severidad.nivel >= nivel
+
+
+def evento_lote(eventos):
+    '''
+    Varios deltas en un solo evento (cierres masivos): un frame por
+    socket en lugar de uno por incidente. El cliente aplica cada uno
+    como si hubiera llegado solo.
+    '''
+    return {
+        "accion": "incidente_update",
+        "op": "lote",
+        "critico": any(e.get("critico") for e in eventos),
+        "incidentes": [
+            {k: v for k, v in e.items() if k not in ("accion", "critico")}
+            for e in eventos
+        ]
+    }
+
+
+def evento_incidente_borrado(inc):
+    '''
+    Lápida: solo id y versión, el cliente quita la fila.
+    '''
+    return {
+        "accion": "incidente_update",
+        "op": "delete",
+        "id": inc.id,
+        "version": inc.version
+    }
@@ -1,6 +1,9 @@
 from rest_framework import serializers
+from django.utils import timezone
 import magic
 from .models import *
+from .catalogos import CatalogoPKField
+from .campos import CamposDinamicosMixin
 
 class TipoIncidenteSerializer(serializers.ModelSerializer):
     class Meta:
@@ -20,7 +23,12 @@ class EstadoIncidenteSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
-class IncidenteSerializer(serializers.ModelSerializer):
+class IncidenteSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
+
+    # catálogos validados contra la caché en memoria (sin consulta)
+    tipo = CatalogoPKField(TipoIncidente)
+    severidad = CatalogoPKField(Severidad)
+    estado = CatalogoPKField(EstadoIncidente)
 
     creado_por = serializers.ReadOnlyField(source="creado_por.username")
     tipo_nombre = serializers.CharField(source="tipo.nombre", read_only=True)
@@ -33,9 +41,14 @@ class IncidenteSerializer(serializers.ModelSerializer):
 
     recursos_asignados = serializers.SerializerMethodField()
 
+    # ?fields= / ?omit= (ver campos.py); id y version salen siempre
+    campos_fijos = ("id", "version")
+    columnas_metodos = {"evidencia_url": ("evidencia",)}
+
     class Meta:
         model = Incidente
         fields = "__all__"
+        read_only_fields = ["version"]
 
     def create(self, validated_data):
         validated_data["activo"] = True
@@ -52,7 +65,11 @@ class IncidenteSerializer(serializers.ModelSerializer):
         return request.build_absolute_uri(url) if request else url
 
     def get_recursos_asignados(self, obj):
-        return Asignacion.objects.filter(incidente=obj, activo=True).count()
+        # anotado por consultas.incidentes_qs(); sin anotación, una consulta
+        activos = getattr(obj, "recursos_activos", None)
+        if activos is None:
+            return Asignacion.objects.filter(incidente=obj, activo=True).count()
+        return activos
 
     def validate_evidencia(self, file):
 
@@ -75,7 +92,10 @@ class IncidenteSerializer(serializers.ModelSerializer):
 
         return file
 
-class RecursoSerializer(serializers.ModelSerializer):
+class RecursoSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
+
+    tipo = CatalogoPKField(TipoRecurso)
+    estado = CatalogoPKField(EstadoRecurso)
 
     tipo_nombre = serializers.CharField(
         source="tipo.nombre",
@@ -90,10 +110,22 @@ class RecursoSerializer(serializers.ModelSerializer):
     class Meta:
         model = Recurso
         fields = "__all__"
+        read_only_fields = ["fecha_posicion"]
+
+    def validate(self, attrs):
+        if "latitud" in attrs or "longitud" in attrs:
+            attrs["fecha_posicion"] = timezone.now()
+        return attrs
+
+
+class PosicionRecursoSerializer(serializers.Serializer):
+
+    latitud = serializers.FloatField(min_value=-90, max_value=90)
+    longitud = serializers.FloatField(min_value=-180, max_value=180)
 
 
 
-class AsignacionSerializer(serializers.ModelSerializer):
+class AsignacionSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
 
     recurso_nombre = serializers.CharField(
         source="recurso.nombre",
@@ -0,0 +1,129 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.contrib.auth.models import User
+
+from .models import (
+    TipoIncidente, Severidad, EstadoIncidente, TipoRecurso, EstadoRecurso,
+    Incidente, Recurso, Asignacion
+)
+from .versiones import tocar_versiones
+from .catalogos import es_catalogo, invalidar_catalogo
+from . import busqueda
+from . import cercania
+from . import evidencias
+
+
+# modelo -> tabla de versiones (ver versiones.py). Los .update() y
+# bulk_create no disparan señales: esas vistas llaman tocar_versiones().
+TABLAS = {
+    TipoIncidente: "tipo_incidente",
+    Severidad: "severidad",
+    EstadoIncidente: "estado_incidente",
+    TipoRecurso: "tipo_recurso",
+    EstadoRecurso: "estado_recurso",
+    Incidente: "incidente",
+    Recurso: "recurso",
+    Asignacion: "asignacion",
+    # el listado de incidentes muestra creado_por y rescatista
+    User: "usuario",
+}
+
+# guardados que no cambian nada de lo que muestran los listados: cada
+# login escribe last_login y no debe invalidar todos los ETag
+CAMPOS_SIN_VERSION = {
+    User: {"last_login"},
+}
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def tocar_version_tabla(sender, update_fields=None, **kwargs):
+    tabla = TABLAS.get(sender)
+    ignorados = CAMPOS_SIN_VERSION.get(sender)
+
+    if tabla and not (update_fields and ignorados and set(update_fields) <= ignorados):
+        tocar_versiones(tabla)
+
+    if es_catalogo(sender):
+        invalidar_catalogo(sender)
+
+
+# ---------------- ÍNDICE DE BÚSQUEDA ----------------
+# misma transacción que la escritura: el índice nunca queda por delante
+# ni por detrás de lo confirmado (ver busqueda.py)
+
+CAMPOS_INDEXADOS = {"descripcion", "tipo", "estado", "activo"}
+
+
+@receiver(post_save, sender=Incidente)
+def indexar_incidente(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+
+    # save(update_fields=[...]) que no toca el texto ni la visibilidad
+    if update_fields is not None and not CAMPOS_INDEXADOS & set(update_fields):
+        return
+
+    busqueda.indexar_incidentes([instance.pk])
+
+
+@receiver(post_delete, sender=Incidente)
+def desindexar_incidente(sender, instance, **kwargs):
+    busqueda.quitar_incidente(instance.pk)
+
+
+@receiver(post_save, sender=TipoIncidente)
+@receiver(post_save, sender=EstadoIncidente)
+def reindexar_catalogo(sender, instance, created=False, raw=False, **kwargs):
+    if created or raw:
+        return
+
+    columna = "tipo_id" if sender is TipoIncidente else "estado_id"
+    busqueda.indexar_por_catalogo(columna, instance.pk)
+
+
+# ---------------- ÍNDICE DE CERCANÍA ----------------
+# posición, tipo, estado o baja de un recurso (ver cercania.py); los
+# .update() de estado avisan desde asignaciones.py
+
+@receiver(post_save, sender=Recurso)
+def reubicar_recurso(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    cercania.recursos_cambiados([instance])
+
+
+@receiver(post_delete, sender=Recurso)
+def quitar_recurso(sender, instance, **kwargs):
+    cercania.recursos_borrados([instance.pk])
+
+
+# ---------------- EVIDENCIAS ----------------
+# referencias de los blobs (ver evidencias.py): la evidencia con la que se
+# leyó el incidente (Incidente.from_db) contra la que queda al guardar
+
+@receiver(post_save, sender=Incidente)
+def mover_referencia_evidencia(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+
+    if "evidencia" in instance.get_deferred_fields():
+        return
+
+    if update_fields is not None and "evidencia" not in update_fields:
+        return
+
+    anterior = "" if created else getattr(instance, "_evidencia_inicial", "")
+    actual = instance.evidencia.name or ""
+
+    if actual != anterior:
+        evidencias.referenciar(actual)
+        evidencias.soltar(anterior)
+
+    instance._evidencia_inicial = actual
+
+
+@receiver(post_delete, sender=Incidente)
+def soltar_evidencia(sender, instance, **kwargs):
+    if "evidencia" not in instance.get_deferred_fields():
+        evidencias.soltar(instance.evidencia.name)
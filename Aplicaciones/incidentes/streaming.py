@@ -0,0 +1,77 @@
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+
+from .json_rapido import dumps
+
+
+# Respuestas JSON en streaming para listados grandes y exportaciones: el
+# queryset se recorre por bloques (.iterator) y cada fila se serializa y
+# se escribe al vuelo como parte de un arreglo JSON. La memoria del worker
+# queda acotada por el bloque, no por el total de filas, y el primer byte
+# sale con la primera fila.
+
+CHUNK_FILAS = 500
+BUFFER_BYTES = 64 * 1024
+
+
+def arreglo_json(filas, serializar):
+    '''
+    Genera el arreglo JSON en partes de ~BUFFER_BYTES (bytes).
+    '''
+    buffer = ["["]
+    tamano = 1
+    primera = True
+
+    for fila in filas:
+        parte = dumps(serializar(fila))
+
+        if not primera:
+            parte = "," + parte
+        primera = False
+
+        buffer.append(parte)
+        tamano += len(parte)
+
+        if tamano >= BUFFER_BYTES:
+            yield "".join(buffer).encode()
+            buffer = []
+            tamano = 0
+
+    buffer.append("]")
+    yield "".join(buffer).encode()
+
+
+async def _en_async(partes):
+    # bajo ASGI Django consumiría un iterador síncrono entero en memoria;
+    # cada parte se pide en el hilo del request (el de su conexión a la BD)
+    siguiente = sync_to_async(next, thread_sensitive=True)
+
+    while True:
+        parte = await siguiente(partes, None)
+        if parte is None:
+            return
+        yield parte
+
+
+def respuesta_streaming(request, qs, serializar, chunk_size=CHUNK_FILAS):
+    '''
+    StreamingHttpResponse con el arreglo JSON de serializar(fila) para cada
+    fila de qs. Las consultas corren mientras se envía la respuesta, fuera
+    de la vista (no cuentan en @presupuesto_consultas).
+    '''
+    partes = arreglo_json(qs.iterator(chunk_size=chunk_size), serializar)
+
+    if isinstance(getattr(request, "_request", request), ASGIRequest):
+        partes = _en_async(partes)
+
+    return StreamingHttpResponse(partes, content_type="application/json")
+
+
+def serializar_con(serializer_class, **kwargs):
+    '''
+    Una sola instancia del serializer para todas las filas (los campos se
+    construyen una vez), en lugar de una por fila.
+    '''
+    serializer = serializer_class(**kwargs)
+    return serializer.to_representation
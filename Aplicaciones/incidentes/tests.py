@@ -1,3 +1,1500 @@
-from django.test import TestCase
+import os
+import asyncio
+import io
+import json
+import time
+import zlib
+import base64
+import shutil
+import tempfile
+import uuid
+from datetime import date, datetime, timedelta, time as dt_time, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import msgpack
+
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.models import TokenUser
+
+from Aplicaciones.accounts.jwt import generar_tokens
+
+from .models import (
+    TipoIncidente, Severidad, EstadoIncidente, TipoRecurso, EstadoRecurso,
+    Incidente, Recurso, Asignacion, BlobEvidencia, AuditoriaAccion
+)
+from .almacenamiento import AlmacenamientoDireccionado, almacenamiento_evidencias
+from .asignaciones import aplicar_asignacion
+from .catalogos import catalogo
+from .codificacion import SUBPROTOCOLOS, elegir_subprotocolo, codificar, precodificar
+from .consultas import incidentes_qs
+from .consumers import IncidenteConsumer, MAX_TEMAS
+from .json_rapido import JSONRapidoRenderer, JSONRapidoParser
+from .presupuesto import PresupuestoConsultas
+from .realtime import group_send_many, evento_precodificado, escuchar_control, GRUPO_CONTROL
+from .serializers import IncidenteSerializer
+
+
+# Sin Redis: channel layer en memoria (con log de eventos corto)
+CAPA_MEMORIA = {
+    "default": {
+        "BACKEND": "Aplicaciones.incidentes.layers.InMemoryChannelLayer",
+        "CONFIG": {"event_log_size": 3},
+    }
+}
+
+CACHE_LOCAL = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+}
+
+
+async def publicar(id_, version, **extra):
+    await group_send_many(["rol_operador"], {
+        "type": "enviar_evento",
+        "data": {
+            "accion": "incidente_update",
+            "op": "upsert",
+            "id": id_,
+            "version": version,
+            **extra
+        }
+    })
+
+
+async def conectar_ws(rol, consulta="", protocolos=None, consumer=IncidenteConsumer):
+    '''
+    Socket de ws/incidentes/ ya aceptado, con el "conectado" leído.
+    '''
+    comm = WebsocketCommunicator(
+        consumer.as_asgi(),
+        "/ws/incidentes/?" + consulta,
+        subprotocols=protocolos
+    )
+    comm.scope["user"] = TokenUser({"user_id": 1, "role": rol})
+
+    conectado, protocolo = await comm.connect()
+    assert conectado
+
+    hola = await comm.receive_from()
+    return comm, protocolo, hola
+
+
+class ConsumerObservado(IncidenteConsumer):
+    # deja ver el estado interno de la última conexión
+    ultimo = None
+
+    async def connect(self):
+        ConsumerObservado.ultimo = self
+        await super().connect()
+
+
+def miembros(grupo):
+    return set(get_channel_layer().groups.get(grupo, {}))
+
+
+def crear_usuario(nombre, rol):
+    usuario = User.objects.create_user(nombre, password="x")
+    usuario.perfil.rol = rol
+    usuario.perfil.save()
+    return usuario
+
+
+def cliente_de(usuario):
+    cliente = APIClient()
+    cliente.credentials(HTTP_AUTHORIZATION="Bearer " + generar_tokens(usuario)["access"])
+    return cliente
+
+
+class DatosMixin:
+    '''
+    Catálogos, un operador, un rescatista y INCIDENTES incidentes con
+    rescatista y dos recursos asignados cada uno (lo que destapa un N+1).
+    '''
+
+    INCIDENTES = 6
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.operador = crear_usuario("operador", "operador")
+        cls.rescatista = crear_usuario("rescatista", "rescatista")
+
+        cls.tipo = TipoIncidente.objects.create(nombre="Incendio")
+        cls.severidad = Severidad.objects.create(nombre="Alta", nivel=3)
+        cls.abierto = EstadoIncidente.objects.create(nombre="Abierto")
+        cls.cerrado = EstadoIncidente.objects.create(nombre="Cerrado")
+
+        cls.ambulancia = TipoRecurso.objects.create(nombre="Ambulancia")
+        cls.disponible = EstadoRecurso.objects.create(nombre="Disponible")
+        cls.asignado = EstadoRecurso.objects.create(nombre="Asignado")
+
+        cls.incidentes = []
+        for i in range(cls.INCIDENTES):
+            inc = Incidente.objects.create(
+                tipo=cls.tipo,
+                severidad=cls.severidad,
+                estado=cls.abierto,
+                descripcion=f"Incendio forestal {i}",
+                latitud="-0.180000",
+                longitud="-78.460000",
+                creado_por=cls.operador,
+                rescatista=cls.rescatista
+            )
+            for j in range(2):
+                Asignacion.objects.create(
+                    incidente=inc,
+                    recurso=cls.recurso(f"A{i}-{j}", cls.asignado)
+                )
+            cls.incidentes.append(inc)
+
+        cls.libres = [cls.recurso(f"L{i}", cls.disponible, i) for i in range(4)]
+
+    @classmethod
+    def recurso(cls, nombre, estado, desplazamiento=0):
+        return Recurso.objects.create(
+            nombre=nombre,
+            tipo=cls.ambulancia,
+            estado=estado,
+            capacidad="4",
+            latitud=-0.18 + desplazamiento / 100,
+            longitud=-78.46
+        )
+
+    def setUp(self):
+        self.cliente = cliente_de(self.operador)
+
+
+# ---------------- REANUDACIÓN (?since=) ----------------
+
+@override_settings(
+    CHANNEL_LAYERS=CAPA_MEMORIA,
+    REALTIME_COALESCE_MS=0,
+    REALTIME_PING_S=0
+)
+class ReanudacionTests(SimpleTestCase):
+
+    async def conectar(self, consulta=""):
+        comm, _, hola = await conectar_ws("operador", consulta)
+
+        hola = json.loads(hola)
+        self.assertEqual(hola["accion"], "conectado")
+        return comm, hola["seq"]
+
+    async def publicar(self, id_, version, **extra):
+        await publicar(id_, version, **extra)
+
+    async def test_reanuda_solo_lo_perdido(self):
+        comm, seq = await self.conectar()
+        await comm.disconnect()
+
+        await self.publicar(1, 1)
+        await self.publicar(2, 1)
+        await self.publicar(1, 2)
+
+        comm, _ = await self.conectar(f"since={seq}")
+
+        # del incidente 1 solo el último, y en orden de secuencia
+        recibidos = [await comm.receive_json_from() for _ in range(2)]
+        self.assertEqual(
+            [(e["id"], e["version"], e["seq"]) for e in recibidos],
+            [(2, 1, seq + 2), (1, 2, seq + 3)]
+        )
+        self.assertTrue(await comm.receive_nothing())
+
+        await comm.disconnect()
+
+    async def test_no_repite_en_vivo_lo_reproducido(self):
+        comm, seq = await self.conectar()
+        await comm.disconnect()
+
+        await self.publicar(5, 1)
+
+        comm, _ = await self.conectar(f"since={seq}")
+        reproducido = await comm.receive_json_from()
+        self.assertEqual(reproducido["seq"], seq + 1)
+
+        # el mismo evento llega tarde por el grupo: se descarta
+        await get_channel_layer().group_send("rol_operador", evento_precodificado({
+            "accion": "incidente_update",
+            "op": "upsert",
+            "id": 5,
+            "version": 1,
+            "seq": seq + 1
+        }))
+        self.assertTrue(await comm.receive_nothing())
+
+        await self.publicar(5, 2)
+        self.assertEqual((await comm.receive_json_from())["version"], 2)
+
+        await comm.disconnect()
+
+    async def test_olvida_lo_reproducido_que_no_vuelve(self):
+        comm, seq = await self.conectar()
+        await comm.disconnect()
+
+        await self.publicar(1, 1)
+        await self.publicar(2, 1)
+
+        comm, _, _ = await conectar_ws("operador", f"since={seq}", consumer=ConsumerObservado)
+        consumer = ConsumerObservado.ultimo
+        await comm.receive_json_from()
+        await comm.receive_json_from()
+        self.assertEqual(consumer.reproducidos, {seq + 1, seq + 2})
+
+        # nunca llegaron en vivo: el siguiente evento en vivo los descarta
+        await self.publicar(3, 1)
+        self.assertEqual((await comm.receive_json_from())["id"], 3)
+        self.assertEqual(consumer.reproducidos, set())
+
+        await comm.disconnect()
+
+    async def test_hueco_mayor_que_el_log_pide_resync(self):
+        comm, seq = await self.conectar()
+        await comm.disconnect()
+
+        # event_log_size = 3: el primero ya no está
+        for version in range(1, 5):
+            await self.publicar(9, version)
+
+        comm, _ = await self.conectar(f"since={seq}")
+        resync = await comm.receive_json_from()
+
+        self.assertEqual(resync["accion"], "resync")
+        self.assertEqual(resync["seq"], seq + 4)
+        self.assertTrue(await comm.receive_nothing())
+
+        await comm.disconnect()
+
+
+# ---------------- PRESUPUESTO DE CONSULTAS ----------------
+
+@override_settings(CHANNEL_LAYERS=CAPA_MEMORIA, CACHES=CACHE_LOCAL)
+class PresupuestoConsultasTests(DatosMixin, TestCase):
+
+    def assertPresupuesto(self, url):
+        '''
+        GET dentro del presupuesto de su @presupuesto_consultas: en la vista
+        un exceso solo va al log, aquí es un fallo (con las consultas).
+        '''
+        with self.assertNoLogs("Aplicaciones.incidentes.presupuesto", "WARNING"):
+            respuesta = self.cliente.get(url)
+
+        self.assertEqual(respuesta.status_code, 200)
+        return respuesta.data
+
+    def test_exceso_solo_se_registra(self):
+        with self.assertLogs("Aplicaciones.incidentes.presupuesto", "WARNING"):
+            with PresupuestoConsultas(0, estricto=False):
+                Incidente.objects.count()
+
+        with self.assertRaises(AssertionError):
+            with PresupuestoConsultas(0):
+                Incidente.objects.count()
+
+    def test_listado_incidentes(self):
+        data = self.assertPresupuesto("/api/incidentes/")
+        self.assertEqual(len(data), self.INCIDENTES)
+        self.assertEqual({i["recursos_asignados"] for i in data}, {2})
+
+    def test_pagina_incidentes(self):
+        data = self.assertPresupuesto("/api/incidentes/?limite=50")
+        self.assertEqual(len(data["resultados"]), self.INCIDENTES)
+        self.assertEqual({i["recursos_asignados"] for i in data["resultados"]}, {2})
+
+    def test_detalle_incidente(self):
+        data = self.assertPresupuesto(f"/api/incidentes/{self.incidentes[0].id}/")
+        self.assertEqual(data["recursos_asignados"], 2)
+
+    def test_recursos(self):
+        data = self.assertPresupuesto("/api/recursos/")
+        self.assertEqual(len(data), self.INCIDENTES * 2 + len(self.libres))
+
+    def test_recursos_disponibles(self):
+        data = self.assertPresupuesto("/api/recursos/disponibles/")
+        self.assertEqual(len(data), len(self.libres))
+
+    def test_recursos_cercanos(self):
+        data = self.assertPresupuesto(
+            f"/api/incidentes/{self.incidentes[0].id}/recursos-cercanos/"
+            f"?tipo={self.ambulancia.id}&k=3"
+        )
+        self.assertEqual(
+            [r["id"] for r in data["recursos"]],
+            [r.id for r in self.libres[:3]]
+        )
+
+    def test_busqueda(self):
+        data = self.assertPresupuesto("/api/incidentes/buscar/?q=forestal")
+        self.assertEqual(len(data["resultados"]), self.INCIDENTES)
+
+    def test_snapshot_operador(self):
+        data = self.assertPresupuesto("/api/operador/snapshot/")
+        self.assertEqual(len(data["incidentes"]["resultados"]), self.INCIDENTES)
+        self.assertEqual(len(data["recursos_disponibles"]), len(self.libres))
+
+    def test_modal_asignaciones(self):
+        data = self.assertPresupuesto(f"/api/incidentes/{self.incidentes[0].id}/asignaciones/")
+        self.assertEqual(len(data["asignados"]), 2)
+        self.assertEqual(len(data["disponibles"]), len(self.libres))
+
+
+@override_settings(CHANNEL_LAYERS=CAPA_MEMORIA, CACHES=CACHE_LOCAL)
+class CambiarEstadoTests(DatosMixin, TestCase):
+
+    def test_cierre_publica_recursos_ya_liberados(self):
+        inc = self.incidentes[0]
+
+        with mock.patch("Aplicaciones.incidentes.views.enviar_incidentes") as enviar:
+            respuesta = self.cliente.put(
+                f"/api/incidentes/{inc.id}/estado/",
+                {"estado": self.cerrado.id},
+                format="json"
+            )
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertFalse(Asignacion.objects.filter(incidente=inc).exists())
+
+        (_, evento), _ = enviar.call_args
+        self.assertEqual(evento["incidente"]["recursos_asignados"], 0)
+        self.assertEqual(evento["incidente"]["estado"], self.cerrado.id)
+
+
+# ---------------- RECLAMOS CONCURRENTES ----------------
+
+@override_settings(CHANNEL_LAYERS=CAPA_MEMORIA, CACHES=CACHE_LOCAL)
+class ReclamoConcurrenteTests(DatosMixin, TestCase):
+    '''
+    Las carreras se reproducen intercalando a mano lo que haría el otro
+    despachador entre la foto de estados y la escritura.
+    '''
+
+    def asignaciones_activas(self, recurso):
+        return Asignacion.objects.filter(recurso=recurso).count()
+
+    def test_el_segundo_recibe_ocupado(self):
+        recurso = self.libres[0]
+        primero, segundo = self.incidentes[:2]
+
+        original = Asignacion.objects.bulk_create
+
+        # el otro despachador inserta después de la foto del segundo
+        def insertar_antes(objs, **kwargs):
+            original([Asignacion(incidente=primero, recurso=recurso)])
+            return original(objs, **kwargs)
+
+        with mock.patch.object(Asignacion.objects, "bulk_create", side_effect=insertar_antes):
+            diff = aplicar_asignacion(segundo, {recurso.id}, set())
+
+        self.assertEqual(diff["asignados"], [])
+        self.assertEqual(diff["conflictos"], [{"recurso": recurso.id, "motivo": "ocupado"}])
+        self.assertEqual(
+            list(Asignacion.objects.filter(recurso=recurso).values_list("incidente", flat=True)),
+            [primero.id]
+        )
+
+    def test_recurso_que_deja_de_estar_disponible(self):
+        libre, retirado = self.libres[:2]
+        inc = self.incidentes[0]
+        mantenimiento = EstadoRecurso.objects.create(nombre="Mantenimiento")
+
+        original = Asignacion.objects.bulk_create
+
+        # lo retiran entre la foto (Disponible) y el INSERT
+        def retirar_antes(objs, **kwargs):
+            Recurso.objects.filter(id=retirado.id).update(estado=mantenimiento)
+            return original(objs, **kwargs)
+
+        with mock.patch.object(Asignacion.objects, "bulk_create", side_effect=retirar_antes):
+            diff = aplicar_asignacion(inc, {libre.id, retirado.id}, set())
+
+        self.assertEqual(diff["asignados"], [libre.id])
+        self.assertEqual(
+            diff["conflictos"],
+            [{"recurso": retirado.id, "motivo": "no_disponible"}]
+        )
+
+        retirado.refresh_from_db()
+        self.assertEqual(retirado.estado, mantenimiento)
+        self.assertEqual(self.asignaciones_activas(retirado), 0)
+
+        libre.refresh_from_db()
+        self.assertEqual(libre.estado, self.asignado)
+        self.assertEqual(self.asignaciones_activas(libre), 1)
+
+    def test_pedido_repetido_no_duplica(self):
+        recurso = self.libres[0]
+        primero, segundo = self.incidentes[:2]
+
+        aplicar_asignacion(primero, {recurso.id}, set())
+        diff = aplicar_asignacion(segundo, {recurso.id}, set())
+
+        self.assertEqual(diff["conflictos"], [{"recurso": recurso.id, "motivo": "no_disponible"}])
+        self.assertEqual(self.asignaciones_activas(recurso), 1)
+
+    def test_respuesta_de_la_vista(self):
+        inc = self.incidentes[0]
+        suelto = Asignacion.objects.filter(incidente=inc).first().recurso_id
+        libre = self.libres[0].id
+
+        with self.captureOnCommitCallbacks(execute=True):
+            respuesta = self.cliente.post(
+                f"/api/incidentes/{inc.id}/asignar/",
+                {"rescatista": self.rescatista.id, "asignar": [libre, 999999], "desasignar": [suelto]},
+                format="json"
+            )
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.data, {
+            "ok": "asignación actualizada",
+            "asignados": [libre],
+            "desasignados": [suelto],
+            "conflictos": [{"recurso": 999999, "motivo": "no_existe"}],
+        })
+
+
+# ---------------- INGESTA ----------------
+
+@override_settings(CHANNEL_LAYERS=CAPA_MEMORIA, CACHES=CACHE_LOCAL)
+class IngestaTests(DatosMixin, TestCase):
+
+    URL = "/api/incidentes/ingesta/"
+
+    def ingerir(self, cuerpo, tipo):
+        return self.cliente.post(self.URL, data=cuerpo.encode(), content_type=tipo)
+
+    def test_ndjson_con_filas_invalidas(self):
+        cuerpo = "\n".join([
+            '{"tipo": "Incendio", "severidad": "Alta", "descripcion": "Bodega en llamas", "latitud": "-0.2"}',
+            '{"tipo": "Inundación", "severidad": "Alta", "descripcion": "Sin tipo"}',
+            "",
+            "no es json",
+            f'{{"tipo": {self.tipo.id}, "severidad": {self.severidad.id}, "estado": "Cerrado", "descripcion": "Por id"}}',
+            '{"tipo": "Incendio", "severidad": "Alta", "descripcion": "Fuera", "latitud": 91}',
+            '["no", "es", "objeto"]',
+        ])
+
+        with mock.patch("Aplicaciones.incidentes.ingesta.LOTE", 1):
+            respuesta = self.ingerir(cuerpo, "application/x-ndjson")
+
+        self.assertEqual(respuesta.status_code, 201)
+        data = respuesta.data
+
+        self.assertEqual((data["filas"], data["creados"], data["lotes"]), (6, 2, 2))
+        self.assertEqual(
+            [(e["fila"], sorted(e["errores"])) for e in data["errores"]],
+            [(2, ["tipo"]), (4, ["fila"]), (6, ["latitud"]), (7, ["fila"])]
+        )
+
+        creados = Incidente.objects.filter(id__in=data["ids"]).order_by("id")
+        self.assertEqual(
+            [(i.descripcion, i.estado_id, str(i.latitud)) for i in creados],
+            [
+                ("Bodega en llamas", self.abierto.id, "-0.200000"),
+                ("Por id", self.cerrado.id, "0.000000"),
+            ]
+        )
+        self.assertTrue(all(i.creado_por_id == self.operador.id for i in creados))
+
+        # indexados en la misma transacción que el INSERT
+        busqueda = self.cliente.get("/api/incidentes/buscar/?q=bodega")
+        self.assertEqual([i["id"] for i in busqueda.data["resultados"]], data["ids"][:1])
+
+    def test_csv_cuenta_la_cabecera(self):
+        cuerpo = (
+            "tipo,severidad,descripcion,latitud,longitud\n"
+            "Incendio,Alta,Casa,-0.1,-78.5\n"
+            "Incendio,Media,Sin severidad,,\n"
+            "Incendio,Alta,,,\n"
+        )
+
+        respuesta = self.ingerir(cuerpo, "text/csv")
+
+        self.assertEqual(respuesta.status_code, 201)
+        self.assertEqual(respuesta.data["creados"], 1)
+        self.assertEqual(
+            [(e["fila"], sorted(e["errores"])) for e in respuesta.data["errores"]],
+            [(3, ["severidad"]), (4, ["descripcion"])]
+        )
+
+    def test_csv_sigue_despues_de_una_fila_mal_formada(self):
+        # un campo entre comillas que pasa el límite del módulo csv
+        cuerpo = (
+            "tipo,severidad,descripcion\n"
+            "Incendio,Alta,Antes\n"
+            'Incendio,Alta,"' + "x" * 140_000 + '"\n'
+            "Incendio,Alta,Después\n"
+        )
+
+        respuesta = self.ingerir(cuerpo, "text/csv")
+
+        self.assertEqual(respuesta.status_code, 201)
+        self.assertFalse(respuesta.data["truncado"])
+        self.assertEqual(respuesta.data["creados"], 2)
+        self.assertIn("CSV inválido", str(respuesta.data["errores"][0]["errores"]))
+        self.assertEqual(
+            list(Incidente.objects.filter(id__in=respuesta.data["ids"]).values_list("descripcion", flat=True)),
+            ["Antes", "Después"]
+        )
+
+    def test_csv_con_cabecera_ilegible_queda_truncado(self):
+        cuerpo = '"' + "x" * 140_000 + '"\nIncendio,Alta,Nunca\n'
+
+        respuesta = self.ingerir(cuerpo, "text/csv")
+
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertTrue(respuesta.data["truncado"])
+        self.assertEqual(respuesta.data["creados"], 0)
+        self.assertIn("Cabecera CSV inválida", str(respuesta.data["errores"]))
+
+    def test_sin_filas_validas(self):
+        antes = Incidente.objects.count()
+
+        respuesta = self.ingerir('{"descripcion": "Falta todo"}\n', "application/x-ndjson")
+
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertEqual(respuesta.data["creados"], 0)
+        self.assertEqual(
+            sorted(respuesta.data["errores"][0]["errores"]),
+            ["severidad", "tipo"]
+        )
+        self.assertEqual(Incidente.objects.count(), antes)
+
+    def test_formato_no_soportado(self):
+        self.assertEqual(self.ingerir("<xml/>", "application/xml").status_code, 415)
+
+    def test_solo_operador_o_admin(self):
+        respuesta = cliente_de(self.rescatista).post(
+            self.URL, data=b"{}", content_type="application/x-ndjson"
+        )
+        self.assertEqual(respuesta.status_code, 403)
+
+
+# ---------------- CIERRE MASIVO ----------------
+
+@override_settings(CHANNEL_LAYERS=CAPA_MEMORIA, CACHES=CACHE_LOCAL)
+class CierreMasivoTests(DatosMixin, TestCase):
+
+    URL = "/api/incidentes/cerrar/"
+
+    def cerrar(self, ids):
+        with mock.patch("Aplicaciones.incidentes.views.enviar_incidentes") as enviar:
+            with CaptureQueriesContext(connection) as consultas:
+                respuesta = self.cliente.post(self.URL, {"ids": ids}, format="json")
+
+        return respuesta, enviar, len(consultas)
+
+    def test_cierra_libera_e_ignora(self):
+        ids = [inc.id for inc in self.incidentes[:3]]
+        self.cerrar(ids[2:])
+
+        respuesta, enviar, _ = self.cerrar(ids + [999999])
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.data["cerrados"], ids[:2])
+        self.assertEqual(respuesta.data["ignorados"], sorted([ids[2], 999999]))
+
+        self.assertEqual(
+            set(Incidente.objects.filter(id__in=ids).values_list("estado", flat=True)),
+            {self.cerrado.id}
+        )
+        self.assertFalse(Asignacion.objects.filter(incidente_id__in=ids).exists())
+
+        # la relación inversa ve también las asignaciones cerradas
+        liberados = Recurso.objects.filter(asignacion__incidente_id__in=ids[:2])
+        self.assertEqual(
+            list(liberados.values_list("estado", flat=True)),
+            [self.disponible.id] * 4
+        )
+
+        # un solo evento "lote" con los cerrados
+        enviar.assert_called_once()
+        (incs, evento), _ = enviar.call_args
+        self.assertEqual(evento["op"], "lote")
+        self.assertEqual(sorted(e["id"] for e in evento["incidentes"]), ids[:2])
+        self.assertEqual(sorted(inc.id for inc in incs), ids[:2])
+
+    def test_sentencias_fijas(self):
+        ids = [inc.id for inc in self.incidentes]
+
+        _, _, dos = self.cerrar(ids[:2])
+        _, _, cuatro = self.cerrar(ids[2:])
+
+        self.assertEqual(dos, cuatro)
+
+    def test_ids_debe_ser_lista(self):
+        for ids in (5, "12", {"1": 1}, None):
+            respuesta, enviar, _ = self.cerrar(ids)
+            self.assertEqual(respuesta.status_code, 400, ids)
+            enviar.assert_not_called()
+
+        self.assertEqual(Incidente.objects.filter(estado=self.cerrado).count(), 0)
+
+        respuesta, _, _ = self.cerrar(["x"])
+        self.assertEqual(respuesta.status_code, 400)
+
+
+# ---------------- TEMAS ----------------
+
+@override_settings(CHANNEL_LAYERS=CAPA_MEMORIA, REALTIME_PING_S=0)
+class TemasTests(SimpleTestCase):
+
+    async def pedir(self, comm, accion, temas):
+        await comm.send_json_to({"accion": accion, "temas": temas})
+        return await comm.receive_json_from()
+
+    async def test_permisos_por_rol(self):
+        casos = {
+            "rescatista": (["catalogos"], ["incidente_1", "auditoria", "auditoria_incidente_1"]),
+            "auditor": (["auditoria", "auditoria_incidente_1"], ["incidente_1"]),
+            "operador": (["incidente_1", "auditoria_incidente_1"], ["auditoria"]),
+            "admin": (["incidente_1", "auditoria", "auditoria_incidente_1"], []),
+        }
+
+        for rol, (aceptados, rechazados) in casos.items():
+            with self.subTest(rol=rol):
+                comm, _, _ = await conectar_ws(rol)
+
+                # desconocidos y con id mal formado: para todos
+                respuesta = await self.pedir(
+                    comm, "suscribir",
+                    [*aceptados, *rechazados, "nada", "incidente_x", "incidente_", 7]
+                )
+
+                self.assertEqual(respuesta["temas"], aceptados)
+                self.assertEqual(
+                    respuesta["rechazados"],
+                    [*rechazados, "nada", "incidente_x", "incidente_", 7]
+                )
+
+                for tema in rechazados:
+                    self.assertEqual(miembros(tema), set())
+                for tema in aceptados:
+                    self.assertEqual(len(miembros(tema)), 1)
+
+                await comm.disconnect()
+
+    async def test_temas_al_conectar(self):
+        comm, _, _ = await conectar_ws("rescatista", "temas=catalogos,incidente_5")
+
+        respuesta = await comm.receive_json_from()
+        self.assertEqual(respuesta["accion"], "suscrito")
+        self.assertEqual(respuesta["temas"], ["catalogos"])
+        self.assertEqual(respuesta["rechazados"], ["incidente_5"])
+        self.assertEqual(len(miembros("catalogos")), 1)
+
+        await comm.disconnect()
+        self.assertEqual(miembros("catalogos"), set())
+
+    async def test_maximo_de_temas(self):
+        comm, _, _ = await conectar_ws("operador")
+
+        temas = [f"incidente_{i}" for i in range(MAX_TEMAS + 1)]
+        respuesta = await self.pedir(comm, "suscribir", temas)
+
+        self.assertEqual(respuesta["temas"], temas[:MAX_TEMAS])
+        self.assertEqual(respuesta["rechazados"], temas[MAX_TEMAS:])
+
+        # repetir uno ya suscrito no cuenta como nuevo
+        respuesta = await self.pedir(comm, "suscribir", temas[:1])
+        self.assertEqual(respuesta["temas"], temas[:1])
+
+        # al soltar uno queda sitio
+        await self.pedir(comm, "desuscribir", temas[:1])
+        respuesta = await self.pedir(comm, "suscribir", temas[MAX_TEMAS:])
+        self.assertEqual(respuesta["temas"], temas[MAX_TEMAS:])
+
+        await comm.disconnect()
+
+    async def test_desuscribir(self):
+        comm, _, _ = await conectar_ws("operador")
+
+        await self.pedir(comm, "suscribir", ["incidente_1", "incidente_2"])
+
+        respuesta = await self.pedir(comm, "desuscribir", ["incidente_1", "incidente_1", "incidente_9"])
+
+        self.assertEqual(respuesta, {"accion": "desuscrito", "temas": ["incidente_1"]})
+        self.assertEqual(miembros("incidente_1"), set())
+        self.assertEqual(len(miembros("incidente_2")), 1)
+
+        # ya no le llega lo del tema
+        await group_send_many(["incidente_1"], {
+            "type": "enviar_evento",
+            "data": {"accion": "incidente_update", "op": "upsert", "id": 1, "version": 1}
+        })
+        self.assertTrue(await comm.receive_nothing())
+
+        await comm.disconnect()
+
+
+# ---------------- LISTADO (keyset y filtros) ----------------
+
+@override_settings(CHANNEL_LAYERS=CAPA_MEMORIA, CACHES=CACHE_LOCAL)
+class ListadoIncidentesTests(DatosMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+
+        # cuatro con la misma fecha: el id desempata
+        ahora = timezone.now()
+        empatados = [inc.id for inc in cls.incidentes[1:5]]
+        Incidente.objects.filter(id__in=empatados).update(fecha_creacion=ahora - timedelta(hours=1))
+        Incidente.objects.filter(id=cls.incidentes[0].id).update(fecha_creacion=ahora - timedelta(hours=2))
+        Incidente.objects.filter(id=cls.incidentes[5].id).update(fecha_creacion=ahora)
+
+        cls.orden = [cls.incidentes[5].id, *sorted(empatados, reverse=True), cls.incidentes[0].id]
+
+    def get(self, url):
+        respuesta = self.cliente.get(url)
+        return respuesta.status_code, respuesta.data
+
+    def test_lista_sin_paginar(self):
+        status, data = self.get("/api/incidentes/")
+
+        self.assertEqual(status, 200)
+        self.assertIsInstance(data, list)
+        self.assertEqual([i["id"] for i in data], self.orden)
+
+    def test_paginas_continuas_con_fechas_empatadas(self):
+        vistos = []
+        url = "/api/incidentes/?limite=2"
+
+        while url:
+            status, data = self.get(url)
+            self.assertEqual(status, 200)
+            self.assertLessEqual(len(data["resultados"]), 2)
+
+            vistos += [i["id"] for i in data["resultados"]]
+            url = data["siguiente"] and f"/api/incidentes/?limite=2&cursor={data['siguiente']}"
+
+        self.assertEqual(vistos, self.orden)
+
+    def test_ultima_pagina_sin_siguiente(self):
+        status, data = self.get(f"/api/incidentes/?limite={self.INCIDENTES}")
+        self.assertEqual(len(data["resultados"]), self.INCIDENTES)
+        self.assertIsNone(data["siguiente"])
+
+    def test_filtros(self):
+        Incidente.objects.filter(id=self.orden[0]).update(estado=self.cerrado, rescatista=None)
+
+        _, data = self.get(f"/api/incidentes/?limite=50&estado={self.cerrado.id}")
+        self.assertEqual([i["id"] for i in data["resultados"]], self.orden[:1])
+
+        _, data = self.get("/api/incidentes/?rescatista=ninguno")
+        self.assertEqual([i["id"] for i in data], self.orden[:1])
+
+        _, data = self.get(f"/api/incidentes/?rescatista={self.rescatista.id}&estado={self.abierto.id},{self.cerrado.id}")
+        self.assertEqual([i["id"] for i in data], self.orden[1:])
+
+        manana = (timezone.localdate() + timedelta(days=1)).isoformat()
+        _, data = self.get(f"/api/incidentes/?desde={manana}")
+        self.assertEqual(data, [])
+
+    def test_cursor_invalido(self):
+        malos = [
+            "no-es-base64!",
+            base64.urlsafe_b64encode(b"[1, 2]").decode(),
+            base64.urlsafe_b64encode(b'["2024-01-01T00:00:00", "7"]').decode(),
+            base64.urlsafe_b64encode(b'{"a": 1}').decode(),
+        ]
+
+        for cursor in malos:
+            status, data = self.get(f"/api/incidentes/?cursor={cursor}")
+            self.assertEqual(status, 400, cursor)
+            self.assertEqual(data, {"error": "Cursor inválido"})
+
+    def test_filtros_invalidos(self):
+        for consulta in [
+            "estado=abierto",
+            "severidad=1,x",
+            "rescatista=alguno",
+            "activo=quizas",
+            "desde=2024-13-01",
+            "fecha=ayer",
+        ]:
+            status, data = self.get(f"/api/incidentes/?{consulta}")
+            self.assertEqual(status, 400, consulta)
+            self.assertIn("error", data)
+
+
+# ---------------- CAMPOS (?fields= / ?omit=) ----------------
+
+@override_settings(CHANNEL_LAYERS=CAPA_MEMORIA, CACHES=CACHE_LOCAL)
+class CamposTests(DatosMixin, TestCase):
+
+    def sql_incidentes(self, url):
+        # solo la consulta del listado (la autenticación lee auth_user)
+        desde = f'FROM "{Incidente._meta.db_table}"'
+
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.cliente.get(url)
+
+        self.assertEqual(respuesta.status_code, 200)
+        sql = [q["sql"] for q in consultas.captured_queries if desde in q["sql"]]
+        self.assertEqual(len(sql), 1)
+        return respuesta.data, sql[0]
+
+    def test_fields_con_fijos(self):
+        data, _ = self.sql_incidentes("/api/incidentes/?fields=descripcion")
+
+        self.assertEqual(len(data), self.INCIDENTES)
+        for incidente in data:
+            self.assertEqual(set(incidente), {"id", "version", "descripcion"})
+
+    def test_omit(self):
+        data, _ = self.sql_incidentes("/api/incidentes/?omit=descripcion,evidencia_url")
+
+        self.assertNotIn("descripcion", data[0])
+        self.assertNotIn("evidencia_url", data[0])
+        self.assertIn("estado_nombre", data[0])
+
+    def test_omit_no_quita_los_fijos(self):
+        data, _ = self.sql_incidentes("/api/incidentes/?fields=estado&omit=id,version")
+        self.assertEqual(set(data[0]), {"id", "version", "estado"})
+
+    def test_campo_desconocido(self):
+        for consulta in ["fields=descripcion,nada", "omit=nada", "limite=5&fields=nada"]:
+            respuesta = self.cliente.get(f"/api/incidentes/?{consulta}")
+            self.assertEqual(respuesta.status_code, 400, consulta)
+            self.assertIn("nada", respuesta.data["error"])
+
+        respuesta = self.cliente.get("/api/recursos/?fields=nada")
+        self.assertEqual(respuesta.status_code, 400)
+
+    def test_poda_joins_y_subconsulta(self):
+        _, completa = self.sql_incidentes("/api/incidentes/")
+        self.assertIn("JOIN", completa)
+        self.assertIn(Asignacion._meta.db_table, completa)
+
+        data, podada = self.sql_incidentes("/api/incidentes/?fields=descripcion")
+        self.assertNotIn("JOIN", podada)
+        self.assertNotIn(Asignacion._meta.db_table, podada)
+        self.assertNotIn("latitud", podada)
+
+    def test_poda_solo_las_relaciones_pedidas(self):
+        data, sql = self.sql_incidentes("/api/incidentes/?fields=tipo_nombre,recursos_asignados")
+
+        self.assertEqual({i["tipo_nombre"] for i in data}, {"Incendio"})
+        self.assertEqual({i["recursos_asignados"] for i in data}, {2})
+        self.assertIn(TipoIncidente._meta.db_table, sql)
+        self.assertIn(Asignacion._meta.db_table, sql)
+        self.assertNotIn(User._meta.db_table, sql)
+        self.assertNotIn(EstadoIncidente._meta.db_table, sql)
+
+    def test_recursos(self):
+        desde = f'FROM "{Recurso._meta.db_table}"'
+
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.cliente.get("/api/recursos/?fields=nombre")
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(set(respuesta.data[0]), {"id", "nombre"})
+
+        sql = [q["sql"] for q in consultas.captured_queries if desde in q["sql"]]
+        self.assertEqual(len(sql), 1)
+        self.assertNotIn("JOIN", sql[0])
+
+
+# ---------------- STREAMING ----------------
+
+@override_settings(CHANNEL_LAYERS=CAPA_MEMORIA, CACHES=CACHE_LOCAL)
+class StreamingTests(DatosMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        # partes chicas: el arreglo cruza varios límites de buffer
+        parche = mock.patch("Aplicaciones.incidentes.streaming.BUFFER_BYTES", 200)
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    def leer(self, url):
+        respuesta = self.cliente.get(url)
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertTrue(respuesta.streaming)
+        self.assertEqual(respuesta["Content-Type"], "application/json")
+
+        partes = list(respuesta.streaming_content)
+        return partes, json.loads(b"".join(partes))
+
+    def serializado(self, qs, **kwargs):
+        # lo que habría respondido Response(serializer.data)
+        return json.loads(JSONRenderer().render(IncidenteSerializer(qs, many=True, **kwargs).data))
+
+    def test_exportar(self):
+        partes, data = self.leer("/api/incidentes/exportar/")
+
+        self.assertGreater(len(partes), 1)
+        self.assertEqual(
+            data,
+            self.serializado(incidentes_qs().order_by("-fecha_creacion", "-id"))
+        )
+        self.assertEqual(data, self.cliente.get("/api/incidentes/").json())
+
+    def test_exportar_con_filtros_y_campos(self):
+        Incidente.objects.filter(id=self.incidentes[0].id).update(estado=self.cerrado)
+
+        _, data = self.leer(f"/api/incidentes/exportar/?estado={self.cerrado.id}&fields=descripcion")
+        self.assertEqual(data, [{
+            "id": self.incidentes[0].id,
+            "version": self.incidentes[0].version,
+            "descripcion": self.incidentes[0].descripcion,
+        }])
+
+    def test_inactivos(self):
+        inactivos = [inc.id for inc in self.incidentes[:3]]
+        Incidente.objects.filter(id__in=inactivos).update(activo=False)
+
+        _, data = self.leer("/api/incidentes/inactivos/")
+
+        self.assertEqual(sorted(i["id"] for i in data), inactivos)
+        self.assertEqual(
+            sorted(data, key=lambda i: i["id"]),
+            self.serializado(incidentes_qs(Incidente.all_objects.filter(activo=False)).order_by("id"))
+        )
+
+    def test_vacio(self):
+        partes, data = self.leer("/api/incidentes/inactivos/")
+        self.assertEqual(partes, [b"[]"])
+        self.assertEqual(data, [])
+
+    def test_auditoria(self):
+        inc = self.incidentes[0]
+        comunes = {"tabla": "incidente", "registro_id": inc.id, "ip": "127.0.0.1", "user_agent": "test"}
+
+        AuditoriaAccion.objects.create(
+            usuario=self.operador, rol="operador", accion="UPDATE", metodo="PATCH",
+            endpoint=f"/api/incidentes/{inc.id}/",
+            data={"descripcion": "Humo \u2028 \"negro\"", "n": [1.5, None]},
+            **comunes
+        )
+        AuditoriaAccion.objects.create(
+            usuario=None, rol="", accion="DELETE", metodo="DELETE",
+            endpoint=f"/api/incidentes/{inc.id}/", data=None, **comunes
+        )
+
+        _, data = self.leer(f"/api/incidentes/{inc.id}/auditoria/")
+
+        logs = AuditoriaAccion.objects.filter(tabla="incidente", registro_id=inc.id).order_by("fecha")
+        self.assertEqual(data, [
+            {
+                "usuario": a.usuario.username if a.usuario else "-",
+                "rol": a.rol,
+                "accion": a.accion,
+                "metodo": a.metodo,
+                "endpoint": a.endpoint,
+                "fecha": a.fecha.strftime("%Y-%m-%d %H:%M:%S"),
+                "data": a.data,
+            }
+            for a in logs
+        ])
+        self.assertEqual(data[1]["usuario"], "-")
+
+
+# ---------------- JSON (ujson) ----------------
+
+@override_settings(CHANNEL_LAYERS=CAPA_MEMORIA, CACHES=CACHE_LOCAL)
+class JsonRapidoTests(DatosMixin, TestCase):
+
+    def assertMismoJson(self, data):
+        esperado = JSONRenderer().render(data)
+        self.assertEqual(JSONRapidoRenderer().render(data), esperado)
+        return esperado
+
+    def test_tipos(self):
+        ahora = timezone.now()
+
+        self.assertMismoJson({
+            "latitud": Decimal("-0.180000"),
+            "grande": Decimal("12345678901234567890.123456789"),
+            "fecha": ahora,
+            "fecha_utc": datetime(2024, 1, 2, 3, 4, 5, 123456, tzinfo=dt_timezone.utc),
+            "fecha_local": timezone.localtime(ahora),
+            "dia": date(2024, 1, 2),
+            "hora": dt_time(3, 4, 5),
+            "duracion": timedelta(minutes=5),
+            "uuid": uuid.UUID(int=5),
+            "lazy": gettext_lazy("Incendio"),
+            "texto": "Ñandú </script> \u2028\u2029",
+            "anidado": [{"uuid": uuid.uuid4(), "n": [1, 2.5, None, True]}],
+        })
+
+    def test_no_finitos(self):
+        for renderer in [JSONRenderer(), JSONRapidoRenderer()]:
+            with self.assertRaises(ValueError):
+                renderer.render({"x": float("nan")})
+
+    def test_incidentes_serializados(self):
+        data = IncidenteSerializer(incidentes_qs(), many=True).data
+        esperado = self.assertMismoJson(data)
+
+        # y vuelve igual por el parser
+        self.assertEqual(JSONRapidoParser().parse(io.BytesIO(esperado)), json.loads(esperado))
+
+    def test_respuesta_api(self):
+        respuesta = self.cliente.get("/api/incidentes/")
+        self.assertEqual(respuesta.content, JSONRenderer().render(respuesta.data))
+
+
+# ---------------- ETAG ----------------
+
+@override_settings(CHANNEL_LAYERS=CAPA_MEMORIA, CACHES=CACHE_LOCAL)
+class EtagTests(DatosMixin, TestCase):
+
+    URL = "/api/incidentes/"
+
+    def etag(self, **cabeceras):
+        respuesta = self.cliente.get(self.URL, **cabeceras)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertIn("Accept", respuesta["Vary"])
+        return respuesta["ETag"]
+
+    def revalidar(self, etag):
+        return self.cliente.get(self.URL, HTTP_IF_NONE_MATCH=etag).status_code
+
+    def test_304_con_el_mismo_etag(self):
+        etag = self.etag()
+
+        respuesta = self.cliente.get(self.URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 304)
+        self.assertEqual(respuesta["ETag"], etag)
+        self.assertIn("Accept", respuesta["Vary"])
+
+    def test_escritura_invalida(self):
+        etag = self.etag()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            inc = self.incidentes[0]
+            inc.descripcion = "Otra"
+            inc.save()
+
+        self.assertEqual(self.revalidar(etag), 200)
+        self.assertNotEqual(self.etag(), etag)
+
+    def test_html_y_json_no_comparten_etag(self):
+        self.assertNotEqual(self.etag(), self.etag(HTTP_ACCEPT="text/html"))
+
+    def test_login_no_invalida(self):
+        etag = self.etag()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.operador.last_login = timezone.now()
+            self.operador.save(update_fields=["last_login"])
+
+        self.assertEqual(self.revalidar(etag), 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.operador.first_name = "Ana"
+            self.operador.save(update_fields=["first_name", "last_login"])
+
+        self.assertEqual(self.revalidar(etag), 200)
+
+
+# ---------------- EVIDENCIAS ----------------
+
+@override_settings(CHANNEL_LAYERS=CAPA_MEMORIA, CACHES=CACHE_LOCAL)
+class EvidenciasTests(DatosMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+
+        ajuste = override_settings(MEDIA_ROOT=media)
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+
+    def con_evidencia(self, contenido, nombre):
+        return Incidente.objects.create(
+            tipo=self.tipo,
+            severidad=self.severidad,
+            estado=self.abierto,
+            descripcion="Con evidencia",
+            creado_por=self.operador,
+            evidencia=ContentFile(contenido, name=nombre)
+        )
+
+    def archivos(self):
+        # nombres de almacenamiento de todo lo que hay en disco
+        raiz = almacenamiento_evidencias.path("")
+        return sorted(
+            os.path.relpath(os.path.join(carpeta, archivo), raiz).replace(os.sep, "/")
+            for carpeta, _, archivos in os.walk(raiz)
+            for archivo in archivos
+        )
+
+    def referencias(self, inc):
+        inc.refresh_from_db()
+        return BlobEvidencia.objects.get(nombre=inc.evidencia.name).referencias
+
+    def envejecer(self, nombre):
+        antes = time.time() - 2 * 3600
+        os.utime(almacenamiento_evidencias.path(nombre), (antes, antes))
+
+    def test_mismo_contenido_un_archivo(self):
+        a = self.con_evidencia(b"informe", "parte.pdf")
+        b = self.con_evidencia(b"informe", "PARTE.txt")
+
+        self.assertEqual(a.evidencia.name, b.evidencia.name)
+        self.assertTrue(a.evidencia.name.endswith(".pdf"))
+        self.assertEqual(len(self.archivos()), 1)
+        self.assertEqual(self.referencias(a), 2)
+
+    def test_subida_en_curso_con_otra_extension(self):
+        original = AlmacenamientoDireccionado.reservar
+        nombres = []
+
+        # la segunda subida llega entre la reserva y el rename de la primera
+        def reservar(almacen, *args):
+            nombre = original(almacen, *args)
+            if not nombres:
+                nombres.append(nombre)
+                nombres.append(almacen.save("incidentes/foto.png", ContentFile(b"foto")))
+            return nombre
+
+        with mock.patch.object(AlmacenamientoDireccionado, "reservar", reservar):
+            primero = almacenamiento_evidencias.save("incidentes/foto.jpg", ContentFile(b"foto"))
+
+        self.assertEqual(nombres, [primero, primero])
+        self.assertEqual(len(self.archivos()), 1)
+        self.assertEqual(BlobEvidencia.objects.count(), 1)
+
+    def test_referencias_al_cambiar_y_borrar(self):
+        a = self.con_evidencia(b"uno", "a.jpg")
+        b = self.con_evidencia(b"uno", "a.jpg")
+        nombre_uno = a.evidencia.name
+
+        a.evidencia = ContentFile(b"dos", name="b.jpg")
+        a.save()
+
+        self.assertEqual(self.referencias(a), 1)
+        self.assertEqual(self.referencias(b), 1)
+
+        # el borrado lógico conserva la evidencia; el físico la suelta
+        b.activo = False
+        b.save()
+        self.assertEqual(BlobEvidencia.objects.get(nombre=nombre_uno).referencias, 1)
+
+        b.delete()
+        self.assertEqual(BlobEvidencia.objects.get(nombre=nombre_uno).referencias, 0)
+
+        # nada se borra del disco hasta la recolección
+        self.assertEqual(len(self.archivos()), 2)
+
+    def test_recoleccion(self):
+        usado = self.con_evidencia(b"usado", "usado.pdf")
+        suelto = self.con_evidencia(b"suelto", "suelto.pdf")
+        reciente = self.con_evidencia(b"reciente", "reciente.pdf")
+
+        nombre_suelto = suelto.evidencia.name
+        nombre_reciente = reciente.evidencia.name
+        Incidente.all_objects.filter(id__in=[suelto.id, reciente.id]).delete()
+        self.envejecer(nombre_suelto)
+
+        # conteo desviado y un archivo sin fila (subida revertida)
+        BlobEvidencia.objects.filter(nombre=usado.evidencia.name).update(referencias=5)
+        huerfano = almacenamiento_evidencias.nombre_blob("incidentes", "f" * 64, ".pdf")
+        os.makedirs(os.path.dirname(almacenamiento_evidencias.path(huerfano)), exist_ok=True)
+        with open(almacenamiento_evidencias.path(huerfano), "wb") as f:
+            f.write(b"huerfano")
+        self.envejecer(huerfano)
+
+        salida = io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("deduplicar_evidencias", stdout=salida)
+
+        self.assertEqual(self.referencias(usado), 1)
+        self.assertFalse(BlobEvidencia.objects.filter(nombre=nombre_suelto).exists())
+        self.assertTrue(BlobEvidencia.objects.filter(nombre=nombre_reciente).exists())
+
+        self.assertEqual(self.archivos(), sorted([usado.evidencia.name, nombre_reciente]))
+        self.assertIn("referencias_corregidas", salida.getvalue())
+
+
+# ---------------- COALESCENCIA ----------------
+
+@override_settings(CHANNEL_LAYERS=CAPA_MEMORIA, REALTIME_PING_S=0)
+class CoalescenciaTests(SimpleTestCase):
+
+    async def conectar(self, ventana_ms):
+        with self.settings(REALTIME_COALESCE_MS=ventana_ms):
+            comm, _, _ = await conectar_ws("operador")
+        return comm
+
+    async def recibir(self, comm, n, timeout=1):
+        return [
+            (e["id"], e["version"], e["seq"])
+            for e in [await comm.receive_json_from(timeout) for _ in range(n)]
+        ]
+
+    async def test_rafaga_de_un_incidente_sale_en_un_frame(self):
+        comm = await self.conectar(100)
+
+        for version in range(1, 6):
+            await publicar(1, version)
+
+        [(id_, version, _)] = await self.recibir(comm, 1)
+        self.assertEqual((id_, version), (1, 5))
+        self.assertTrue(await comm.receive_nothing(0.2))
+
+        await comm.disconnect()
+
+    async def test_version_vieja_no_reemplaza_a_la_nueva(self):
+        comm = await self.conectar(100)
+
+        await publicar(1, 3)
+        await publicar(1, 2)
+
+        [(_, version, _)] = await self.recibir(comm, 1)
+        self.assertEqual(version, 3)
+        self.assertTrue(await comm.receive_nothing(0.2))
+
+        await comm.disconnect()
+
+    async def test_critico_vacia_lo_pendiente_en_orden(self):
+        # ventana larga: lo que llegue antes solo puede venir del crítico
+        comm = await self.conectar(60_000)
+
+        await publicar(1, 1)
+        await publicar(2, 1)
+        await publicar(1, 2)
+        await publicar(3, 1, critico=True)
+
+        recibidos = await self.recibir(comm, 3)
+
+        self.assertEqual([(i, v) for i, v, _ in recibidos], [(2, 1), (1, 2), (3, 1)])
+        self.assertEqual([s for *_, s in recibidos], sorted(s for *_, s in recibidos))
+        self.assertTrue(await comm.receive_nothing(0.2))
+
+        await comm.disconnect()
+
+    async def test_critico_reemplaza_al_pendiente_del_mismo_incidente(self):
+        comm = await self.conectar(60_000)
+
+        await publicar(1, 1)
+        await publicar(1, 2, critico=True)
+
+        self.assertEqual([(i, v) for i, v, _ in await self.recibir(comm, 1)], [(1, 2)])
+        self.assertTrue(await comm.receive_nothing(0.2))
+
+        await comm.disconnect()
+
+
+# ---------------- CODIFICACIÓN ----------------
+
+def decodificar(frame, subprotocolo):
+    '''
+    Lo que hace el cliente: zlib si empieza por 0x78, luego JSON o msgpack.
+    '''
+    formato = (subprotocolo or "json").split(".")[0]
+
+    if isinstance(frame, bytes) and frame[:1] == b"\x78":
+        frame = zlib.decompress(frame)
+
+    if formato == "msgpack":
+        return msgpack.unpackb(frame)
+    return json.loads(frame)
+
+
+@override_settings(
+    CHANNEL_LAYERS=CAPA_MEMORIA,
+    REALTIME_COALESCE_MS=0,
+    REALTIME_PING_S=0,
+    REALTIME_DEFLATE_MIN_BYTES=256
+)
+class CodificacionTests(SimpleTestCase):
+
+    CHICO = {"accion": "incidente_update", "op": "upsert", "id": 1, "version": 1}
+    GRANDE = {**CHICO, "incidente": {"descripcion": "humo " * 200, "latitud": "-0.180000"}}
+
+    def test_elige_por_preferencia_del_servidor(self):
+        self.assertEqual(elegir_subprotocolo(["json", "msgpack.deflate"]), "msgpack.deflate")
+        self.assertEqual(elegir_subprotocolo(["json.deflate", "json"]), "json.deflate")
+        self.assertEqual(elegir_subprotocolo(["xml", "json"]), "json")
+        self.assertIsNone(elegir_subprotocolo(["xml"]))
+        self.assertIsNone(elegir_subprotocolo(None))
+
+    def test_umbral_de_compresion(self):
+        for subprotocolo in SUBPROTOCOLOS:
+            with self.subTest(subprotocolo=subprotocolo):
+                texto, binario = codificar(self.CHICO, subprotocolo)
+                comprimido = codificar(self.GRANDE, subprotocolo)[1]
+
+                # por debajo del umbral: sin comprimir, aun con .deflate
+                if subprotocolo.startswith("json"):
+                    self.assertEqual(json.loads(texto), self.CHICO)
+                else:
+                    self.assertIsNone(texto)
+                    self.assertEqual(msgpack.unpackb(binario), self.CHICO)
+
+                if subprotocolo.endswith(".deflate"):
+                    self.assertEqual(comprimido[:1], b"\x78")
+                    self.assertLess(len(comprimido), len(json.dumps(self.GRANDE)))
+
+        with self.settings(REALTIME_DEFLATE_MIN_BYTES=1):
+            self.assertEqual(codificar(self.CHICO, "json.deflate")[1][:1], b"\x78")
+
+    def test_precodificado_igual_a_codificar(self):
+        frames = precodificar(self.GRANDE)
+
+        self.assertEqual(set(frames), set(SUBPROTOCOLOS))
+        for subprotocolo, frame in frames.items():
+            self.assertEqual(frame, codificar(self.GRANDE, subprotocolo))
+
+    async def test_ida_y_vuelta_por_el_socket(self):
+        for subprotocolo in [*SUBPROTOCOLOS, None]:
+            with self.subTest(subprotocolo=subprotocolo):
+                comm, aceptado, hola = await conectar_ws(
+                    "operador",
+                    protocolos=[subprotocolo] if subprotocolo else None
+                )
+
+                self.assertEqual(aceptado, subprotocolo)
+                self.assertEqual(decodificar(hola, subprotocolo)["accion"], "conectado")
+
+                for data in (self.CHICO, self.GRANDE):
+                    await group_send_many(["rol_operador"], {"type": "enviar_evento", "data": data})
+                    recibido = decodificar(await comm.receive_from(), subprotocolo)
+
+                    recibido.pop("seq")
+                    self.assertEqual(recibido, data)
+
+                await comm.disconnect()
+
+
+# ---------------- LATIDO ----------------
+
+@override_settings(
+    CHANNEL_LAYERS={
+        "default": {
+            **CAPA_MEMORIA["default"],
+            "CONFIG": {**CAPA_MEMORIA["default"]["CONFIG"], "group_expiry": 0.6},
+        }
+    },
+    REALTIME_COALESCE_MS=0,
+    REALTIME_PING_S=0.05,
+    REALTIME_IDLE_TIMEOUT_S=0.3
+)
+class LatidoTests(SimpleTestCase):
+
+    async def hasta_cerrar(self, comm, timeout=2):
+        '''
+        Lee (y descarta los ping) hasta el cierre; devuelve su código.
+        '''
+        while True:
+            salida = await comm.receive_output(timeout)
+            if salida["type"] == "websocket.close":
+                return salida.get("code")
+            self.assertEqual(json.loads(salida["text"])["accion"], "ping")
+
+    async def responder_pings(self, comm, segundos):
+        fin = asyncio.get_running_loop().time() + segundos
+        while asyncio.get_running_loop().time() < fin:
+            salida = await comm.receive_output(1)
+            self.assertEqual(salida["type"], "websocket.send")
+            await comm.send_json_to({"accion": "pong"})
+
+    async def test_socket_mudo_se_cierra_y_sale_de_sus_grupos(self):
+        comm, _, _ = await conectar_ws("operador", "temas=incidente_1")
+        await comm.receive_json_from()      # suscrito
+
+        self.assertEqual(len(miembros("rol_operador")), 1)
+        self.assertEqual(len(miembros("incidente_1")), 1)
+
+        self.assertEqual(await self.hasta_cerrar(comm), 4408)
+        self.assertEqual(miembros("rol_operador"), set())
+        self.assertEqual(miembros("incidente_1"), set())
+
+    async def test_pong_lo_mantiene_y_renueva_la_membresia(self):
+        comm, _, _ = await conectar_ws("operador")
+
+        # más que el tiempo inactivo y que la expiración de los grupos
+        await self.responder_pings(comm, 1.0)
+
+        self.assertEqual(len(miembros("rol_operador")), 1)
+        await publicar(1, 1)
+        while (evento := await comm.receive_json_from(1))["accion"] == "ping":
+            pass
+        self.assertEqual(evento["id"], 1)
+
+        # deja de contestar: se cierra
+        self.assertEqual(await self.hasta_cerrar(comm), 4408)
+
+
+# ---------------- CATÁLOGOS ----------------
+
+@override_settings(CHANNEL_LAYERS=CAPA_MEMORIA, CACHES=CACHE_LOCAL)
+class CatalogoTests(DatosMixin, TestCase):
+
+    def test_escritura_invalida_y_recarga(self):
+        cache_estados = catalogo(EstadoRecurso)
+        self.assertIsNone(cache_estados.por_nombre("Mantenimiento"))
+        generacion = cache_estados.generacion
+
+        with mock.patch("Aplicaciones.incidentes.realtime.despachar") as despachar:
+            with self.captureOnCommitCallbacks(execute=True):
+                nuevo = EstadoRecurso.objects.create(nombre="Mantenimiento")
+
+        self.assertEqual(cache_estados.generacion, generacion + 1)
+        self.assertEqual(cache_estados.por_nombre("mantenimiento"), nuevo)
+
+        # y el aviso a los demás procesos, después del commit
+        grupos, mensaje = despachar.call_args.args
+        self.assertEqual(grupos, [GRUPO_CONTROL])
+        self.assertEqual(mensaje["data"], {"accion": "catalogo_invalidado", "tabla": "estado_recurso"})
+
+    def test_sin_escritura_no_consulta(self):
+        catalogo(TipoIncidente).todos()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(catalogo(TipoIncidente).por_nombre("incendio"), self.tipo)
+            self.assertEqual(catalogo(TipoIncidente).por_id(self.tipo.id), self.tipo)
+
+
+@override_settings(CHANNEL_LAYERS=CAPA_MEMORIA)
+class ControlCatalogosTests(SimpleTestCase):
+
+    async def test_aviso_de_otro_proceso_invalida(self):
+        cache_estados = catalogo(EstadoRecurso)
+        self.addCleanup(cache_estados.invalidar)
+        asyncio.ensure_future(escuchar_control())
+
+        try:
+            # la escucha entra al grupo de control
+            while not miembros(GRUPO_CONTROL):
+                await asyncio.sleep(0.01)
+
+            cache_estados.datos = ({}, {}, time.monotonic() + 300)
+            generacion = cache_estados.generacion
+
+            # lo que publica otro proceso al escribir (ver el test anterior)
+            await group_send_many([GRUPO_CONTROL], {
+                "type": "control",
+                "data": {"accion": "catalogo_invalidado", "tabla": "estado_recurso"}
+            }, registrar=False)
+
+            for _ in range(100):
+                if cache_estados.datos is None:
+                    break
+                await asyncio.sleep(0.01)
+
+            self.assertIsNone(cache_estados.datos)
+            self.assertEqual(cache_estados.generacion, generacion + 1)
+
+        finally:
+            # escucha y su renovación de grupo
+            for tarea in asyncio.all_tasks():
+                if tarea is not asyncio.current_task():
+                    tarea.cancel()
@@ -22,6 +22,7 @@ urlpatterns = [
     path("recursos/", recursos_api),
     path("recursos/<int:pk>/", recurso_detalle),
     path("recursos/disponibles/", recursos_disponibles),
+    path("recursos/<int:pk>/posicion/", posicion_recurso),
 
     # INCIDENTES
     path("incidentes/", incidentes_api),
@@ -34,10 +35,17 @@ urlpatterns = [
 
     # ✅ Guardar asignación (rescatista + asignar/desasignar recursos)
     path("incidentes/<int:pk>/asignar/", asignar_recursos),
+    path("incidentes/<int:pk>/recursos-cercanos/", recursos_cercanos),
 
 
     path("incidentes/<int:pk>/auditoria/", auditoria_incidente),
-    path("api/incidentes/inactivos/", incidentes_inactivos),
+    path("incidentes/inactivos/", incidentes_inactivos),
+    path("incidentes/exportar/", exportar_incidentes),
+    path("incidentes/buscar/", buscar_incidentes),
+    path("incidentes/cerrar/", cerrar_incidentes),
+    path("incidentes/ingesta/", ingesta_incidentes),
+
+    path("operador/snapshot/", snapshot_operador),
 
 
 
@@ -0,0 +1,112 @@
+import time
+import hashlib
+import logging
+from functools import wraps
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
+from rest_framework.response import Response
+
+
+logger = logging.getLogger(__name__)
+
+
+# Versión por tabla en la caché compartida (Redis): cada escritura la sube
+# después del commit y los listados la convierten en ETag. Un GET con
+# If-None-Match igual responde 304 sin tocar el ORM ni los serializers.
+#
+# La versión se lee antes de consultar los datos y se sube después del
+# commit: un ETag nunca queda asociado para siempre a datos viejos.
+
+PREFIJO = "version:"
+
+
+def _clave(tabla):
+    return f"{PREFIJO}{tabla}"
+
+
+def _inicial():
+    # arranque o caché vaciada: milisegundos, nunca repite una versión vieja
+    return int(time.time() * 1000)
+
+
+def versiones(tablas):
+    claves = [_clave(tabla) for tabla in tablas]
+    actuales = cache.get_many(claves)
+
+    for clave in claves:
+        if clave not in actuales:
+            cache.add(clave, _inicial(), timeout=None)
+            actuales[clave] = cache.get(clave)
+
+    return [actuales[clave] for clave in claves]
+
+
+def tocar_versiones(*tablas):
+    '''
+    Sube la versión de las tablas cuando la transacción actual confirme.
+    '''
+    transaction.on_commit(lambda: _subir(tablas))
+
+
+def _subir(tablas):
+    for tabla in tablas:
+        try:
+            try:
+                cache.incr(_clave(tabla))
+            except ValueError:
+                cache.add(_clave(tabla), _inicial(), timeout=None)
+        except Exception:
+            logger.exception("No se pudo subir la versión de %s", tabla)
+
+
+def etag_listado(request, tablas):
+    # la misma URL en JSON y en la API navegable (HTML) son otra respuesta
+    formato = getattr(request, "accepted_media_type", "")
+
+    base = "|".join(
+        [request.get_host(), request.get_full_path(), formato]
+        + [f"{tabla}={version}" for tabla, version in zip(tablas, versiones(tablas))]
+    )
+    return quote_etag(hashlib.sha1(base.encode()).hexdigest())
+
+
+def con_etag(*tablas):
+    '''
+    Decorador de vistas de listado (debajo de @permission_classes: el 304
+    solo sale después de autenticar). tablas: todo lo que la respuesta lee.
+    '''
+    def decorador(vista):
+
+        @wraps(vista)
+        def envuelta(request, *args, **kwargs):
+
+            if request.method != "GET":
+                return vista(request, *args, **kwargs)
+
+            try:
+                etag = etag_listado(request, tablas)
+            except Exception:
+                # sin caché se responde normal, sin ETag
+                logger.exception("Versiones no disponibles")
+                return vista(request, *args, **kwargs)
+
+            if etag in parse_etags(request.headers.get("If-None-Match", "")):
+                respuesta = Response(status=304)
+            else:
+                respuesta = vista(request, *args, **kwargs)
+
+                if respuesta.status_code != 200:
+                    return respuesta
+
+            # el navegador guarda la respuesta y revalida siempre con el ETag
+            respuesta["ETag"] = etag
+            respuesta["Cache-Control"] = "private, no-cache"
+            patch_vary_headers(respuesta, ["Accept"])
+            return respuesta
+
+        return envuelta
+
+    return decorador
@@ -7,28 +7,49 @@ from rest_framework import status
 from rest_framework.parsers import MultiPartParser, FormParser
 
 from Aplicaciones.accounts.permissions import (
-    IsAdmin, IsOperador, IsAuditor, IsAdminOrOperador
+    IsAdmin, IsOperador, IsAuditor, IsAdminOrOperador, IsOperadorOrRescatista
 )
 
 from django.contrib.auth.models import User, Group
 from django.db.models.deletion import ProtectedError
+from django.db import IntegrityError
+from django.db.models import F
 
 from .models import *
 from .serializers import *
 
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
 from django.utils import timezone
+from django.db import transaction
+from datetime import date, datetime, timedelta
+
+from .paginacion import paginar_keyset, leer_limite
+from .consultas import (
+    incidentes_qs, recursos_qs, recursos_disponibles_qs, lectura_consistente
+)
+from .catalogos import catalogo
+from .streaming import respuesta_streaming, serializar_con
+from .campos import leer_seleccion
+from .busqueda import buscar_ids, indexar_incidentes
+from .asignaciones import aplicar_asignacion, liberar_incidentes, estados
+from .cercania import cercanos
+from .ingesta import ingerir, lineas, filas_csv, filas_ndjson
+from .presupuesto import presupuesto_consultas
+from .versiones import con_etag, tocar_versiones
+from .realtime import (
+    enviar_ws, enviar_incidentes, evento_incidente, evento_incidente_borrado,
+    seq_actual, evento_lote
+)
 
 
 # ---------------- CATÁLOGOS ----------------
 
 @api_view(["GET", "POST"])
 @permission_classes([IsAuthenticated, IsAdminOrOperador])
+@con_etag("tipo_incidente")
 def tipo_incidente_api(request):
 
     if request.method == "GET":
-        qs = TipoIncidente.objects.all()
+        qs = catalogo(TipoIncidente).todos()
         return Response(TipoIncidenteSerializer(qs, many=True).data)
 
     if request.method == "POST":
@@ -43,15 +64,11 @@ def tipo_incidente_api(request):
             ser.save()
 
             # 🔔 evento realtime
-            channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)(
-                "catalogos",
+            enviar_ws(
+                ["catalogos"],
                 {
-                    "type": "enviar_evento",
-                    "data": {
-                        "accion": "catalogo_actualizado",
-                        "tabla": "tipo_incidente"
-                    }
+                    "accion": "catalogo_actualizado",
+                    "tabla": "tipo_incidente"
                 }
             )
 
@@ -62,10 +79,11 @@ def tipo_incidente_api(request):
 
 @api_view(["GET", "POST"])
 @permission_classes([IsAuthenticated, IsAdminOrOperador])
+@con_etag("severidad")
 def severidad_api(request):
 
     if request.method == "GET":
-        qs = Severidad.objects.all()
+        qs = catalogo(Severidad).todos()
         return Response(SeveridadSerializer(qs, many=True).data)
 
     if request.method == "POST":
@@ -78,15 +96,11 @@ def severidad_api(request):
         if ser.is_valid():
             ser.save()
 
-            channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)(
-                "catalogos",
+            enviar_ws(
+                ["catalogos"],
                 {
-                    "type": "enviar_evento",
-                    "data": {
-                        "accion": "catalogo_actualizado",
-                        "tabla": "severidad"
-                    }
+                    "accion": "catalogo_actualizado",
+                    "tabla": "severidad"
                 }
             )
 
@@ -97,10 +111,11 @@ def severidad_api(request):
 
 @api_view(["GET", "POST"])
 @permission_classes([IsAuthenticated, IsAdminOrOperador])
+@con_etag("estado_incidente")
 def estado_incidente_api(request):
 
     if request.method == "GET":
-        qs = EstadoIncidente.objects.all()
+        qs = catalogo(EstadoIncidente).todos()
         return Response(EstadoIncidenteSerializer(qs, many=True).data)
 
     if request.method == "POST":
@@ -113,15 +128,11 @@ def estado_incidente_api(request):
         if ser.is_valid():
             ser.save()
 
-            channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)(
-                "catalogos",
+            enviar_ws(
+                ["catalogos"],
                 {
-                    "type": "enviar_evento",
-                    "data": {
-                        "accion": "catalogo_actualizado",
-                        "tabla": "estado_incidente"
-                    }
+                    "accion": "catalogo_actualizado",
+                    "tabla": "estado_incidente"
                 }
             )
 
@@ -132,36 +143,132 @@ def estado_incidente_api(request):
 
 # ---------------- INCIDENTES ----------------
 
+def pide_pagina(params):
+    # sin ?cursor= ni ?limite= el listado sigue siendo la lista de siempre
+    return "cursor" in params or "limite" in params
+
+
+def lista_incidentes(request):
+    '''
+    Lista completa (sin sobre), como antes de paginar, con los mismos
+    filtros y campos que pagina_incidentes.
+    '''
+    seleccion = leer_seleccion(request.GET)
+    qs = filtrar_incidentes(incidentes_qs(seleccion=seleccion), request.GET)
+
+    return IncidenteSerializer(
+        qs.order_by("-fecha_creacion", "-id"),
+        many=True,
+        context={"request": request},
+        seleccion=seleccion
+    ).data
+
+
+def pagina_incidentes(request):
+    '''
+    {"resultados", "siguiente"} para ?cursor=&limite=, ?fields=/?omit= y
+    los filtros de filtrar_incidentes. ValueError si algún parámetro no
+    es válido.
+    '''
+    seleccion = leer_seleccion(request.GET)
+    qs = filtrar_incidentes(incidentes_qs(seleccion=seleccion), request.GET)
+
+    filas, siguiente = paginar_keyset(
+        qs,
+        request.GET.get("cursor"),
+        leer_limite(request.GET.get("limite"))
+    )
+
+    return {
+        "resultados": IncidenteSerializer(
+            filas,
+            many=True,
+            context={"request": request},
+            seleccion=seleccion
+        ).data,
+        "siguiente": siguiente
+    }
+
+
+def filtrar_incidentes(qs, params):
+    '''
+    Filtros del listado. ValueError con el mensaje para el cliente si
+    algún valor no es válido.
+    '''
+    for campo in ["estado", "severidad", "tipo"]:
+        if params.get(campo):
+            qs = qs.filter(**{f"{campo}_id__in": leer_ids(params[campo], campo)})
+
+    rescatista = params.get("rescatista")
+    if rescatista == "ninguno":
+        qs = qs.filter(rescatista__isnull=True)
+    elif rescatista:
+        qs = qs.filter(rescatista_id__in=leer_ids(rescatista, "rescatista"))
+
+    activo = params.get("activo")
+    if activo:
+        if activo.lower() not in ["true", "false", "1", "0"]:
+            raise ValueError("activo inválido")
+        qs = qs.filter(activo=activo.lower() in ["true", "1"])
+
+    # rango por días locales, como límites de fecha_creacion (usa el índice)
+    desde = leer_fecha(params.get("desde"), "desde")
+    hasta = leer_fecha(params.get("hasta") or params.get("fecha"), "hasta")
+
+    if desde:
+        qs = qs.filter(fecha_creacion__gte=inicio_dia(desde))
+
+    qs = qs.filter(
+        fecha_creacion__lt=inicio_dia((hasta or timezone.localdate()) + timedelta(days=1))
+    )
+
+    return qs
+
+
+def leer_ids(valor, campo):
+    try:
+        return [int(x) for x in valor.split(",") if x.strip()]
+    except ValueError:
+        raise ValueError(f"{campo} inválido")
+
+
+def leer_fecha(valor, campo):
+    if not valor:
+        return None
+    try:
+        return date.fromisoformat(valor)
+    except ValueError:
+        raise ValueError(f"{campo} inválido (YYYY-MM-DD)")
+
+
+def inicio_dia(dia):
+    return timezone.make_aware(datetime.combine(dia, datetime.min.time()))
+
+
 @api_view(["GET", "POST"])
 @permission_classes([IsAuthenticated, IsAdminOrOperador])
 @parser_classes([MultiPartParser, FormParser])
+@con_etag(
+    "incidente", "asignacion", "usuario",
+    "tipo_incidente", "severidad", "estado_incidente"
+)
+@presupuesto_consultas(1)
 def incidentes_api(request):
 
     # ================= GET =================
+    # ?cursor=&limite= (keyset sobre fecha_creacion, id; más nuevos primero)
+    # devuelve {"resultados", "siguiente"}; sin ellos, la lista completa
+    # filtros: estado, severidad, tipo (ids, separados por coma), activo,
+    # rescatista (id o "ninguno"), desde / hasta (YYYY-MM-DD; "fecha" = hasta)
+    # campos: ?fields=a,b / ?omit=c (id y version van siempre)
     if request.method == "GET":
 
-        hoy = timezone.now().date()
-
-        # todos (activos + inactivos) pero <= hoy
-        fecha = request.GET.get("fecha")
-
-        qs = Incidente.all_objects.all()
-
-        if fecha:
-            qs = qs.filter(fecha_creacion__date__lte=fecha)
-        else:
-            qs = qs.filter(
-                fecha_creacion__date__lte=timezone.now().date()
-            )
-
-
-        return Response(
-            IncidenteSerializer(
-                qs,
-                many=True,
-                context={"request": request}
-            ).data
-        )
+        try:
+            if pide_pagina(request.GET):
+                return Response(pagina_incidentes(request))
+            return Response(lista_incidentes(request))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
 
 
     # ================= POST =================
@@ -187,42 +294,47 @@ def incidentes_api(request):
                 activo=True
             )
 
-            # 🔔 realtime
-            channel_layer = get_channel_layer()
-
-            for grupo in ["rol_operador", "rol_admin"]:
-                async_to_sync(channel_layer.group_send)(
-                    grupo,
-                    {
-                        "type": "enviar_evento",
-                        "data": {
-                            "accion": "incidente_update"
-                        }
-                    }
-                )
+            # releído con sus relaciones: una consulta para serializar
+            incidente = incidentes_qs().get(pk=incidente.pk)
 
-            return Response(
-                IncidenteSerializer(
-                    incidente,
-                    context={"request": request}
-                ).data,
-                status=201
+            data = IncidenteSerializer(
+                incidente,
+                context={"request": request}
+            ).data
+
+            # 🔔 realtime (delta con el incidente ya serializado)
+            enviar_incidentes(
+                [incidente],
+                evento_incidente(incidente, data),
+                ["rol_operador", "rol_admin"]
             )
 
+            return Response(data, status=201)
+
         return Response(ser.errors, status=400)
 
 
 @api_view(["GET", "PUT", "PATCH", "DELETE"])
 @permission_classes([IsAuthenticated, IsAdminOrOperador])
+@presupuesto_consultas(1)
 def incidente_detalle_api(request, pk):
 
+    # ?fields= / ?omit= solo en lectura
+    seleccion = leer_seleccion(request.GET) if request.method == "GET" else None
+
     try:
-        inc = Incidente.objects.get(pk=pk)
+        inc = incidentes_qs(Incidente.objects, seleccion).get(pk=pk)
     except Incidente.DoesNotExist:
         return Response({"detail": "No existe"}, status=404)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
 
     if request.method == "GET":
-        return Response(IncidenteSerializer(inc, context={"request": request}).data)
+        return Response(IncidenteSerializer(
+            inc,
+            context={"request": request},
+            seleccion=seleccion
+        ).data)
 
     if request.method in ["PUT", "PATCH"]:
 
@@ -237,29 +349,22 @@ def incidente_detalle_api(request, pk):
         )
 
         if ser.is_valid():
-            ser.save()
+            inc = ser.save()
+
+            enviar_incidentes([inc], evento_incidente(inc, ser.data))
+
             return Response(ser.data)
 
         return Response(ser.errors, status=400)
 
     if request.method == "DELETE":
 
-        # 🔥 liberar antes de borrar
-        liberar_recursos_incidente(inc)
-
-        inc.soft_delete()
+        # 🔥 liberar antes de borrar, en la misma transacción
+        with transaction.atomic():
+            liberar_incidentes([inc.pk])
+            inc.soft_delete()
 
-        channel_layer = get_channel_layer()
-        for grupo in ["rol_admin", "rol_operador", "rol_rescatista", "rol_auditor"]:
-            async_to_sync(channel_layer.group_send)(
-                grupo,
-                {
-                    "type":"enviar_evento",
-                    "data":{
-                        "accion":"incidente_update"
-                    }
-                }
-            )
+        enviar_incidentes([inc], evento_incidente_borrado(inc))
 
         return Response(status=204)
 
@@ -281,53 +386,184 @@ def cambiar_estado(request, pk):
     except:
         return Response({"error":"Estado inválido"}, status=400)
 
-    inc.estado_id = nuevo_estado
-    inc.save()
+    # desde la caché: valida el id y el serializer no vuelve a consultarlo
+    estado = catalogo(EstadoIncidente).por_id(nuevo_estado)
+    if estado is None:
+        return Response({"error":"Estado inválido"}, status=400)
+
+    estado_cerrado = catalogo(EstadoIncidente).por_nombre("Cerrado")
 
+    with transaction.atomic():
 
-    estado_cerrado = EstadoIncidente.objects.filter(
-        nombre__iexact="Cerrado"
-    ).first()
+        inc.estado = estado
+        inc.save()
 
-    if estado_cerrado and nuevo_estado == estado_cerrado.id:
-        liberar_recursos_incidente(inc)
+        if estado_cerrado and nuevo_estado == estado_cerrado.id:
+            liberar_incidentes([inc.pk])
 
+        # historial automático
+        HistorialIncidente.objects.create(
+            incidente=inc,
+            estado=inc.estado,
+            usuario=request.user,
+            observacion="Cambio de estado"
+        )
 
     # 🔔 EVENTO TIEMPO REAL (todos)
-    channel_layer = get_channel_layer()
+    # releído después del commit: recursos_asignados ya sin los liberados
+    inc = incidentes_qs().get(pk=inc.pk)
+    data = IncidenteSerializer(inc, context={"request": request}).data
+    enviar_incidentes([inc], evento_incidente(inc, data))
 
-    for grupo in ["rol_admin", "rol_operador", "rol_rescatista", "rol_auditor"]:
-        async_to_sync(channel_layer.group_send)(
-            grupo,
-            {
-                "type": "enviar_evento",
-                "data": {
-                    "accion": "incidente_update"
-                }
-            }
+    return Response({"ok": "estado actualizado"})
+
+
+# ---------------- CARGA MASIVA ----------------
+# Feeds de centrales de llamadas: NDJSON (application/x-ndjson) o CSV
+# (text/csv), o ?formato=ndjson|csv. El cuerpo se lee en streaming, nunca
+# entero en memoria (ver ingesta.py). Un evento "lote" por cada lote
+# insertado, no uno por incidente.
+
+FORMATOS_INGESTA = {
+    "ndjson": filas_ndjson,
+    "jsonl": filas_ndjson,
+    "csv": filas_csv,
+}
+
+
+@api_view(["POST"])
+@permission_classes([IsAuthenticated, IsAdminOrOperador])
+def ingesta_incidentes(request):
+
+    formato = (request.GET.get("formato") or "").lower()
+    if not formato:
+        tipo = request.content_type or ""
+        formato = "csv" if "csv" in tipo else "ndjson" if "ndjson" in tipo or "jsonl" in tipo else ""
+
+    filas = FORMATOS_INGESTA.get(formato)
+    if filas is None:
+        return Response(
+            {"error": "Formato no soportado: usa NDJSON o CSV"},
+            status=415
         )
 
+    contexto = {"request": request}
 
-    # historial automático
-    HistorialIncidente.objects.create(
-        incidente=inc,
-        estado=inc.estado,
-        usuario=request.user,
-        observacion="Cambio de estado"
-    )
+    def publicar(creados):
+        for inc in creados:
+            inc.recursos_activos = 0
 
-    return Response({"ok": "estado actualizado"})
+        datos = IncidenteSerializer(creados, many=True, context=contexto).data
+
+        # 🔔 un evento por lote; nadie sigue aún a estos incidentes por
+        # su grupo, basta con los roles (como en el alta individual)
+        enviar_ws(
+            ["rol_operador", "rol_admin"],
+            evento_lote([evento_incidente(inc, d) for inc, d in zip(creados, datos)])
+        )
+
+    # request._request: el cuerpo crudo, sin pasar por los parsers de DRF
+    resumen = ingerir(filas(lineas(request._request)), request.user, publicar)
+
+    if resumen["creados"]:
+        return Response(resumen, status=201)
+
+    return Response(resumen, status=400 if resumen["errores"] else 200)
+
+
+# ---------------- CIERRE MASIVO ----------------
+# Fin de un evento grande: cierra muchos incidentes con un número fijo de
+# sentencias (estado + versión, recursos, historial, índice de búsqueda)
+# y un solo evento "lote" para todos.
+
+LOTE_MAXIMO = 1000
+
+
+@api_view(["POST"])
+@permission_classes([IsAuthenticated, IsAdminOrOperador])
+def cerrar_incidentes(request):
+    '''
+    Body: {"ids": [1, 2, 3], "observacion": "..."}
+    '''
+    # solo una lista: "12" no puede acabar cerrando el 1 y el 2
+    if not isinstance(request.data.get("ids"), list):
+        return Response({"error": "ids debe ser una lista"}, status=400)
+
+    ids = leer_ids_recursos(request.data["ids"])
+
+    if not ids:
+        return Response({"error": "ids requeridos"}, status=400)
+
+    if len(ids) > LOTE_MAXIMO:
+        return Response({"error": f"Máximo {LOTE_MAXIMO} incidentes por lote"}, status=400)
+
+    estado_cerrado = catalogo(EstadoIncidente).por_nombre("Cerrado")
+    if estado_cerrado is None:
+        return Response({"error": "No existe el estado Cerrado"}, status=409)
+
+    with transaction.atomic():
+
+        # activos y no cerrados ya; los bloquea hasta el commit
+        cerrar = list(
+            Incidente.objects
+            .select_for_update()
+            .filter(id__in=ids)
+            .exclude(estado=estado_cerrado)
+            .values_list("id", flat=True)
+        )
+
+        if cerrar:
+            Incidente.objects.filter(id__in=cerrar).update(
+                estado=estado_cerrado,
+                version=F("version") + 1
+            )
+
+            liberar_incidentes(cerrar)
+
+            HistorialIncidente.objects.bulk_create([
+                HistorialIncidente(
+                    incidente_id=id_,
+                    estado=estado_cerrado,
+                    usuario=request.user,
+                    observacion=request.data.get("observacion") or "Cierre masivo"
+                )
+                for id_ in cerrar
+            ])
+
+            # .update() no pasa por las señales
+            tocar_versiones("incidente")
+            indexar_incidentes(cerrar)
+
+    if cerrar:
+        # 🔔 un solo evento para todo el lote
+        incs = list(incidentes_qs().filter(id__in=cerrar))
+        ser = serializar_con(IncidenteSerializer, context={"request": request})
+        enviar_incidentes(
+            incs,
+            evento_lote([evento_incidente(inc, ser(inc)) for inc in incs])
+        )
+
+    return Response({
+        "cerrados": sorted(cerrar),
+        "ignorados": sorted(ids - set(cerrar))
+    })
 
 
 # ---------------- RECURSOS ----------------
 # ✅ GET también para operador (para consultas). POST sigue siendo solo admin.
 @api_view(["GET", "POST"])
 @permission_classes([IsAuthenticated, IsAdminOrOperador])
+@con_etag("recurso", "tipo_recurso", "estado_recurso")
+@presupuesto_consultas(1)
 def recursos_api(request):
 
     if request.method == "GET":
-        qs = Recurso.objects.all()
-        return Response(RecursoSerializer(qs, many=True).data)
+        seleccion = leer_seleccion(request.GET)
+        try:
+            qs = recursos_qs(seleccion=seleccion)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+        return Response(RecursoSerializer(qs, many=True, seleccion=seleccion).data)
 
     if request.method == "POST":
         if request.auth["role"] != "admin":
@@ -370,10 +606,192 @@ def recurso_detalle(request, pk):
 
 @api_view(["GET"])
 @permission_classes([IsAuthenticated, IsOperador])
+@presupuesto_consultas(1)
 def recursos_disponibles(request):
 
-    qs = Recurso.objects.filter(estado__nombre__iexact="Disponible")
-    return Response(RecursoSerializer(qs, many=True).data)
+    seleccion = leer_seleccion(request.GET)
+    try:
+        qs = recursos_disponibles_qs(seleccion)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+    return Response(RecursoSerializer(qs, many=True, seleccion=seleccion).data)
+
+
+# ---------------- POSICIÓN Y CERCANÍA ----------------
+# Los recursos reportan su posición; la recomendación sale del índice en
+# memoria (cercania.py), la base solo aporta las k filas a devolver.
+
+K_MAXIMO = 50
+
+
+@api_view(["POST"])
+@permission_classes([IsAuthenticated, IsOperadorOrRescatista])
+def posicion_recurso(request, pk):
+    '''
+    Body: {"latitud": -0.18, "longitud": -78.46}
+    '''
+    ser = PosicionRecursoSerializer(data=request.data)
+    if not ser.is_valid():
+        return Response(ser.errors, status=400)
+
+    try:
+        obj = Recurso.objects.get(pk=pk)
+    except Recurso.DoesNotExist:
+        return Response(status=404)
+
+    obj.latitud = round(ser.validated_data["latitud"], 6)
+    obj.longitud = round(ser.validated_data["longitud"], 6)
+    obj.fecha_posicion = timezone.now()
+    obj.save(update_fields=["latitud", "longitud", "fecha_posicion"])
+
+    return Response({
+        "id": obj.id,
+        "latitud": obj.latitud,
+        "longitud": obj.longitud,
+        "fecha_posicion": obj.fecha_posicion
+    })
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated, IsAdminOrOperador])
+@presupuesto_consultas(2)
+def recursos_cercanos(request, pk):
+    '''
+    ?tipo=<TipoRecurso>&k=5[&radio_km=20] (+ ?fields= / ?omit=): los k
+    recursos Disponibles de ese tipo más cercanos al incidente, del más
+    cercano al más lejano, con distancia_km.
+    '''
+    tipo = catalogo(TipoRecurso).por_id(request.GET.get("tipo"))
+    if tipo is None:
+        return Response({"error": "tipo requerido"}, status=400)
+
+    try:
+        k = min(K_MAXIMO, max(1, int(request.GET.get("k") or 5)))
+        radio_km = request.GET.get("radio_km")
+        radio_km = float(radio_km) if radio_km else None
+    except ValueError:
+        return Response({"error": "k / radio_km inválidos"}, status=400)
+
+    seleccion = leer_seleccion(request.GET)
+    try:
+        qs = recursos_qs(seleccion=seleccion)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+
+    try:
+        inc = Incidente.objects.only("latitud", "longitud").get(pk=pk)
+    except Incidente.DoesNotExist:
+        return Response({"detail":"Incidente no encontrado"}, status=404)
+
+    estado_disponible, _ = estados()
+    if estado_disponible is None:
+        return Response({"error": "No existe el estado Disponible"}, status=409)
+
+    vecinos = cercanos(inc.latitud, inc.longitud, tipo.id, estado_disponible.id, k, radio_km)
+
+    # la base confirma: si el índice va un instante por detrás, se omite
+    por_id = qs.filter(estado=estado_disponible).in_bulk([id_ for _, id_ in vecinos]) if vecinos else {}
+
+    vecinos = [(distancia, id_) for distancia, id_ in vecinos if id_ in por_id]
+    recursos = RecursoSerializer(
+        [por_id[id_] for _, id_ in vecinos],
+        many=True,
+        seleccion=seleccion
+    ).data
+
+    for data, (distancia, _) in zip(recursos, vecinos):
+        data["distancia_km"] = round(distancia, 3)
+
+    return Response({
+        "incidente": inc.id,
+        "tipo": tipo.id,
+        "recursos": recursos
+    })
+
+
+# ---------------- BÚSQUEDA ----------------
+# ?q=texto&pagina=1&limite=50 (+ ?fields= / ?omit=): incidentes activos
+# por relevancia (descripción, tipo y estado), ver busqueda.py
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated, IsAdminOrOperador])
+@presupuesto_consultas(2)
+def buscar_incidentes(request):
+
+    try:
+        pagina = max(1, int(request.GET.get("pagina") or 1))
+    except ValueError:
+        return Response({"error": "pagina inválida"}, status=400)
+
+    limite = leer_limite(request.GET.get("limite"))
+    seleccion = leer_seleccion(request.GET)
+
+    try:
+        qs = incidentes_qs(Incidente.objects, seleccion)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+
+    # una fila de más dice si hay otra página
+    ids = buscar_ids(request.GET.get("q"), limite + 1, (pagina - 1) * limite)
+    hay_mas = len(ids) > limite
+    ids = ids[:limite]
+
+    # en el orden del ranking
+    por_id = qs.in_bulk(ids) if ids else {}
+    filas = [por_id[i] for i in ids if i in por_id]
+
+    return Response({
+        "resultados": IncidenteSerializer(
+            filas,
+            many=True,
+            context={"request": request},
+            seleccion=seleccion
+        ).data,
+        "siguiente": pagina + 1 if hay_mas else None
+    })
+
+
+# ---------------- SNAPSHOT OPERADOR ----------------
+# Todo lo que la pantalla del operador necesita al abrir, en una sola
+# petición: catálogos, primera página de incidentes (mismos filtros y
+# ?limite= que /incidentes/), recursos disponibles y la secuencia de
+# eventos desde la que el socket debe continuar (?since=seq).
+#
+# Incidentes y recursos salen de una sola foto de la base, tomada después
+# de leer la secuencia. Los catálogos vienen de la caché del proceso, que
+# puede ir por detrás del aviso de invalidación; un cambio de catálogo
+# también llega por el socket (catalogo_actualizado).
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated, IsAdminOrOperador])
+@presupuesto_consultas(2)
+def snapshot_operador(request):
+
+    try:
+        with lectura_consistente():
+
+            # la secuencia se lee ANTES que los datos (antes de la foto):
+            # un evento con seq <= esta ya está en la lectura; uno posterior
+            # puede repetirse al reanudar y el cliente lo descarta por versión
+            seq = seq_actual()
+
+            incidentes = pagina_incidentes(request)
+            disponibles = RecursoSerializer(recursos_disponibles_qs(), many=True).data
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+
+    return Response({
+        "seq": seq,
+        "catalogos": {
+            "tipos_incidente": TipoIncidenteSerializer(catalogo(TipoIncidente).todos(), many=True).data,
+            "severidades": SeveridadSerializer(catalogo(Severidad).todos(), many=True).data,
+            "estados_incidente": EstadoIncidenteSerializer(catalogo(EstadoIncidente).todos(), many=True).data,
+            "tipos_recurso": TipoRecursoSerializer(catalogo(TipoRecurso).todos(), many=True).data,
+            "estados_recurso": EstadoRecursoSerializer(catalogo(EstadoRecurso).todos(), many=True).data,
+        },
+        "incidentes": incidentes,
+        "recursos_disponibles": disponibles
+    })
 
 
 # ---------------- ASIGNACIÓN (legacy) ----------------
@@ -386,18 +804,19 @@ def asignar_recurso(request):
 
     if ser.is_valid():
 
-        asignacion = ser.save()
+        # una sola asignación activa por recurso (índice único parcial)
+        try:
+            with transaction.atomic():
+                asignacion = ser.save()
+        except IntegrityError:
+            return Response({"error":"El recurso ya está asignado"}, status=409)
 
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            "rol_rescatista",
+        enviar_ws(
+            ["rol_rescatista"],
             {
-                "type": "enviar_evento",
-                "data": {
-                    "accion": "recurso_asignado",
-                    "incidente": asignacion.incidente.id,
-                    "recurso": asignacion.recurso.nombre
-                }
+                "accion": "recurso_asignado",
+                "incidente": asignacion.incidente.id,
+                "recurso": asignacion.recurso.nombre
             }
         )
 
@@ -409,6 +828,7 @@ def asignar_recurso(request):
 # ---------------- MODAL ASIGNACIÓN: DATOS ----------------
 @api_view(["GET"])
 @permission_classes([IsAuthenticated, IsAdminOrOperador])
+@presupuesto_consultas(5)
 def asignaciones_incidente_api(request, pk):
     '''
     Devuelve todo lo necesario para el modal:
@@ -438,7 +858,7 @@ def asignaciones_incidente_api(request, pk):
     ]
 
     # 2) Tipos de recurso (filtro)
-    tipos = TipoRecurso.objects.all()
+    tipos = catalogo(TipoRecurso).todos()
     tipos_data = TipoRecursoSerializer(tipos, many=True).data
 
     # 3) Recursos asignados (activos) para este incidente
@@ -447,7 +867,7 @@ def asignaciones_incidente_api(request, pk):
     asignados_data = RecursoSerializer(asignados_recursos, many=True).data
 
     # 4) Disponibles
-    disponibles_qs = Recurso.objects.filter(estado__nombre__iexact="Disponible")
+    disponibles_qs = recursos_disponibles_qs()
     disponibles_data = RecursoSerializer(disponibles_qs, many=True).data
 
     return Response({
@@ -461,6 +881,18 @@ def asignaciones_incidente_api(request, pk):
 
 
 # ---------------- GUARDAR ASIGNACIÓN (rescatista + recursos) ----------------
+
+def leer_ids_recursos(valores):
+    # ids no numéricos se ignoran, como antes
+    ids = set()
+    for valor in valores or []:
+        try:
+            ids.add(int(valor))
+        except (TypeError, ValueError):
+            continue
+    return ids
+
+
 @api_view(["POST"])
 @permission_classes([IsAuthenticated, IsOperador])
 def asignar_recursos(request, pk):
@@ -471,90 +903,59 @@ def asignar_recursos(request, pk):
       "asignar": [1,2,3],
       "desasignar": [4,5]
     }
-    '''
 
-    try:
-        inc = Incidente.objects.get(pk=pk)
-    except Incidente.DoesNotExist:
-        return Response({"detail":"Incidente no encontrado"}, status=404)
+    Respuesta: el diff efectivo (asignaciones.aplicar_asignacion)
+    {
+      "ok": "asignación actualizada",
+      "asignados": [1,2],
+      "desasignados": [4],
+      "conflictos": [{"recurso": 3, "motivo": "no_existe" | "no_disponible" | "ocupado"}]
+    }
+    Los ids de desasignar que no están asignados a este incidente no se
+    tocan ni se informan.
+    '''
 
     rescatista_id = request.data.get("rescatista")
-    asignar = request.data.get("asignar") or []
-    desasignar = request.data.get("desasignar") or []
+    asignar = leer_ids_recursos(request.data.get("asignar"))
+    desasignar = leer_ids_recursos(request.data.get("desasignar"))
 
-    # ✅ set rescatista (opcional)
     if rescatista_id in [None, "", "null"]:
-        inc.rescatista = None
-        inc.save(update_fields=["rescatista"])
+        rescatista_id = None
     else:
         try:
-            inc.rescatista_id = int(rescatista_id)
-            inc.save(update_fields=["rescatista"])
-        except Exception:
+            rescatista_id = int(rescatista_id)
+        except (TypeError, ValueError):
             return Response({"error":"rescatista inválido"}, status=400)
 
-    # estados de recurso (por nombre, fallback por id si ya lo tenías)
-    estado_disponible = EstadoRecurso.objects.filter(nombre__iexact="Disponible").first()
-    estado_asignado = EstadoRecurso.objects.filter(nombre__iexact="Asignado").first()
-
-    # fallback si tus IDs están fijos
-    if not estado_disponible:
-        estado_disponible = EstadoRecurso.objects.filter(id=1).first()
-    if not estado_asignado:
-        estado_asignado = EstadoRecurso.objects.filter(id=2).first()
-
-    # 1) Asignar nuevos recursos
-    for rid in asignar:
-        try:
-            rid_int = int(rid)
-        except Exception:
-            continue
-
-        if Asignacion.objects.filter(incidente=inc, recurso_id=rid_int, activo=True).exists():
-            continue
-
-        Asignacion.objects.create(incidente=inc, recurso_id=rid_int)
+        if not User.objects.filter(pk=rescatista_id).exists():
+            return Response({"error":"rescatista inválido"}, status=400)
 
-        if estado_asignado:
-            Recurso.objects.filter(id=rid_int).update(estado=estado_asignado)
+    # todo o nada: rescatista y recursos en la misma transacción
+    with transaction.atomic():
 
-    # 2) Desasignar recursos
-    for rid in desasignar:
         try:
-            rid_int = int(rid)
-        except Exception:
-            continue
-
-        # buscamos el último registro aunque esté soft-delete
-        asig = Asignacion.all_objects.filter(
-            incidente=inc,
-            recurso_id=rid_int
-        ).order_by("-id").first()
-
-        if asig:
-            asig.soft_delete()
+            # dos asignaciones simultáneas al mismo incidente van en fila
+            inc = Incidente.objects.select_for_update().get(pk=pk)
+        except Incidente.DoesNotExist:
+            return Response({"detail":"Incidente no encontrado"}, status=404)
 
-        if estado_disponible:
-            Recurso.objects.filter(
-                id=rid_int
-            ).update(estado=estado_disponible)
+        # ✅ set rescatista (opcional); también sube la versión del incidente
+        inc.rescatista_id = rescatista_id
+        inc.save(update_fields=["rescatista"])
 
+        diff = aplicar_asignacion(inc, asignar, desasignar)
 
     # 🔔 Evento tiempo real (rescatista + admin + operador)
-    channel_layer = get_channel_layer()
-    for grupo in ["rol_rescatista", "rol_admin", "rol_operador"]:
-        async_to_sync(channel_layer.group_send)(
-            grupo,
-            {
-                "type":"enviar_evento",
-                "data":{
-                    "accion":"incidente_update"
-                }
-            }
-        )
+    inc = incidentes_qs().get(pk=inc.pk)
+    data = IncidenteSerializer(inc, context={"request": request}).data
+    enviar_incidentes(
+        [inc],
+        evento_incidente(inc, data),
+        ["rol_rescatista", "rol_admin", "rol_operador"]
+    )
 
 
-    return Response({"ok":"asignación actualizada"})
+    return Response({"ok":"asignación actualizada", **diff})
 
 
 # ---------------- AUDITOR ----------------
@@ -638,10 +1039,11 @@ def estado_incidente_detalle(request, pk):
 # ---------------- TIPO RECURSO ----------------
 @api_view(["GET", "POST"])
 @permission_classes([IsAuthenticated, IsAdminOrOperador])
+@con_etag("tipo_recurso")
 def tipo_recurso_api(request):
 
     if request.method == "GET":
-        qs = TipoRecurso.objects.all()
+        qs = catalogo(TipoRecurso).todos()
         return Response(TipoRecursoSerializer(qs, many=True).data)
 
     if request.method == "POST":
@@ -654,10 +1056,11 @@ def tipo_recurso_api(request):
 
 @api_view(["GET", "POST"])
 @permission_classes([IsAuthenticated, IsAdmin])
+@con_etag("estado_recurso")
 def estado_recurso_api(request):
 
     if request.method == "GET":
-        qs = EstadoRecurso.objects.all()
+        qs = catalogo(EstadoRecurso).todos()
         return Response(EstadoRecursoSerializer(qs, many=True).data)
 
     if request.method == "POST":
@@ -734,32 +1137,6 @@ def estado_recurso_detalle(request, pk):
             return Response({"error":"No se puede eliminar porque está en uso"}, status=409)
 
 
-def liberar_recursos_incidente(inc):
-    # estado disponible
-    estado_disponible = EstadoRecurso.objects.filter(
-        nombre__iexact="Disponible"
-    ).first()
-
-    if not estado_disponible:
-        estado_disponible = EstadoRecurso.objects.filter(id=1).first()
-
-    # buscar asignaciones activas
-    asignaciones = Asignacion.objects.filter(
-        incidente=inc,
-        activo=True
-    )
-
-    for a in asignaciones:
-        # soft delete asignación
-        a.soft_delete()
-
-        # liberar recurso
-        if estado_disponible:
-            Recurso.objects.filter(id=a.recurso_id).update(
-                estado=estado_disponible
-            )
-
-
 @api_view(["GET"])
 @permission_classes([IsAuthenticated, IsAdminOrOperador])
 def auditoria_incidente(request, pk):
@@ -767,12 +1144,10 @@ def auditoria_incidente(request, pk):
     logs = AuditoriaAccion.objects.filter(
         registro_id=pk,
         tabla="incidente"
-    ).order_by("fecha")
-
-    data = []
+    ).select_related("usuario").order_by("fecha")
 
-    for a in logs:
-        data.append({
+    def fila(a):
+        return {
             "usuario": a.usuario.username if a.usuario else "-",
             "rol": a.rol,
             "accion": a.accion,
@@ -780,19 +1155,45 @@ def auditoria_incidente(request, pk):
             "endpoint": a.endpoint,
             "fecha": a.fecha.strftime("%Y-%m-%d %H:%M:%S"),
             "data": a.data
-        })
+        }
 
-    return Response(data)
+    # 🌊 sin límite de filas: se envía en streaming
+    return respuesta_streaming(request, logs, fila)
 
 
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def incidentes_inactivos(request):
 
-    qs = Incidente.all_objects.filter(is_deleted=True)
+    seleccion = leer_seleccion(request.GET)
+    try:
+        qs = incidentes_qs(Incidente.all_objects.filter(activo=False), seleccion)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+
+    return respuesta_streaming(
+        request, qs, serializar_con(IncidenteSerializer, seleccion=seleccion)
+    )
+
 
-    data = IncidenteSerializer(qs, many=True).data
-    return Response(data)
+@api_view(["GET"])
+@permission_classes([IsAuthenticated, IsAdminOrOperador])
+def exportar_incidentes(request):
+    '''
+    Todos los incidentes que cumplen los filtros de /incidentes/ (sin
+    paginar), más nuevos primero, como un arreglo JSON en streaming.
+    '''
+    seleccion = leer_seleccion(request.GET)
+    try:
+        qs = filtrar_incidentes(incidentes_qs(seleccion=seleccion), request.GET)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+
+    return respuesta_streaming(
+        request,
+        qs.order_by("-fecha_creacion", "-id"),
+        serializar_con(IncidenteSerializer, context={"request": request}, seleccion=seleccion)
+    )
 
 
 
@@ -17,12 +17,14 @@ from channels.routing import ProtocolTypeRouter, URLRouter
 from django.core.asgi import get_asgi_application
 
 import Aplicaciones.incidentes.routing
-from Aplicaciones.incidentes.middleware import JwtAuthMiddleware
+from Aplicaciones.incidentes.middleware import (
+    JwtAuthMiddleware, LoopPrincipalMiddleware
+)
 
-application = ProtocolTypeRouter({
+application = LoopPrincipalMiddleware(ProtocolTypeRouter({
     "http": get_asgi_application(),
     "websocket": JwtAuthMiddleware(
         URLRouter(Aplicaciones.incidentes.routing.websocket_urlpatterns)
     ),
-})
+}))
 
@@ -92,6 +92,10 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # con escrituras concurrentes se espera el lock (en segundos)
+        'OPTIONS': {
+            'timeout': 20,
+        },
     }
 }
 
@@ -147,6 +151,16 @@ REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
         "rest_framework_simplejwt.authentication.JWTAuthentication",
     ),
+    # JSON con ujson (ver Aplicaciones/incidentes/json_rapido.py)
+    "DEFAULT_RENDERER_CLASSES": (
+        "Aplicaciones.incidentes.json_rapido.JSONRapidoRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ),
+    "DEFAULT_PARSER_CLASSES": (
+        "Aplicaciones.incidentes.json_rapido.JSONRapidoParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ),
 }
 
 SIMPLE_JWT = {
@@ -155,18 +169,62 @@ SIMPLE_JWT = {
     "AUTH_HEADER_TYPES": ("Bearer",),
 }
 
+# Tokens ya verificados en el handshake WebSocket (LRU en memoria)
+WS_TOKEN_CACHE_SIZE = 10000
+WS_TOKEN_CACHE_TTL = 300
+
+
+# Caché compartida entre procesos (versiones por tabla para los ETag)
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": "redis://127.0.0.1:6379/1",
+    }
+}
+
 
 ASGI_APPLICATION = "core.asgi.application"
 
 CHANNEL_LAYERS = {
     "default": {
-        "BACKEND": "channels_redis.core.RedisChannelLayer",
+        "BACKEND": "Aplicaciones.incidentes.layers.RedisChannelLayer",
         "CONFIG": {
             "hosts": [("127.0.0.1", 6379)],
+            # eventos que se guardan por grupo para reanudar con ?since=
+            "event_log_size": 500,
+            "event_log_ttl": 86400,
+            # membresía que no se renueva (latido) sale de los grupos
+            "group_expiry": 300,
         },
     },
 }
 
+# Ventana (ms) en la que IncidenteConsumer junta eventos del mismo tipo y
+# clave en un solo frame. 0 desactiva la coalescencia.
+REALTIME_COALESCE_MS = 150
+
+# Incidentes con severidad de este nivel o mayor saltan la ventana
+# (Alta = 3, el nivel más alto del catálogo).
+REALTIME_NIVEL_CRITICO = 3
+
+# Con los subprotocolos *.deflate solo se comprimen frames de este tamaño
+# (bytes) o más; los pequeños crecerían.
+REALTIME_DEFLATE_MIN_BYTES = 256
+
+# Latido de IncidenteConsumer (segundos): ping al cliente y cierre de
+# sockets que no envían nada (ni el pong) en REALTIME_IDLE_TIMEOUT_S.
+REALTIME_PING_S = 25
+REALTIME_IDLE_TIMEOUT_S = 75
+
+# Caché de catálogos en memoria (segundos). Se invalida por el grupo de
+# control al guardar; el TTL solo cubre un aviso perdido.
+CATALOGOS_CACHE_TTL = 300
+
+# Índice de cercanía de recursos (cercania.py): tamaño de celda de la
+# rejilla en grados (0.01 ≈ 1.1 km) y recarga completa de respaldo (s).
+RECURSOS_CELDA_GRADOS = 0.01
+RECURSOS_INDICE_TTL = 300
+
 
 
 LOGIN_URL = '/'